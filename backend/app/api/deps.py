@@ -0,0 +1,16 @@
+from fastapi import Request
+from ..services.database_service import DatabaseService
+from ..services.usage_service import UsageService
+from ..services.job_service import JobService
+
+# Services are built once in the application lifespan (see main.py) and shared by
+# every request, so their Chroma client, HTTP pools and caches are reused.
+
+def get_database_service(request: Request) -> DatabaseService:
+    return request.app.state.database_service
+
+def get_usage_service(request: Request) -> UsageService:
+    return request.app.state.usage_service
+
+def get_job_service(request: Request) -> JobService:
+    return request.app.state.job_service
@@ -6,60 +6,294 @@ import os
 import secrets
 from pathlib import Path
 from datetime import datetime
-from ....services.database_service import DatabaseService
+from ....services.database_service import DatabaseService, DatabaseBusyError, QueryTimeoutError, QUERY_MODES
 from ....services.usage_service import UsageService
+from ....services.job_service import JobService, JobQueueFullError
+from ....services.file_service import FileTooLargeError
+from ....services.query_filters import QueryFilters, InvalidFilterError, parse_filters
+from ....services.embedding_cache import get_embedding_cache
+from ....services.embedding_dispatcher import get_embedding_dispatcher
+from ....services.query_cache import get_query_embedding_cache, get_query_result_cache
+from ....services.diversify import Diversification
+from ....services.index_params import IndexParams, resolve_index_params
+from ....services import reranker
 from ....core.config import get_settings
+from ...deps import get_database_service, get_usage_service, get_job_service
 
 router = APIRouter()
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+def _check_query_mode(mode: str):
+    if mode not in QUERY_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"mode must be one of: {', '.join(QUERY_MODES)}"
+        )
+
+def _parse_filters(filters: Optional[str]) -> QueryFilters:
+    try:
+        return parse_filters(filters)
+    except InvalidFilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _parse_diversification(mmr_lambda: Optional[float], max_per_source: Optional[int]) -> Diversification:
+    diversification = Diversification(mmr_lambda, max_per_source)
+    try:
+        diversification.validate()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return diversification
+
+def _check_search_ef(search_ef: Optional[int]):
+    if search_ef is not None and search_ef < 1:
+        raise HTTPException(status_code=400, detail="search_ef must be a positive integer")
+
+def _parse_index_params(
+    preset: Optional[str],
+    space: Optional[str],
+    M: Optional[int],
+    construction_ef: Optional[int],
+    search_ef: Optional[int]
+) -> IndexParams:
+    try:
+        return resolve_index_params(preset, space, M, construction_ef, search_ef)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/create")
 async def create_database(
     name: str = Form(...),
     files: List[UploadFile] = File(...),
     description: str = Form(...),
     sector: str = Form(...),
-    model: str = Form("text-embedding-ada-002"),
+    model: str = Form("text-embedding-ada-002"),  # OpenAI model, or "local/<name>" for in-process embeddings
     chunk_size: int = Form(512),
-    user_id: str = Form(None)  # Make it optional for now
+    user_id: str = Form(None),  # Make it optional for now
+    deduplicate: bool = Form(False),  # Drop exact and near-duplicate chunks before embedding
+    file_metadata: str = Form(None),  # JSON: {"<filename>": {"<key>": <scalar>}} stored on every chunk
+    quantize: bool = Form(False),  # Product-quantized codes in RAM, full-precision vectors on disk
+    dimensions: int = Form(None),  # Reduced width for text-embedding-3 (or local) models, e.g. 512
+    index_preset: str = Form(None),  # fast, balanced (default) or high-recall
+    space: str = Form(None),  # l2, ip or cosine; the remaining fields override the preset
+    hnsw_m: int = Form(None),
+    construction_ef: int = Form(None),
+    search_ef: int = Form(None),
+    database_service: DatabaseService = Depends(get_database_service)
 ):
     """Create a new vector database from uploaded files"""
+    index_params = _parse_index_params(index_preset, space, hnsw_m, construction_ef, search_ef)
     try:
         logger.info(f"Creating database with name: {name}, sector: {sector}")
-        database_service = DatabaseService()
-        database_id = await database_service.create_database(
+        created = await database_service.create_database(
             name=name,
             files=files,
             description=description,
             sector=sector,
             model=model,
             chunk_size=chunk_size,
-            user_id=user_id
+            user_id=user_id,
+            deduplicate=deduplicate,
+            file_metadata=file_metadata,
+            quantize=quantize,
+            dimensions=dimensions,
+            index_params=index_params
         )
-        return {"database_id": database_id, "status": "processing"}
+        return {
+            "database_id": created["database_id"],
+            "job_id": created["job_id"],
+            "status": "processing"
+        }
     
+    except FileTooLargeError as e:
+        logger.warning(f"Rejecting database creation: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        # Invalid file metadata or an unsupported embedding dimensionality
+        logger.warning(f"Rejecting database creation: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFullError as e:
+        logger.warning(f"Rejecting database creation: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error creating database: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/{database_id}/documents")
+async def append_documents(
+    database_id: str,
+    files: List[UploadFile] = File(...),
+    user_id: str = Form(None),
+    file_metadata: str = Form(None),  # JSON: {"<filename>": {"<key>": <scalar>}} stored on every chunk
+    database_service: DatabaseService = Depends(get_database_service)
+):
+    """Add or replace files in an existing database, embedding only new chunks"""
+    try:
+        db_info = database_service.get_database_info(database_id)
+        if not db_info:
+            raise HTTPException(
+                status_code=404,
+                detail="Database not found"
+            )
+        
+        if db_info["status"] != "completed":
+            raise HTTPException(
+                status_code=400,
+                detail="Database is not ready for new documents"
+            )
+        
+        appended = await database_service.append_documents(
+            database_id=database_id,
+            files=files,
+            user_id=user_id,
+            file_metadata=file_metadata
+        )
+        return {
+            "database_id": appended["database_id"],
+            "job_id": appended["job_id"],
+            "status": "processing"
+        }
+    
+    except HTTPException:
+        raise
+    except FileTooLargeError as e:
+        logger.warning(f"Rejecting documents for {database_id}: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidFilterError as e:
+        logger.warning(f"Rejecting documents for {database_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFullError as e:
+        logger.warning(f"Rejecting documents for {database_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except DatabaseBusyError as e:
+        logger.warning(f"Rejecting documents for {database_id}: {str(e)}")
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error appending documents: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{database_id}/status")
-async def get_database_status(database_id: str):
+async def get_database_status(
+    database_id: str,
+    database_service: DatabaseService = Depends(get_database_service),
+    job_service: JobService = Depends(get_job_service)
+):
     """Get the current status of database processing"""
     try:
-        database_service = DatabaseService()
         status = database_service.get_database_status(database_id)
-        return {"status": status}
+        
+        # Attach ingestion progress when the database was built by a job
+        job = None
+        db_info = database_service.get_database_info(database_id)
+        if db_info and db_info.get("job_id"):
+            job = job_service.get_job(db_info["job_id"])
+        
+        # Set when an append was cut short by a restart, until the files are appended again
+        append_interrupted = db_info.get("append_interrupted") if db_info else None
+        return {"status": status, "job": job, "append_interrupted": append_interrupted}
     
     except Exception as e:
         logger.error(f"Error getting database status: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/{database_id}/storage")
+async def get_database_storage(
+    database_id: str,
+    database_service: DatabaseService = Depends(get_database_service)
+):
+    """Get the search engine of a database and the size, memory reduction and recall@k of its index"""
+    db_info = database_service.get_database_info(database_id)
+    if not db_info:
+        raise HTTPException(status_code=404, detail="Database not found")
+    return {
+        "search_engine": db_info.get("search_engine"),
+        "exact_index": db_info.get("exact_index"),
+        "quantized_index": db_info.get("quantized_index")
+    }
+
+@router.post("/{database_id}/pin")
+def pin_database(
+    database_id: str,
+    pinned: bool = Form(True),
+    database_service: DatabaseService = Depends(get_database_service)
+):
+    """Keep a database's indexes loaded regardless of the memory budget, or release the pin"""
+    # A plain def: FastAPI runs it on its thread pool while the indexes load
+    try:
+        found = database_service.pin_database(database_id, pinned)
+    except Exception as e:
+        logger.error(f"Error pinning database: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not found:
+        raise HTTPException(status_code=404, detail="Database not found")
+    return {"database_id": database_id, "pinned": pinned}
+
+@router.get("/collections/stats")
+async def get_collection_stats(database_service: DatabaseService = Depends(get_database_service)):
+    """Get the memory budget, resident size and load time of every loaded database"""
+    return database_service.collections.stats()
+
+@router.get("/embedding-cache/stats")
+async def get_embedding_cache_stats():
+    """Get hit/miss counters and size of the embedding cache"""
+    cache = get_embedding_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@router.get("/query-embedding-cache/stats")
+async def get_query_embedding_cache_stats():
+    """Get hit/miss counters and size of the in-memory query embedding cache"""
+    cache = get_query_embedding_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@router.get("/query-result-cache/stats")
+async def get_query_result_cache_stats():
+    """Get size of the query result cache and hit ratio and write generation per database"""
+    cache = get_query_result_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@router.get("/reranker/stats")
+async def get_reranker_stats():
+    """Get rerank and skip counters of the cross-encoder reranker, if it has been loaded"""
+    if reranker._reranker is None:
+        return {"loaded": False}
+    return {"loaded": True, **reranker._reranker.stats()}
+
+@router.get("/embedding-dispatcher/stats")
+async def get_embedding_dispatcher_stats():
+    """Get throughput and rate-limit counters of the embedding dispatcher"""
+    return get_embedding_dispatcher().stats()
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, job_service: JobService = Depends(get_job_service)):
+    """Get the status and progress of an ingestion job"""
+    try:
+        job = job_service.get_job(job_id)
+        if not job:
+            raise HTTPException(
+                status_code=404,
+                detail="Job not found"
+            )
+        return job
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting job: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/list")
-async def list_databases(user_id: str = None):
+async def list_databases(
+    user_id: str = None,
+    database_service: DatabaseService = Depends(get_database_service)
+):
     """List all databases or filter by user_id"""
     try:
-        database_service = DatabaseService()
         databases = database_service.list_databases(user_id)
         return databases
     except Exception as e:
@@ -67,10 +301,12 @@ async def list_databases(user_id: str = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{database_id}")
-async def delete_database(database_id: str):
+async def delete_database(
+    database_id: str,
+    database_service: DatabaseService = Depends(get_database_service)
+):
     """Delete a database and its files"""
     try:
-        database_service = DatabaseService()
         await database_service.delete_database(database_id)
         return {"status": "success"}
     
@@ -83,14 +319,22 @@ async def external_query(
     query: str = Form(...),
     api_key: str = Form(...),
     n_results: int = Form(5),
-    model: str = Form("text-embedding-ada-002")
+    model: str = Form(None),  # Defaults to the model the database was built with
+    mode: str = Form("vector"),  # vector, hybrid or lexical
+    filters: str = Form(None),  # JSON filter expression, see query_filters.parse_filters
+    rerank: bool = Form(False),  # Reorder candidates with the cross-encoder reranker
+    mmr_lambda: float = Form(None),  # Diversify with MMR: 1.0 is pure relevance, 0.0 pure novelty
+    max_per_source: int = Form(None),  # At most this many results from one source document
+    search_ef: int = Form(None),  # Wider HNSW candidate list for this request: higher recall, more latency
+    database_service: DatabaseService = Depends(get_database_service),
+    usage_service: UsageService = Depends(get_usage_service)
 ):
     """Query a database using an API key (for external users)"""
+    _check_query_mode(mode)
+    query_filters = _parse_filters(filters)
+    diversification = _parse_diversification(mmr_lambda, max_per_source)
+    _check_search_ef(search_ef)
     try:
-        # Initialize services
-        database_service = DatabaseService()
-        usage_service = UsageService()
-        
         # Get database ID from API key
         database_id = database_service.get_database_id_from_key(api_key)
         if not database_id:
@@ -129,7 +373,12 @@ async def external_query(
             database_id=database_id,
             query=query,
             n_results=n_results,
-            model=model
+            model=model,
+            mode=mode,
+            filters=query_filters,
+            rerank=rerank,
+            diversification=diversification,
+            search_ef=search_ef
         )
         
         # Format response
@@ -140,7 +389,9 @@ async def external_query(
                 {
                     "text": result.get("text", ""),
                     "source": result.get("metadata", {}).get("source", "unknown"),
-                    "score": result.get("distance", 0)
+                    # Distance for vector search, BM25 or fused rank score otherwise
+                    "score": result.get("score", result.get("distance", 0)),
+                    **({"rerank_score": result["rerank_score"]} if "rerank_score" in result else {})
                 }
                 for result in results
             ]
@@ -150,33 +401,145 @@ async def external_query(
         
     except HTTPException:
         raise
+    except QueryTimeoutError as e:
+        logger.warning(f"Error querying database: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error querying database: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/federated/query")
+async def federated_query(
+    query: str = Form(...),
+    database_ids: Optional[List[str]] = Form(None),  # Repeat the field once per database
+    sector: str = Form(None),  # Used with owner when no database_ids are given
+    owner: str = Form(None),
+    n_results: int = Form(5),
+    model: str = Form(None),  # Defaults to the model the databases were built with
+    filters: str = Form(None),  # JSON filter expression, see query_filters.parse_filters
+    database_service: DatabaseService = Depends(get_database_service)
+):
+    """Search several databases with one query and merge the hits into a global top n_results"""
+    if not database_ids and not sector and not owner:
+        raise HTTPException(
+            status_code=400,
+            detail="Provide database_ids or a sector/owner selector"
+        )
+    query_filters = _parse_filters(filters)
+    try:
+        logger.info(f"Federated query over {database_ids or {'sector': sector, 'owner': owner}}")
+        return await database_service.query_federated(
+            query=query,
+            database_ids=database_ids,
+            sector=sector,
+            owner=owner,
+            n_results=n_results,
+            model=model,
+            filters=query_filters
+        )
+    
+    except QueryTimeoutError as e:
+        logger.warning(f"Error running federated query: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except ValueError as e:
+        logger.warning(f"Rejecting federated query: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error running federated query: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/{database_id}/query")
 async def query_database(
     database_id: str,
     query: str = Form(...),
     n_results: int = Form(5),
-    model: str = Form("text-embedding-ada-002")
+    model: str = Form(None),  # Defaults to the model the database was built with
+    mode: str = Form("vector"),  # vector, hybrid or lexical
+    filters: str = Form(None),  # JSON filter expression, see query_filters.parse_filters
+    rerank: bool = Form(False),  # Reorder candidates with the cross-encoder reranker
+    mmr_lambda: float = Form(None),  # Diversify with MMR: 1.0 is pure relevance, 0.0 pure novelty
+    max_per_source: int = Form(None),  # At most this many results from one source document
+    search_ef: int = Form(None),  # Wider HNSW candidate list for this request: higher recall, more latency
+    database_service: DatabaseService = Depends(get_database_service)
 ):
-    """Query a database with semantic search"""
+    """Query a database with semantic, lexical or hybrid search"""
+    _check_query_mode(mode)
+    query_filters = _parse_filters(filters)
+    diversification = _parse_diversification(mmr_lambda, max_per_source)
+    _check_search_ef(search_ef)
     try:
-        logger.info(f"Querying database with model: {model}")  # Log received model
-        database_service = DatabaseService()
+        logger.info(f"Querying database with model: {model}, mode: {mode}")  # Log received model
         results = await database_service.query_database(
             database_id=database_id,
             query=query,
             n_results=n_results,
-            model=model
+            model=model,
+            mode=mode,
+            filters=query_filters,
+            rerank=rerank,
+            diversification=diversification,
+            search_ef=search_ef
         )
         return {"results": results}
     
+    except QueryTimeoutError as e:
+        logger.warning(f"Error querying database: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error querying database: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/{database_id}/query/batch")
+async def query_database_batch(
+    database_id: str,
+    queries: List[str] = Form(...),  # Repeat the field once per query
+    n_results: int = Form(5),
+    model: str = Form(None),  # Defaults to the model the database was built with
+    mode: str = Form("vector"),  # vector, hybrid or lexical
+    filters: str = Form(None),  # JSON filter expression, see query_filters.parse_filters
+    rerank: bool = Form(False),  # Reorder candidates with the cross-encoder reranker
+    mmr_lambda: float = Form(None),  # Diversify with MMR: 1.0 is pure relevance, 0.0 pure novelty
+    max_per_source: int = Form(None),  # At most this many results from one source document
+    search_ef: int = Form(None),  # Wider HNSW candidate list for this request: higher recall, more latency
+    database_service: DatabaseService = Depends(get_database_service)
+):
+    """Query a database with several questions using one embedding call and one vector search"""
+    _check_query_mode(mode)
+    query_filters = _parse_filters(filters)
+    diversification = _parse_diversification(mmr_lambda, max_per_source)
+    _check_search_ef(search_ef)
+    if len(queries) > settings.MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.MAX_BATCH_QUERIES} queries are allowed per batch"
+        )
+    try:
+        logger.info(f"Batch querying database {database_id} with {len(queries)} queries")
+        results = await database_service.query_database_batch(
+            database_id=database_id,
+            queries=queries,
+            n_results=n_results,
+            model=model,
+            mode=mode,
+            filters=query_filters,
+            rerank=rerank,
+            diversification=diversification,
+            search_ef=search_ef
+        )
+        return {
+            "results": [
+                {"query": query, "results": query_results}
+                for query, query_results in zip(queries, results)
+            ]
+        }
+    
+    except QueryTimeoutError as e:
+        logger.warning(f"Error batch querying database: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error batch querying database: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/{database_id}/generate-key")
 async def generate_api_key(database_id: str, user_id: str):
     """Generate a new API key for a database"""
@@ -243,7 +606,10 @@ async def get_api_key(database_id: str, user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/user/{user_id}/api-keys")
-async def get_user_api_keys(user_id: str):
+async def get_user_api_keys(
+    user_id: str,
+    database_service: DatabaseService = Depends(get_database_service)
+):
     """Get all API keys for a user"""
     try:
         print(f"Getting all API keys for user {user_id}")
@@ -263,7 +629,6 @@ async def get_user_api_keys(user_id: str):
         for db_id, db_keys in keys_data.items():
             if user_id in db_keys:
                 # Get database name
-                database_service = DatabaseService()
                 db_info = database_service.get_database_info(db_id)
                 db_name = db_info.get('name', 'Unknown Database') if db_info else 'Unknown Database'
                 
@@ -281,10 +646,12 @@ async def get_user_api_keys(user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/usage/{user_id}")
-async def get_usage(user_id: str):
+async def get_usage(
+    user_id: str,
+    usage_service: UsageService = Depends(get_usage_service)
+):
     """Get usage statistics for a user"""
     try:
-        usage_service = UsageService()
         usage_data = usage_service.get_user_usage(user_id)
         
         if not usage_data:
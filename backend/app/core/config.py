@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from functools import lru_cache
 
 class Settings(BaseSettings):
     # API Settings
@@ -18,21 +19,102 @@ class Settings(BaseSettings):
     
     # Vector DB Settings
     VECTOR_DB_DIR: str = "vector_dbs"
+    CATALOG_PATH: str = "vector_dbs/catalog.sqlite3"  # SQLite catalog of database metadata
+    MAX_BATCH_QUERIES: int = 256  # Queries accepted by one batch query request
+    QUERY_WORKERS: int = 8  # Threads running Chroma searches for queries
+    QUERY_EMBEDDING_TIMEOUT_SECONDS: float = 10.0
+    QUERY_SEARCH_TIMEOUT_SECONDS: float = 10.0
     INTERMEDIATE_DIR: str = "intermediate"  # Directory for intermediate processed files
     EMBEDDING_MODEL: str = "text-embedding-ada-002"  # Default OpenAI embedding model
     
+    # Lexical (BM25) Index Settings
+    LEXICAL_INDEX_ENABLED: bool = True  # Build a BM25 index next to each collection
+    LEXICAL_BM25_K1: float = 1.2
+    LEXICAL_BM25_B: float = 0.75
+    LEXICAL_BUILD_BLOCK_POSTINGS: int = 2000000  # Postings held in memory while building before a block is spilled to disk
+    HYBRID_CANDIDATE_FACTOR: int = 4  # Candidates fetched per ranking, as a multiple of n_results
+    HYBRID_RRF_K: int = 60  # Reciprocal rank fusion constant
+    
+    # Rerank Settings
+    RERANK_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"  # Resolved against LOCAL_EMBEDDING_MODEL_DIR first
+    RERANK_CANDIDATE_FACTOR: int = 4  # Candidates scored per requested result
+    RERANK_BATCH_SIZE: int = 64  # Pairs per forward pass
+    RERANK_LATENCY_BUDGET_MS: float = 300.0  # Skip reranking when it is expected to take longer
+    RERANK_CONCURRENCY: int = 2  # Reranks scored at once; requests beyond this skip reranking
+    RERANK_REPROBE_SECONDS: float = 30.0  # While over budget, rerank one request this often to refresh the estimate
+    
+    # Exact Search Settings
+    EXACT_SEARCH_MAX_CHUNKS: int = 20000  # Collections up to this size are searched brute force; 0 disables
+    EXACT_SEARCH_DTYPE: str = "float32"  # float16 halves the matrix on disk but is converted block by block per query
+    EXACT_INDEX_MAX_DELETED: float = 0.25  # Appends rewrite the exact matrix once rows of deleted chunks reach this fraction of it
+    
+    # Quantized Storage Settings
+    PQ_SUBSPACE_DIMS: int = 16  # Dimensions per product-quantization byte (1536 dims -> 96 bytes)
+    PQ_TRAINING_SAMPLE: int = 10000  # Vectors sampled to train the codebooks
+    PQ_ITERATIONS: int = 8  # k-means iterations per subspace
+    QUANTIZED_RESCORE_FACTOR: int = 8  # Candidates rescored at full precision per requested result
+    QUANTIZED_RECALL_K: int = 10  # k of the recall@k measured after every build
+    QUANTIZED_RECALL_SAMPLE: int = 5000  # Stored vectors the recall@k estimate searches, whatever the collection size
+    PQ_IVF_MIN_VECTORS: int = 100000  # Quantized indexes this large are partitioned so searches scan only the nearest lists
+    PQ_IVF_PROBE: int = 16  # Coarse lists scanned per query, more when they hold too few candidates
+    PQ_RETRAIN_GROWTH: float = 2.0  # Appends reuse the codebooks until the collection grows by this factor since training
+    
+    # Collection Residency Settings
+    COLLECTION_MEMORY_BUDGET_BYTES: int = 4 * 1024 * 1024 * 1024  # Index bytes kept loaded across databases; 0 disables eviction
+    COLLECTION_PRELOAD_ENABLED: bool = True  # Load pinned and most-queried databases in the background at startup
+    COLLECTION_PRELOAD_MAX_DATABASES: int = 32  # Most-queried databases considered for preloading
+    
+    # Diversification Settings
+    DIVERSITY_CANDIDATE_FACTOR: int = 4  # Candidates considered by MMR / per-source grouping per requested result
+    
+    # Ingestion Job Settings
+    JOBS_DIR: str = "jobs"  # Directory for persisted ingestion job records
+    INGESTION_WORKERS: int = 2  # Databases built concurrently
+    INGESTION_QUEUE_SIZE: int = 16  # Jobs allowed to wait for a free worker
+    INGESTION_QUEUE_BATCHES: int = 4  # Batches buffered between pipeline stages
+    EMBEDDING_BATCH_SIZE: int = 256  # Max inputs per embedding request
+    EMBEDDING_BATCH_TOKENS: int = 300000  # Max tokens per embedding request (OpenAI per-request limit)
+    CHROMA_WRITE_BATCH_SIZE: int = 1000  # Vectors per collection write
+    DEDUP_MAX_HAMMING_DISTANCE: int = 5  # SimHash bits two chunks may differ by and still count as duplicates
+    
+    # Embedding Cache Settings
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = "embedding_cache/embeddings.sqlite3"
+    EMBEDDING_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # 2GB of float32 vectors
+    
+    # Query Embedding Cache Settings (in memory, 0 disables)
+    QUERY_EMBEDDING_CACHE_SIZE: int = 10000
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS: float = 24 * 60 * 60
+    
+    # Query Result Cache Settings (in memory, 0 disables)
+    QUERY_RESULT_CACHE_SIZE: int = 10000
+    QUERY_RESULT_CACHE_TTL_SECONDS: float = 60 * 60
+    
     # OpenAI Settings
     OPENAI_API_KEY: str = ""  # This will be overridden by env var
+    EMBEDDING_CONCURRENCY: int = 4  # Embedding requests in flight per process
+    EMBEDDING_REQUESTS_PER_MINUTE: int = 3000
+    EMBEDDING_TOKENS_PER_MINUTE: int = 1000000
+    EMBEDDING_MAX_RETRIES: int = 6  # Retries for 429/5xx/connection errors
+    EMBEDDING_BACKOFF_BASE: float = 0.5  # Seconds, doubled per retry before jitter
+    EMBEDDING_BACKOFF_MAX: float = 30.0
+    
+    # Local Embedding Settings (models named "local/<name>")
+    LOCAL_EMBEDDING_MODEL_DIR: str = "models"  # Checked for <name> before downloading from the hub
+    LOCAL_EMBEDDING_BATCH_SIZE: int = 64  # Texts per forward pass
+    LOCAL_EMBEDDING_MAX_INPUT_WORDS: int = 256  # Longer chunks are split before embedding
+    HASHING_EMBEDDING_DIMENSION: int = 384  # Dimension of the dependency-free "local/hashing" model
     
     class Config:
         env_file = ".env"
         case_sensitive = True
 
+@lru_cache()
 def get_settings() -> Settings:
     settings = Settings()
     
     # Create necessary directories
-    for dir_path in [settings.UPLOAD_DIR, settings.VECTOR_DB_DIR, settings.INTERMEDIATE_DIR]:
+    for dir_path in [settings.UPLOAD_DIR, settings.VECTOR_DB_DIR, settings.INTERMEDIATE_DIR, settings.JOBS_DIR]:
         Path(dir_path).mkdir(parents=True, exist_ok=True)
     
     return settings
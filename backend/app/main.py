@@ -1,8 +1,12 @@
 from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 from .core.config import get_settings
 from .api.v1.api import api_router
+from .services.database_service import DatabaseService
+from .services.usage_service import UsageService
 
 # Configure logging
 logging.basicConfig(
@@ -14,10 +18,40 @@ logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build process-wide services once; endpoints receive them through Depends"""
+    database_service = DatabaseService()
+    app.state.database_service = database_service
+    app.state.job_service = database_service.job_service
+    app.state.usage_service = UsageService()
+    
+    # Jobs that were queued or running when the process stopped will never finish
+    for job in database_service.job_service.fail_interrupted_jobs():
+        logger.warning(f"Marking interrupted job {job['id']} as failed")
+        if job.get("kind") == "append":
+            # The database keeps serving; its indexes are rebuilt to cover the chunks written
+            # before the restart, and it is flagged until the files are appended again
+            if database_service.recover_interrupted_append(job):
+                asyncio.get_running_loop().run_in_executor(None, database_service.rebuild_indexes, job["database_id"])
+            continue
+        database_service.update_database_metadata(job["database_id"], {
+            "status": "error",
+            "error_message": "Processing interrupted by server restart"
+        })
+    
+    # Load pinned and most-queried databases without delaying startup
+    asyncio.get_running_loop().run_in_executor(
+        None, database_service.preload_collections, app.state.usage_service.database_query_counts()
+    )
+    
+    yield
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -0,0 +1,136 @@
+from typing import List, Dict, Any, Optional, Tuple
+import json
+import sqlite3
+import threading
+import logging
+from pathlib import Path
+from ..core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Metadata fields mirrored into indexed columns
+_COLUMNS = {"owner": "created_by", "sector": "sector", "status": "status", "created_at": "created_at"}
+
+
+class DatabaseCatalog:
+    """
+    SQLite catalog with one row per database. The full metadata document is stored as JSON.
+    Owner, sector and status are mirrored into indexed columns, so listings and selectors are
+    answered by one query instead of reading every database directory. In WAL mode a listing
+    reads while an ingestion job writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS databases (
+                id TEXT PRIMARY KEY,
+                owner TEXT,
+                sector TEXT,
+                status TEXT,
+                created_at TEXT,
+                metadata TEXT NOT NULL
+            )"""
+        )
+        for column in ("owner", "sector", "status"):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_databases_{column} ON databases ({column})")
+        self._conn.commit()
+
+    @staticmethod
+    def _row(database_id: str, metadata: Dict[str, Any]) -> Tuple:
+        return (database_id, *(metadata.get(field) for field in _COLUMNS.values()), json.dumps(metadata))
+
+    def _write(self, database_id: str, metadata: Dict[str, Any]):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO databases (id, owner, sector, status, created_at, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+            self._row(database_id, metadata)
+        )
+
+    def put(self, database_id: str, metadata: Dict[str, Any]):
+        """Insert or replace a database's metadata"""
+        with self._lock:
+            self._write(database_id, metadata)
+            self._conn.commit()
+
+    def get(self, database_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT metadata FROM databases WHERE id = ?", (database_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, database_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Merge updates into a database's metadata in one transaction; None if it is not catalogued"""
+        with self._lock:
+            row = self._conn.execute("SELECT metadata FROM databases WHERE id = ?", (database_id,)).fetchone()
+            if row is None:
+                return None
+            metadata = {**json.loads(row[0]), **updates}
+            self._write(database_id, metadata)
+            self._conn.commit()
+        return metadata
+
+    def delete(self, database_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM databases WHERE id = ?", (database_id,))
+            self._conn.commit()
+
+    def list(
+        self,
+        owner: Optional[str] = None,
+        sector: Optional[str] = None,
+        status: Optional[str] = None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """(id, metadata) of the databases matching every given column, oldest first"""
+        filters = {"owner": owner, "sector": sector, "status": status}
+        clauses = [f"{column} = ?" for column, value in filters.items() if value]
+        params = [value for value in filters.values() if value]
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, metadata FROM databases{where} ORDER BY created_at, id", params
+            ).fetchall()
+        return [(database_id, json.loads(metadata)) for database_id, metadata in rows]
+
+    def migrate(self, vector_db_path: Path) -> int:
+        """
+        Import the metadata.json of every database directory missing from the catalog. The files
+        are left in place. Returns the number of databases imported.
+        """
+        with self._lock:
+            known = {row[0] for row in self._conn.execute("SELECT id FROM databases")}
+        imported = []
+        for db_dir in vector_db_path.iterdir():
+            metadata_path = db_dir / "metadata.json"
+            if db_dir.name in known or db_dir.name.startswith('.') or not metadata_path.is_file():
+                continue
+            try:
+                with open(metadata_path, "r") as f:
+                    imported.append((db_dir.name, json.load(f)))
+            except Exception as e:
+                logger.error(f"Error reading metadata for {db_dir.name}: {e}")
+        if imported:
+            with self._lock:
+                for database_id, metadata in imported:
+                    self._write(database_id, metadata)
+                self._conn.commit()
+            logger.info(f"Migrated {len(imported)} databases from metadata.json into {self.path}")
+        return len(imported)
+
+
+_catalog: Optional[DatabaseCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_database_catalog() -> DatabaseCatalog:
+    """Return the process-wide catalog, importing legacy database directories when it is first opened"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = DatabaseCatalog(settings.CATALOG_PATH)
+            _catalog.migrate(Path(settings.VECTOR_DB_DIR))
+        return _catalog
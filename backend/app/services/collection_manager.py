@@ -0,0 +1,169 @@
+from typing import Callable, Dict, Any, List, Iterable, Optional
+from collections import OrderedDict
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionManager:
+    """
+    Memory-budgeted LRU of the databases whose search indexes are loaded in this process.
+    A database is loaded on its first query, and the load is timed. Once the resident bytes
+    exceed budget_bytes, the least recently queried unpinned databases are unloaded.
+    Pinned databases are never evicted, even when they alone exceed the budget.
+
+    size measures what unload frees. HNSW segments live in Chroma's own cache, which unload
+    cannot release; hnsw_size measures them separately, and they are reported under
+    hnsw_cache ("chroma_lru" when Chroma bounds them, otherwise "unmanaged") rather than
+    counted as resident bytes that an eviction frees.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], None],
+        unload: Callable[[str], None],
+        size: Callable[[str], int],
+        budget_bytes: int,
+        hnsw_size: Optional[Callable[[str], int]] = None,
+        hnsw_cache: str = "unmanaged"
+    ):
+        self._load = load
+        self._unload = unload
+        self._size = size
+        self._hnsw_size = hnsw_size
+        self.budget_bytes = budget_bytes  # 0 disables eviction
+        self.hnsw_cache = hnsw_cache
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pinned = set()
+        self._hnsw: Dict[str, int] = {}  # HNSW bytes loaded into Chroma per database, still held after eviction
+        self._lock = threading.Lock()
+
+    def touch(self, database_id: str):
+        """Mark a database as just queried, loading it first if it is not resident"""
+        with self._lock:
+            entry = self._entries.get(database_id)
+            if entry is not None:
+                self._entries.move_to_end(database_id)
+                entry["queries"] += 1
+                self.hits += 1
+                return
+        self._load_entry(database_id, preloaded=False)
+
+    def _load_entry(self, database_id: str, preloaded: bool):
+        # Loading runs outside the lock so a slow load never blocks queries on resident databases
+        started = time.perf_counter()
+        self._load(database_id)
+        load_seconds = time.perf_counter() - started
+        size = self._size(database_id)
+        hnsw_bytes = self._hnsw_size(database_id) if self._hnsw_size else 0
+        with self._lock:
+            if hnsw_bytes:
+                self._hnsw[database_id] = hnsw_bytes
+            if database_id in self._entries:
+                # Another query loaded it concurrently
+                self._entries.move_to_end(database_id)
+                return
+            self._entries[database_id] = {
+                "bytes": size,
+                "hnsw_bytes": hnsw_bytes,
+                "load_seconds": load_seconds,
+                "loaded_at": datetime.now(timezone.utc).isoformat(),
+                "queries": 0 if preloaded else 1,
+                "preloaded": preloaded,
+            }
+            self.loads += 1
+            self._evict(keep=database_id)
+        logger.info(f"Loaded {database_id} ({size} bytes) in {load_seconds:.3f}s")
+
+    def _evict(self, keep: str):
+        """Unload least recently used unpinned databases until the budget is met. Caller holds the lock."""
+        if self.budget_bytes <= 0:
+            return
+        resident = sum(entry["bytes"] for entry in self._entries.values())
+        for database_id in list(self._entries):
+            if resident <= self.budget_bytes:
+                break
+            if database_id == keep or database_id in self._pinned:
+                continue
+            resident -= self._entries.pop(database_id)["bytes"]
+            self._unload(database_id)
+            self.evictions += 1
+            logger.info(f"Evicted {database_id} to stay within {self.budget_bytes} bytes")
+
+    def discard(self, database_id: str):
+        """Forget and unload a database whose indexes were rewritten or deleted; its next query reloads it"""
+        with self._lock:
+            self._entries.pop(database_id, None)
+            self._hnsw.pop(database_id, None)
+            self._unload(database_id)
+
+    def pin(self, database_id: str, pinned: bool = True, load: bool = True):
+        """Exempt a database from eviction, loading it right away unless load is False, or make it evictable again"""
+        with self._lock:
+            if not pinned:
+                self._pinned.discard(database_id)
+                self._evict(keep="")
+                return
+            self._pinned.add(database_id)
+            resident = database_id in self._entries
+        if load and not resident:
+            self._load_entry(database_id, preloaded=True)
+
+    def preload(self, pinned: Iterable[str], ranked: List[str]):
+        """
+        Load the pinned databases, then the ranked ones, most used first, while they fit the budget.
+        Databases that do not fit are skipped rather than evicting a more used one. Unmanaged
+        HNSW bytes count towards the fit, since no eviction can release them.
+        """
+        for database_id in pinned:
+            try:
+                self.pin(database_id)
+            except Exception as e:
+                logger.error(f"Error preloading pinned database {database_id}: {str(e)}")
+        for database_id in ranked:
+            with self._lock:
+                if database_id in self._entries:
+                    continue
+                resident = sum(entry["bytes"] for entry in self._entries.values())
+                if self.hnsw_cache == "unmanaged":
+                    resident += sum(self._hnsw.values())
+            try:
+                needed = self._size(database_id)
+                if self._hnsw_size and self.hnsw_cache == "unmanaged":
+                    needed += self._hnsw_size(database_id)
+                if self.budget_bytes > 0 and resident + needed > self.budget_bytes:
+                    continue
+                self._load_entry(database_id, preloaded=True)
+            except Exception as e:
+                logger.error(f"Error preloading database {database_id}: {str(e)}")
+        # Most used last, so they are the last to be evicted
+        with self._lock:
+            for database_id in reversed(ranked):
+                if database_id in self._entries:
+                    self._entries.move_to_end(database_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Budget, counters and the resident databases, most recently used first"""
+        with self._lock:
+            lookups = self.hits + self.loads
+            return {
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": sum(entry["bytes"] for entry in self._entries.values()),
+                "hits": self.hits,
+                "loads": self.loads,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "hnsw_cache": self.hnsw_cache,
+                "hnsw_bytes": sum(self._hnsw.values()),
+                "pinned": sorted(self._pinned),
+                "databases": [
+                    {"database_id": database_id, "pinned": database_id in self._pinned, **entry}
+                    for database_id, entry in reversed(self._entries.items())
+                ],
+            }
@@ -1,27 +1,108 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set, Tuple, Callable, Union, Collection
+import asyncio
+import heapq
+import threading
+import time
 import uuid
 import json
+import shutil
+from functools import partial
 from pathlib import Path
 import logging
 import chromadb
+from chromadb.config import Settings as ChromaSettings
+import numpy as np
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import UploadFile
 from .file_service import FileService
 from .embedding_service import EmbeddingService
+from .embedding_backends import validate_dimensions
+from .job_service import JobService
+from .ingestion_service import IngestionPipeline, ChunkWriter
+from .dedup_service import ChunkDeduplicator, merge_counts, merges_metadata
+from .query_cache import get_query_result_cache
+from .query_filters import QueryFilters, RESERVED_METADATA_KEYS, parse_file_metadata
+from .reranker import get_reranker
+from .diversify import Diversification, select_diverse, rank_relevance
+from .index_params import IndexParams, resolve_index_params
+from .lexical_index import (
+    LexicalIndex, INDEX_FILENAME, load_lexical_index, unload_lexical_index, write_lexical_index, reciprocal_rank_fusion
+)
+from .exact_index import ExactIndex, load_exact_index, unload_exact_index, index_bytes as exact_index_bytes, INDEX_FILENAME as EXACT_INDEX_FILENAME
+from .quantized_index import QuantizedIndex, load_quantized_index, unload_quantized_index, INDEX_FILENAME as QUANTIZED_INDEX_FILENAME
+from .collection_manager import CollectionManager
+from .catalog import get_database_catalog
 from ..core.config import get_settings
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Chroma calls on the query path are synchronous; they run on this bounded pool
+# so a slow search never blocks the event loop serving other requests.
+_query_executor = ThreadPoolExecutor(
+    max_workers=settings.QUERY_WORKERS,
+    thread_name_prefix="chroma-query"
+)
+
+
+# vector: embedding similarity, lexical: BM25 over the inverted index, hybrid: both fused with RRF
+QUERY_MODES = ("vector", "hybrid", "lexical")
+
+_lexical_build_lock = threading.Lock()
+_exact_build_lock = threading.Lock()
+_exact_checked = set()  # Databases whose search engine has been settled in this process
+_appending = set()  # Databases with an append job queued or running in this process
+_appending_lock = threading.Lock()
+
+
+class QueryTimeoutError(Exception):
+    """Raised when a stage of a query takes longer than its timeout"""
+
+
+class DatabaseBusyError(Exception):
+    """Raised when a database already has an append job queued or running"""
+
+
+def _chroma_settings() -> ChromaSettings:
+    """
+    Ask Chroma to keep HNSW segments in an LRU bounded by the collection memory budget. Only
+    Chroma's Python segment API honours this; the Rust bindings, its default, size their HNSW
+    cache by open file handles, so there HNSW residency is reported as unmanaged.
+    """
+    if settings.COLLECTION_MEMORY_BUDGET_BYTES <= 0:
+        return ChromaSettings()
+    return ChromaSettings(
+        chroma_segment_cache_policy="LRU",
+        chroma_memory_limit_bytes=settings.COLLECTION_MEMORY_BUDGET_BYTES
+    )
+
+
 class DatabaseService:
     def __init__(self):
         self.file_service = FileService()
         self.embedding_service = EmbeddingService()
-        self.chroma_client = chromadb.PersistentClient(path=settings.VECTOR_DB_DIR)
+        self.job_service = JobService()
+        chroma_settings = _chroma_settings()
+        self.chroma_client = chromadb.PersistentClient(path=settings.VECTOR_DB_DIR, settings=chroma_settings)
+        hnsw_bounded = (
+            chroma_settings.chroma_segment_cache_policy == "LRU"
+            and chroma_settings.chroma_api_impl.endswith(".SegmentAPI")
+        )
+        self.result_cache = get_query_result_cache()
         self.intermediate_dir = Path(settings.INTERMEDIATE_DIR)
         self.intermediate_dir.mkdir(parents=True, exist_ok=True)
         self.vector_db_path = Path("./vector_dbs")
         self.vector_db_path.mkdir(exist_ok=True)
+        self.catalog = get_database_catalog()
+        self.collections = CollectionManager(
+            load=self._load_resident,
+            unload=self._unload_resident,
+            size=self._resident_bytes,
+            budget_bytes=settings.COLLECTION_MEMORY_BUDGET_BYTES,
+            hnsw_size=self._hnsw_bytes,
+            hnsw_cache="chroma_lru" if hnsw_bounded else "unmanaged"
+        )
 
     async def create_database(
         self,
@@ -31,32 +112,48 @@ class DatabaseService:
         sector: str,
         model: str = "text-embedding-ada-002",
         chunk_size: int = 512,
-        user_id: Optional[str] = None
-    ) -> str:
-        """Create a new vector database from uploaded files"""
+        user_id: Optional[str] = None,
+        deduplicate: bool = False,
+        file_metadata: Optional[str] = None,
+        quantize: bool = False,
+        dimensions: Optional[int] = None,
+        index_params: Optional[IndexParams] = None
+    ) -> Dict[str, str]:
+        """
+        Save uploaded files and queue a background job that builds the vector database.
+        file_metadata is a JSON object of custom metadata per filename, attached to every chunk.
+        quantize keeps product-quantized codes in RAM and full-precision vectors on disk.
+        dimensions reduces the model's vectors to that width, for ingestion and queries alike.
+        index_params sets the HNSW metric and graph parameters, the balanced preset by default.
+        """
+        # Local models are loaded to read their width, which must not block the event loop
+        await asyncio.to_thread(validate_dimensions, model, dimensions)
+        index_params = index_params or resolve_index_params()
+        custom_metadata = parse_file_metadata(file_metadata, [file.filename for file in files])
+        # Fail fast when the queue is full, before any upload is written to disk
+        self.job_service.reserve_slot()
+        job = None
+        # Generate unique database ID
+        database_id = str(uuid.uuid4())
         try:
-            # Generate unique database ID
-            database_id = str(uuid.uuid4())
-            
             # Create database directory
             db_path = self.vector_db_path / database_id
             db_path.mkdir(exist_ok=True)
             
-            # Calculate total size of files
-            total_file_size = 0
-            for file in files:
-                content = await file.read()
-                total_file_size += len(content)
-                await file.seek(0)  # Reset file position after reading
-            
             # Create and save metadata
             current_time = datetime.now(timezone.utc).isoformat()
             metadata = {
                 "name": name,
                 "description": description,
                 "sector": sector,
+                "model": model,
+                "dimensions": dimensions,
+                "index_params": index_params._asdict(),
+                "chunk_size": chunk_size,
+                "deduplicate": deduplicate,
+                "quantize": quantize,
                 "file_count": len(files),
-                "total_file_size": total_file_size,  # Initial size of uploaded files
+                "total_file_size": 0,  # Filled in once the uploads are streamed to disk
                 "created_by": user_id,
                 "created_at": current_time,
                 "updated_at": current_time,
@@ -65,83 +162,778 @@ class DatabaseService:
                 "database_size": 0,  # Will be updated after processing
             }
             
-            with open(db_path / "metadata.json", "w") as f:
-                json.dump(metadata, f)
-            
-            # Process and save each file
-            all_chunks = []
-            for file in files:
-                # Save file
-                file_path = await self.file_service.save_file(
-                    file=file,
-                    filename=file.filename,
-                    database_id=database_id
-                )
-                
-                # Extract text
-                text = self.file_service.read_file(file_path)
-                
-                # Chunk text
-                chunks = self.embedding_service.chunk_text(
-                    text=text,
-                    chunk_size=chunk_size
-                )
-                
-                # Add metadata to chunks
-                chunks_with_metadata = [{
-                    'text': chunk,
-                    'metadata': {
-                        'source': file.filename,
-                        'database_id': database_id
-                    }
-                } for chunk in chunks]
-                
-                all_chunks.extend(chunks_with_metadata)
+            self.catalog.put(database_id, metadata)
             
-            # Save intermediate chunks for inspection
-            self._save_intermediate_chunks(database_id, all_chunks)
+            # Persist uploads before returning, the request's temp files go away with it
+            saved_files, file_records = await self._save_uploads(database_id, files, custom_metadata)
             
-            # Create Chroma collection
-            collection = self.chroma_client.create_collection(name=database_id)
+            self.update_database_metadata(database_id, {
+                "total_file_size": sum(record["size"] for record in file_records),
+                "files": file_records
+            })
             
-            # Add documents to collection
-            texts = [chunk['text'] for chunk in all_chunks]
-            metadatas = [chunk['metadata'] for chunk in all_chunks]
+            # Record the job and hand the heavy work to the worker pool
+            job = self.job_service.create_job(database_id, len(files), user_id)
+            self.update_database_metadata(database_id, {"job_id": job["id"]})
+            self.job_service.submit(job["id"], partial(
+                self._build_database,
+                database_id=database_id,
+                job_id=job["id"],
+                saved_files=saved_files,
+                model=model,
+                chunk_size=chunk_size,
+                deduplicate=deduplicate,
+                chunk_metadata=self._chunk_metadata(file_records),
+                quantize=quantize,
+                dimensions=dimensions,
+                index_params=index_params
+            ))
+            
+            return {"database_id": database_id, "job_id": job["id"]}
+        
+        except Exception as e:
+            # Cleanup on failure
+            logger.error(f"Error creating database: {str(e)}")
+            self.job_service.release_slot()
+            if job:
+                self.job_service.delete_job(job["id"])
+            self.cleanup_database(database_id)
+            raise e
+
+    async def append_documents(
+        self,
+        database_id: str,
+        files: List[UploadFile],
+        user_id: Optional[str] = None,
+        file_metadata: Optional[str] = None
+    ) -> Dict[str, str]:
+        """
+        Queue a job that adds files to an existing database. Files whose name is already
+        in the database replace it: unchanged chunks are kept, only new chunks are embedded
+        and chunks that disappeared from the file are deleted. One append runs per database
+        at a time; the file records are updated once its job succeeds.
+        """
+        custom_metadata = parse_file_metadata(file_metadata, [file.filename for file in files])
+        metadata = self.get_database_info(database_id)
+        if not metadata:
+            raise ValueError(f"Database {database_id} not found")
+        if metadata.get("status") != "completed":
+            raise ValueError("Database is not ready for new documents")
+        # Concurrent appends would each rebuild the indexes from a collection missing the other's chunks
+        with _appending_lock:
+            if database_id in _appending:
+                raise DatabaseBusyError(f"Documents are already being added to database {database_id}")
+            _appending.add(database_id)
+        
+        reserved = submitted = False
+        job = None
+        try:
+            # Fail fast when the queue is full, before any upload is written to disk
+            self.job_service.reserve_slot()
+            reserved = True
+            # Stored files are only replaced once the append has indexed the new versions
+            saved_files, file_records = await self._save_uploads(database_id, files, custom_metadata, staged=True)
+            
+            job = self.job_service.create_job(database_id, len(files), user_id, kind="append")
+            self.update_database_metadata(database_id, {"job_id": job["id"]})
+            self.job_service.submit(job["id"], partial(
+                self._append_documents,
+                database_id=database_id,
+                job_id=job["id"],
+                saved_files=saved_files,
+                file_records=file_records,
+                model=metadata.get("model", settings.EMBEDDING_MODEL),
+                chunk_size=metadata.get("chunk_size", 512),
+                deduplicate=metadata.get("deduplicate", False),
+                chunk_metadata=self._chunk_metadata(file_records),
+                quantize=metadata.get("quantize", False),
+                dimensions=metadata.get("dimensions")
+            ))
+            submitted = True
+        finally:
+            if not submitted:
+                if reserved:
+                    self.job_service.release_slot()
+                if job:
+                    self.job_service.delete_job(job["id"])
+                self.file_service.discard_staged(database_id)
+                with _appending_lock:
+                    _appending.discard(database_id)
+        
+        return {"database_id": database_id, "job_id": job["id"]}
+
+    async def _save_uploads(
+        self,
+        database_id: str,
+        files: List[UploadFile],
+        custom_metadata: Optional[Dict[str, Dict[str, Any]]] = None,
+        staged: bool = False
+    ) -> Tuple[List[Tuple[str, Path]], List[Dict[str, Any]]]:
+        """Stream uploads to disk, returning (filename, path) pairs and size/hash/metadata records"""
+        custom_metadata = custom_metadata or {}
+        uploaded_at = datetime.now(timezone.utc).isoformat()
+        saved_files = []
+        file_records = []
+        for file in files:
+            saved = await self.file_service.save_file(
+                file=file,
+                filename=file.filename,
+                database_id=database_id,
+                staged=staged
+            )
+            saved_files.append((file.filename, saved.path))
+            file_records.append({
+                "filename": file.filename,
+                "size": saved.size,
+                "sha256": saved.sha256,
+                "uploaded_at": uploaded_at,
+                "metadata": custom_metadata.get(file.filename, {})
+            })
+        return saved_files, file_records
+
+    @staticmethod
+    def _chunk_metadata(file_records: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Metadata attached to every chunk of each file, keyed by filename"""
+        return {
+            record["filename"]: {
+                # Epoch seconds, so chunks can be filtered by upload date range
+                "uploaded_at": int(datetime.fromisoformat(record["uploaded_at"]).timestamp()),
+                **record.get("metadata", {})
+            }
+            for record in file_records
+        }
+
+    def _append_documents(
+        self,
+        database_id: str,
+        job_id: str,
+        saved_files: List[Tuple[str, Path]],
+        file_records: List[Dict[str, Any]],
+        model: str,
+        chunk_size: int,
+        deduplicate: bool = False,
+        chunk_metadata: Optional[Dict[str, Dict[str, Any]]] = None,
+        quantize: bool = False,
+        dimensions: Optional[int] = None
+    ):
+        """
+        Embed and upsert new chunks into an existing collection, then record the files.
+        A failed append leaves the database's status, stored files and file records as they were.
+        Runs on an ingestion worker.
+        """
+        try:
+            self._append_chunks(
+                database_id, job_id, saved_files, model, chunk_size, deduplicate, chunk_metadata, quantize, dimensions
+            )
+            self.file_service.commit_staged(database_id, [path for _, path in saved_files])
+            # Uploads with an existing filename replace that file's record
+            metadata = self.get_database_info(database_id) or {}
+            appended = {record["filename"] for record in file_records}
+            records = [record for record in metadata.get("files", []) if record["filename"] not in appended]
+            records.extend(file_records)
+            self.update_database_metadata(database_id, {
+                "files": records,
+                "file_count": len(records),
+                "total_file_size": sum(record["size"] for record in records),
+                "append_interrupted": None
+            })
+        finally:
+            self.file_service.discard_staged(database_id)
+            with _appending_lock:
+                _appending.discard(database_id)
+
+    def recover_interrupted_append(self, job: Dict[str, Any]) -> bool:
+        """
+        Flag a database whose append job was cut short by a restart and hold off new appends
+        until rebuild_indexes has run. Chunks the job had already written are in the collection
+        but not in the lexical or exact index, and files it was replacing may still have stale
+        chunks, so the flag stays until the files are appended again. Returns False if the
+        database no longer exists.
+        """
+        database_id = job["database_id"]
+        if not self.get_database_info(database_id):
+            return False
+        with _appending_lock:
+            _appending.add(database_id)
+        self.file_service.discard_staged(database_id)
+        self.update_database_metadata(database_id, {"append_interrupted": {
+            "job_id": job["id"],
+            "message": "Adding documents was interrupted by a server restart; upload the files again to finish"
+        }})
+        return True
+
+    def rebuild_indexes(self, database_id: str):
+        """
+        Rebuild a database's lexical and exact or quantized indexes from its collection after
+        recover_interrupted_append. Blocking; run in the background.
+        """
+        try:
+            metadata = self.get_database_info(database_id) or {}
+            collection = self.chroma_client.get_collection(name=database_id)
+            self._build_lexical_index(database_id, collection)
+            self._build_exact_index(database_id, collection, metadata.get("quantize", False))
+            self.update_database_metadata(database_id, {"document_count": collection.count()})
+            self._update_database_size(database_id)
+            logger.info(f"Rebuilt indexes of {database_id} after an interrupted append")
+        except Exception as e:
+            logger.error(f"Rebuilding indexes of {database_id} failed: {str(e)}")
+        finally:
+            with _appending_lock:
+                _appending.discard(database_id)
+
+    def _append_chunks(
+        self,
+        database_id: str,
+        job_id: str,
+        saved_files: List[Tuple[str, Path]],
+        model: str,
+        chunk_size: int,
+        deduplicate: bool,
+        chunk_metadata: Optional[Dict[str, Dict[str, Any]]],
+        quantize: bool,
+        dimensions: Optional[int]
+    ):
+        """Upsert the files' new chunks, delete the ones they no longer contain and rebuild the indexes"""
+        collection = self.chroma_client.get_collection(name=database_id)
+        
+        # Chunks currently stored for the files being (re)uploaded
+        sources = [filename for filename, _ in saved_files]
+        previous_ids = set(collection.get(where={"source": {"$in": sources}}, include=[])["ids"])
+        
+        pipeline = IngestionPipeline(
+            file_service=self.file_service,
+            embedding_service=self.embedding_service,
+            job_service=self.job_service,
+            write_batch_size=self._max_write_batch_size()
+        )
+        current_ids = set()
+        deduplicator = None
+        merged_elsewhere: List[str] = []
+        if deduplicate:
+            deduplicator = ChunkDeduplicator()
+            merged_elsewhere = self._seed_deduplicator(collection, deduplicator, sources)
+        pipeline.run(
+            collection=collection,
+            saved_files=saved_files,
+            database_id=database_id,
+            model=model,
+            chunk_size=chunk_size,
+            job_id=job_id,
+            seen_ids=current_ids,
+            deduplicator=deduplicator,
+            file_metadata=chunk_metadata,
+            dimensions=dimensions
+        )
+        # Chunks that were already stored keep their vectors but take the new upload's metadata
+        self._refresh_chunk_metadata(
+            database_id, collection, list(previous_ids & current_ids), chunk_metadata or {}, replaced=sources
+        )
+        if deduplicator:
+            self._record_duplicates(database_id, collection, deduplicator, replaced=sources, stored_ids=merged_elsewhere)
+        
+        # Drop chunks that are no longer part of the replaced files
+        stale_ids = list(previous_ids - current_ids)
+        if deduplicator:
+            handed_over = self._hand_over_merged(database_id, collection, stale_ids, sources)
+            stale_ids = [chunk_id for chunk_id in stale_ids if chunk_id not in handed_over]
+            previous_ids -= handed_over
+        batch_size = self._max_write_batch_size()
+        for i in range(0, len(stale_ids), batch_size):
+            collection.delete(ids=stale_ids[i:i + batch_size])
+        self._invalidate_results(database_id)
+        logger.info(f"Appended to {database_id}: removed {len(stale_ids)} stale chunks")
+        self._build_lexical_index(database_id, collection, sources=sources, removed=previous_ids)
+        self._build_exact_index(database_id, collection, quantize, added=current_ids - previous_ids, removed=stale_ids)
+        
+        self.update_database_metadata(database_id, {"document_count": collection.count()})
+        self._update_database_size(database_id)
+
+    def _build_database(
+        self,
+        database_id: str,
+        job_id: str,
+        saved_files: List[Tuple[str, Path]],
+        model: str,
+        chunk_size: int,
+        deduplicate: bool = False,
+        chunk_metadata: Optional[Dict[str, Dict[str, Any]]] = None,
+        quantize: bool = False,
+        dimensions: Optional[int] = None,
+        index_params: Optional[IndexParams] = None
+    ):
+        """Parse, chunk, embed and index saved files. Runs on an ingestion worker."""
+        try:
+            # Create Chroma collection with the database's HNSW metric and parameters
+            index_params = index_params or resolve_index_params()
+            collection = self.chroma_client.create_collection(
+                name=database_id,
+                metadata=index_params.collection_metadata()
+            )
             logger.info(f"Getting embeddings with model: {model}")
-            embeddings = self.embedding_service.get_embeddings(texts, model)
             
-            collection.add(
-                embeddings=embeddings,
-                documents=texts,
-                metadatas=metadatas,
-                ids=[str(i) for i in range(len(texts))]
+            pipeline = IngestionPipeline(
+                file_service=self.file_service,
+                embedding_service=self.embedding_service,
+                job_service=self.job_service,
+                write_batch_size=self._max_write_batch_size()
             )
             
-            # Update metadata with final document count
+            # Save intermediate chunks for inspection as they are written
+            intermediate_file = self.intermediate_dir / f"{database_id}_chunks.json"
+            deduplicator = ChunkDeduplicator() if deduplicate else None
+            with ChunkWriter(intermediate_file) as chunk_writer:
+                pipeline.run(
+                    collection=collection,
+                    saved_files=saved_files,
+                    database_id=database_id,
+                    model=model,
+                    chunk_size=chunk_size,
+                    job_id=job_id,
+                    chunk_sink=chunk_writer.write,
+                    deduplicator=deduplicator,
+                    file_metadata=chunk_metadata,
+                    dimensions=dimensions
+                )
+            if deduplicator:
+                self._record_duplicates(database_id, collection, deduplicator)
+            self._build_lexical_index(database_id, collection)
+            self._build_exact_index(database_id, collection, quantize)
+            
+            # Update metadata with final document count (repeated chunks share one id)
             self.update_database_metadata(database_id, {
-                "document_count": len(texts),
+                "document_count": collection.count(),
                 "status": "completed"
             })
             
             # Update database size
             self._update_database_size(database_id)
-            
-            return database_id
         
         except Exception as e:
-            # Cleanup on failure
-            logger.error(f"Error creating database: {str(e)}")
-            self.cleanup_database(database_id)
+            logger.error(f"Error building database {database_id}: {str(e)}")
+            try:
+                self.chroma_client.delete_collection(name=database_id)
+            except Exception:
+                pass  # Collection might not exist
+            self._invalidate_results(database_id)
+            self.file_service.cleanup_files(database_id)
+            (self.intermediate_dir / f"{database_id}_chunks.json").unlink(missing_ok=True)
+            self.update_database_metadata(database_id, {
+                "status": "error",
+                "error_message": str(e)
+            })
             raise e
 
-    def _save_intermediate_chunks(self, database_id: str, chunks: List[Dict[str, Any]]):
-        """Save intermediate chunks to file for inspection"""
-        intermediate_file = self.intermediate_dir / f"{database_id}_chunks.json"
-        with open(intermediate_file, 'w') as f:
-            json.dump(chunks, f, indent=2)
+    def _refresh_chunk_metadata(
+        self,
+        database_id: str,
+        collection,
+        ids: List[str],
+        chunk_metadata: Dict[str, Dict[str, Any]],
+        replaced: Collection[str] = ()
+    ):
+        """
+        Replace the per-file metadata of stored chunks, keeping what ingestion recorded. Duplicates
+        they absorbed from replaced sources are forgotten; the append records them again.
+        """
+        batch_size = self._max_write_batch_size()
+        for i in range(0, len(ids), batch_size):
+            stored = collection.get(ids=ids[i:i + batch_size], include=["metadatas"])
+            metadatas = []
+            for metadata in stored["metadatas"]:
+                kept = {key: value for key, value in metadata.items() if key in RESERVED_METADATA_KEYS}
+                kept.update(merges_metadata(merge_counts(metadata, replaced)))
+                metadatas.append({**kept, **chunk_metadata.get(metadata["source"], {})})
+            collection.update(ids=stored["ids"], metadatas=metadatas)
+        if ids:
+            self._invalidate_results(database_id)
+
+    def _hand_over_merged(self, database_id: str, collection, ids: List[str], replaced: List[str]) -> Set[str]:
+        """
+        Of chunks about to be deleted with the replaced sources, keep those that absorbed duplicates
+        from other sources: they are the only stored copy of that text. Each is reassigned to one
+        of those sources, with its file metadata, and keeps its id and vector. Returns their ids.
+        """
+        files = {record["filename"]: record for record in (self.get_database_info(database_id) or {}).get("files", [])}
+        handed_over = set()
+        batch_size = self._max_write_batch_size()
+        for i in range(0, len(ids), batch_size):
+            stored = collection.get(ids=ids[i:i + batch_size], include=["metadatas"])
+            updates, metadatas = [], []
+            for chunk_id, metadata in zip(stored["ids"], stored["metadatas"]):
+                counts = merge_counts(metadata, replaced)
+                if not counts:
+                    continue
+                source = min(counts)
+                counts[source] -= 1
+                file_metadata = self._chunk_metadata([files[source]]).get(source, {}) if source in files else {}
+                # Chroma merges metadata updates, so the replaced file's own keys are set to None
+                kept = {key: value if key in RESERVED_METADATA_KEYS else None for key, value in metadata.items()}
+                updates.append(chunk_id)
+                metadatas.append({
+                    **kept,
+                    **merges_metadata({name: count for name, count in counts.items() if count}),
+                    **file_metadata,
+                    "source": source
+                })
+            if updates:
+                collection.update(ids=updates, metadatas=metadatas)
+                handed_over.update(updates)
+        return handed_over
+
+    def _seed_deduplicator(self, collection, deduplicator: ChunkDeduplicator, sources: List[str]) -> List[str]:
+        """
+        Register the chunks stored for other sources than those being appended, so the append
+        drops duplicates of them too. This reads their text, but embeds nothing. Returns the ids of
+        those chunks that absorbed duplicates from the appended sources, whose merges are recounted.
+        """
+        merged = []
+        batch_size = self._max_write_batch_size()
+        offset = 0
+        while True:
+            page = collection.get(
+                where={"source": {"$nin": sources}}, include=["documents", "metadatas"], limit=batch_size, offset=offset
+            )
+            if not len(page["ids"]):
+                return merged
+            for chunk_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                deduplicator.seed(chunk_id, text)
+                if metadata.get("merged_sources") and set(merge_counts(metadata)) & set(sources):
+                    merged.append(chunk_id)
+            offset += len(page["ids"])
+
+    def _record_duplicates(
+        self,
+        database_id: str,
+        collection,
+        deduplicator: ChunkDeduplicator,
+        replaced: Collection[str] = (),
+        stored_ids: Collection[str] = ()
+    ):
+        """
+        Attach merged sources, with per-source counts, to the chunks that absorbed duplicates and
+        store dedup stats. Merges already stored on a chunk are kept, except those from replaced
+        sources, which this run counted again; stored_ids are chunks to recount even if this run
+        merged nothing into them.
+        """
+        run_counts = deduplicator.merged_counts()
+        ids = list(set(run_counts) | set(stored_ids))
+        batch_size = self._max_write_batch_size()
+        for i in range(0, len(ids), batch_size):
+            stored = collection.get(ids=ids[i:i + batch_size], include=["metadatas"])
+            metadatas = []
+            for chunk_id, metadata in zip(stored["ids"], stored["metadatas"]):
+                counts = merge_counts(metadata, replaced)
+                for source, count in run_counts.get(chunk_id, {}).items():
+                    counts[source] = counts.get(source, 0) + count
+                metadatas.append(merges_metadata(counts))
+            if stored["ids"]:
+                collection.update(ids=stored["ids"], metadatas=metadatas)
+        self._invalidate_results(database_id)
+        
+        stats = deduplicator.stats()
+        logger.info(f"Deduplicated {database_id}: {stats}")
+        self.update_database_metadata(database_id, {"dedup_stats": stats})
+
+    def _build_lexical_index(
+        self,
+        database_id: str,
+        collection,
+        sources: Optional[List[str]] = None,
+        removed: Collection[str] = ()
+    ):
+        """
+        Write the BM25 index stored next to the collection. Given the sources of an append and
+        the ids their chunks had before it, only those sources are re-read and re-tokenized;
+        the rest of the existing index is carried over. Otherwise every chunk is indexed.
+        """
+        if not settings.LEXICAL_INDEX_ENABLED:
+            return
+        path = self.vector_db_path / database_id / INDEX_FILENAME
+        base = load_lexical_index(path) if sources is not None else None
+        where = {"source": {"$in": sources}} if base is not None else None
+        batch_size = self._max_write_batch_size()
+        
+        def documents():
+            offset = 0
+            while True:
+                page = collection.get(where=where, include=["documents"], limit=batch_size, offset=offset)
+                if not page["ids"]:
+                    return
+                yield from zip(page["ids"], page["documents"])
+                offset += len(page["ids"])
+        
+        stats = write_lexical_index(path, documents(), base=base, removed=set(removed))
+        logger.info(f"{'Updated' if base is not None else 'Built'} lexical index for {database_id}: {stats}")
+        self.update_database_metadata(database_id, {"lexical_index": stats})
+        # Hybrid and lexical results depend on the index as well as the collection
+        self._invalidate_results(database_id)
+
+    def _get_lexical_index(self, database_id: str, collection) -> LexicalIndex:
+        """Load a database's BM25 index, building it for databases created before indexing existed"""
+        path = self.vector_db_path / database_id / INDEX_FILENAME
+        index = load_lexical_index(path)
+        if index is None:
+            with _lexical_build_lock:
+                index = load_lexical_index(path)
+                if index is None:
+                    self._build_lexical_index(database_id, collection)
+                    index = load_lexical_index(path)
+        if index is None:
+            raise ValueError(f"Database {database_id} has no lexical index")
+        return index
+
+    def _build_exact_index(
+        self,
+        database_id: str,
+        collection,
+        quantize: bool = False,
+        added: Optional[Collection[str]] = None,
+        removed: Collection[str] = ()
+    ):
+        """
+        Store the collection's vectors as a memory-mapped matrix for brute-force search when it
+        holds at most EXACT_SEARCH_MAX_CHUNKS chunks, and drop the matrix once it grows past that.
+        Quantized databases always keep the matrix, at full precision, for rescoring, and search
+        product-quantized codes of it instead; their memory reduction and recall@k are recorded.
+        Rebuilds keep the codebooks and encode only new vectors until the collection has grown
+        PQ_RETRAIN_GROWTH times past the size they were trained at. An empty quantized database
+        has nothing to train on and is searched exactly until chunks are appended.
+
+        An append passes the ids it added and removed: their rows are written at the end of the
+        matrix and deleted rows are only marked, until they make up EXACT_INDEX_MAX_DELETED of
+        it and the matrix is rewritten from Chroma.
+        """
+        db_path = self.vector_db_path / database_id
+        path = db_path / EXACT_INDEX_FILENAME
+        quantized_path = db_path / QUANTIZED_INDEX_FILENAME
+        count = collection.count()
+        if not quantize and (count > settings.EXACT_SEARCH_MAX_CHUNKS or settings.EXACT_SEARCH_MAX_CHUNKS <= 0):
+            path.unlink(missing_ok=True)
+            quantized_path.unlink(missing_ok=True)
+            self.update_database_metadata(database_id, {"search_engine": "hnsw", "exact_index": None, "quantized_index": None})
+            self._invalidate_results(database_id)
+            return
+        batch_size = self._max_write_batch_size()
+        
+        def pages():
+            offset = 0
+            while True:
+                page = collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+                if not len(page["ids"]):
+                    return
+                yield page["ids"], page["embeddings"]
+                offset += len(page["ids"])
+        
+        def added_pages(ids: List[str]):
+            for i in range(0, len(ids), batch_size):
+                page = collection.get(ids=ids[i:i + batch_size], include=["embeddings"])
+                yield page["ids"], page["embeddings"]
+        
+        space = self._collection_space(collection)
+        previous = QuantizedIndex.read(quantized_path) if quantize and quantized_path.exists() else None
+        dtype = "float32" if quantize else settings.EXACT_SEARCH_DTYPE
+        manifest = ExactIndex.manifest(path) if added is not None and path.exists() else None
+        stored = set() if manifest is None else {chunk_id for chunk_id in manifest["ids"] if chunk_id is not None}
+        removed = stored & set(removed)
+        deleted = 0 if manifest is None else len(manifest["ids"]) - len(stored) + len(removed)
+        appending = (
+            manifest is not None
+            and np.dtype(manifest["dtype"]) == np.dtype(dtype)
+            and deleted < settings.EXACT_INDEX_MAX_DELETED * max(len(manifest["ids"]), 1)
+        )
+        if appending:
+            appended = ExactIndex.append(path, added_pages([chunk_id for chunk_id in added if chunk_id not in stored]), removed)
+            logger.info(f"Appended {appended} rows to the exact index of {database_id}, {len(removed)} marked deleted")
+        else:
+            ExactIndex.write(path, pages(), dtype=dtype)
+        index = load_exact_index(path, space)
+        live = len(index.ids) - index.tombstones
+        if not quantize or not live:
+            quantized_path.unlink(missing_ok=True)
+            logger.info(f"{'Updated' if appending else 'Built'} exact index for {database_id}: {index.stats()}")
+            self.update_database_metadata(database_id, {"search_engine": "exact", "exact_index": index.stats(), "quantized_index": None})
+            self._invalidate_results(database_id)
+            return
+        
+        # An append keeps the codebooks until the collection has outgrown the data they were trained on
+        previous_stats = (self.get_database_info(database_id) or {}).get("quantized_index") or {}
+        trained_vectors = previous_stats.get("trained_vectors", previous_stats.get("vectors", 0))
+        retrain = (
+            previous is None
+            or previous[1].shape[0] * previous[1].shape[2] != index.vectors.shape[1]
+            or live >= trained_vectors * settings.PQ_RETRAIN_GROWTH
+        )
+        if retrain:
+            # Codebooks are trained on a sample; every vector is then encoded block by block
+            codebooks = QuantizedIndex.train(index.vectors)
+            trained_vectors = live
+            previous_ids, previous_codes = [], np.zeros((len(codebooks), 0), dtype=np.uint8)
+            coarse = previous_lists = None
+        else:
+            previous_ids, codebooks, previous_codes, coarse, previous_lists = previous
+        codes, encoded = QuantizedIndex.update_codes(
+            codebooks, previous_ids, previous_codes, index.ids, index.vectors, batch_size
+        )
+        # Large indexes are partitioned, about sqrt(N) lists, so a search scans a fraction of the codes
+        list_ids = previous_ids
+        if coarse is None and live >= settings.PQ_IVF_MIN_VECTORS:
+            coarse = QuantizedIndex.train_coarse(index.vectors, int(np.sqrt(live)))
+            list_ids, previous_lists = [], np.zeros(0, dtype=np.int64)
+        lists = None if coarse is None else QuantizedIndex.update_lists(
+            coarse, list_ids, previous_lists, index.ids, index.vectors, batch_size
+        )
+        QuantizedIndex.write(quantized_path, index.ids, codebooks, codes, coarse, lists)
+        quantized = load_quantized_index(db_path, space)
+        # Chroma still stores every vector in SQLite and builds its HNSW index, so on disk the
+        # codes and the full-precision matrix come on top of two copies rather than replacing them
+        dims = index.vectors.shape[1] if index.vectors.ndim == 2 else 0
+        disk_bytes = {
+            "codes": quantized_path.stat().st_size,
+            "full_precision": exact_index_bytes(path),
+            "chroma_estimate": live * 4 * dims + self._hnsw_segment_bytes(database_id, live, dims),
+        }
+        stats = {
+            **quantized.stats(),
+            "disk_bytes": {**disk_bytes, "total": sum(disk_bytes.values())},
+            "trained_vectors": trained_vectors,
+            "recall_k": settings.QUANTIZED_RECALL_K,
+            "recall": round(quantized.recall(settings.QUANTIZED_RECALL_K), 4)
+        }
+        logger.info(f"{'Built' if retrain else 'Updated'} quantized index for {database_id}, {encoded} vectors encoded: {stats}")
+        self.update_database_metadata(database_id, {"search_engine": "quantized", "exact_index": None, "quantized_index": stats})
+        self._invalidate_results(database_id)
+
+    def _get_vector_index(self, database_id: str, collection) -> Optional[Union[ExactIndex, QuantizedIndex]]:
+        """
+        The database's quantized or exact index, or None if it is searched through HNSW. Databases
+        created before exact search existed are sized up, and indexed if small enough, on first query.
+        """
+        db_path = self.vector_db_path / database_id
+        space = self._collection_space(collection)
+        index = load_quantized_index(db_path, space) or load_exact_index(db_path / EXACT_INDEX_FILENAME, space)
+        if index is not None or database_id in _exact_checked or settings.EXACT_SEARCH_MAX_CHUNKS <= 0:
+            return index
+        with _exact_build_lock:
+            metadata = self.get_database_info(database_id) or {}
+            if "search_engine" not in metadata and metadata.get("status") == "completed":
+                self._build_exact_index(database_id, collection, metadata.get("quantize", False))
+            if metadata.get("status") == "completed":
+                _exact_checked.add(database_id)
+        return load_quantized_index(db_path, space) or load_exact_index(db_path / EXACT_INDEX_FILENAME, space)
+
+    @staticmethod
+    def _collection_space(collection) -> str:
+        """Distance metric of a collection, from its metadata or its HNSW configuration"""
+        space = (collection.metadata or {}).get("hnsw:space")
+        if space is None:
+            configuration = getattr(collection, "configuration", None) or {}
+            space = (configuration.get("hnsw") or {}).get("space")
+        return space or "l2"
+
+    def _invalidate_results(self, database_id: str):
+        """
+        Bump the database's write generation so no cached result predating the write is served,
+        and unload its indexes so the next query loads and measures the rewritten ones
+        """
+        if self.result_cache:
+            self.result_cache.bump_generation(database_id)
+        self.collections.discard(database_id)
+
+    def _load_resident(self, database_id: str):
+        """
+        Load everything a query on the database reads: its vector index, paged in by computing
+        the row norms, or its HNSW segment, warmed with a one-result query, and its BM25 index.
+        Blocking.
+        """
+        collection = self.chroma_client.get_collection(name=database_id)
+        index = self._get_vector_index(database_id, collection)
+        if isinstance(index, ExactIndex):
+            index.sq_norms()
+        elif index is None:
+            sample = collection.get(limit=1, include=["embeddings"])
+            if len(sample["ids"]):
+                collection.query(query_embeddings=sample["embeddings"][:1], n_results=1, include=[])
+        load_lexical_index(self.vector_db_path / database_id / INDEX_FILENAME)
+
+    def _unload_resident(self, database_id: str):
+        """Drop the database's cached indexes. Chroma keeps HNSW segments in its own cache."""
+        db_path = self.vector_db_path / database_id
+        unload_quantized_index(db_path)
+        unload_exact_index(db_path / EXACT_INDEX_FILENAME)
+        unload_lexical_index(db_path / INDEX_FILENAME)
+
+    def _index_file_size(self, database_id: str, name: str) -> int:
+        path = self.vector_db_path / database_id / name
+        return path.stat().st_size if path.exists() else 0
+
+    def _resident_bytes(self, database_id: str) -> int:
+        """
+        Memory that unloading a database frees: the quantized codes or the exact matrix and the
+        BM25 index, measured by their files
+        """
+        # Quantized searches read only candidate rows of the full-precision matrix
+        vector_size = (
+            self._index_file_size(database_id, QUANTIZED_INDEX_FILENAME)
+            or exact_index_bytes(self.vector_db_path / database_id / EXACT_INDEX_FILENAME)
+        )
+        return self._index_file_size(database_id, INDEX_FILENAME) + vector_size
+
+    def _hnsw_bytes(self, database_id: str) -> int:
+        """
+        Memory of the HNSW segment Chroma loads for a database searched through it, estimated as
+        hnswlib lays it out: vector plus 2 * M links, a link count and a label per chunk
+        """
+        if self._index_file_size(database_id, QUANTIZED_INDEX_FILENAME) or self._index_file_size(database_id, EXACT_INDEX_FILENAME):
+            return 0
+        collection = self.chroma_client.get_collection(name=database_id)
+        sample = collection.get(limit=1, include=["embeddings"])
+        if not len(sample["ids"]):
+            return 0
+        return self._hnsw_segment_bytes(database_id, collection.count(), len(sample["embeddings"][0]))
+
+    def _hnsw_segment_bytes(self, database_id: str, count: int, dims: int) -> int:
+        m = ((self.get_database_info(database_id) or {}).get("index_params") or {}).get("M", 16)
+        return count * (4 * dims + 8 * m + 12)
+
+    def pin_database(self, database_id: str, pinned: bool = True) -> bool:
+        """Keep a database loaded regardless of the memory budget; the pin is stored in its metadata"""
+        if not self.update_database_metadata(database_id, {"pinned": pinned}):
+            return False
+        # Databases still being built are loaded by their first query
+        self.collections.pin(database_id, pinned, load=self.get_database_status(database_id) == "completed")
+        return True
+
+    def preload_collections(self, query_counts: Dict[str, int]):
+        """
+        Load pinned databases, then the most-queried ones that fit the memory budget, so the first
+        queries after a restart do not pay for index loads. Blocking; run in the background.
+        """
+        completed = dict(self.catalog.list(status="completed"))
+        pinned = [database_id for database_id, metadata in completed.items() if metadata.get("pinned")]
+        if not settings.COLLECTION_PRELOAD_ENABLED:
+            for database_id in pinned:
+                self.collections.pin(database_id, load=False)
+            return
+        ranked = sorted(
+            (database_id for database_id in query_counts if database_id in completed),
+            key=lambda database_id: -query_counts[database_id]
+        )[:settings.COLLECTION_PRELOAD_MAX_DATABASES]
+        started = time.perf_counter()
+        self.collections.preload(pinned, ranked)
+        logger.info(f"Preloaded collections in {time.perf_counter() - started:.2f}s: {self.collections.stats()['resident_bytes']} bytes resident")
+
+    def _max_write_batch_size(self) -> int:
+        """Largest collection write batch allowed by both our settings and the Chroma client"""
+        get_max_batch_size = getattr(self.chroma_client, "get_max_batch_size", None)
+        if get_max_batch_size is None:
+            return settings.CHROMA_WRITE_BATCH_SIZE
+        return min(settings.CHROMA_WRITE_BATCH_SIZE, get_max_batch_size())
 
     def get_database_status(self, database_id: str) -> str:
         """Get the current status of database processing"""
+        metadata = self.get_database_info(database_id)
+        if metadata and metadata.get("status"):
+            return metadata["status"]
         try:
             collection = self.chroma_client.get_collection(name=database_id)
             return "completed" if collection else "error"
@@ -154,8 +946,10 @@ class DatabaseService:
             # Delete Chroma collection
             try:
                 self.chroma_client.delete_collection(name=database_id)
-            except ValueError:
+            except Exception:
                 pass  # Collection might not exist
+            self._invalidate_results(database_id)
+            self.catalog.delete(database_id)
             
             # Delete uploaded files
             self.file_service.cleanup_files(database_id)
@@ -168,7 +962,7 @@ class DatabaseService:
             # Delete database directory
             db_path = self.vector_db_path / database_id
             if db_path.exists():
-                db_path.rmdir()
+                shutil.rmtree(db_path)
                 
         except Exception as e:
             logger.error(f"Error cleaning up database {database_id}: {str(e)}")
@@ -179,119 +973,553 @@ class DatabaseService:
         database_id: str,
         query: str,
         n_results: int = 5,
-        model: str = "text-embedding-ada-002"
+        model: Optional[str] = None,
+        mode: str = "vector",
+        filters: Optional[QueryFilters] = None,
+        rerank: bool = False,
+        diversification: Optional[Diversification] = None,
+        search_ef: Optional[int] = None
     ) -> List[Dict[str, Any]]:
-        """Query a database with semantic search"""
+        """Query a database with semantic, lexical or hybrid search"""
+        results = await self.query_database_batch(
+            database_id, [query], n_results, model, mode, filters, rerank, diversification, search_ef
+        )
+        return results[0]
+
+    async def query_database_batch(
+        self,
+        database_id: str,
+        queries: List[str],
+        n_results: int = 5,
+        model: Optional[str] = None,
+        mode: str = "vector",
+        filters: Optional[QueryFilters] = None,
+        rerank: bool = False,
+        diversification: Optional[Diversification] = None,
+        search_ef: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Run several searches against one database, returning results per query.
+        Queries missing from the result cache are embedded in one call and searched
+        with one collection query. Lexical mode needs no embedding at all. Filters
+        are applied by Chroma while it searches, not to the returned results. With
+        rerank, RERANK_CANDIDATE_FACTOR * n_results candidates are reordered by a
+        cross-encoder, unless the reranker is busy or over its latency budget. With
+        diversification, DIVERSITY_CANDIDATE_FACTOR * n_results candidates are narrowed
+        down by MMR and/or a per-source cap after any reranking. search_ef widens the
+        HNSW candidate list of this request beyond the database's own search_ef.
+        """
         try:
-            # Get collection
-            collection = self.chroma_client.get_collection(name=database_id)
-            if not collection:
-                raise ValueError(f"Database {database_id} not found")
+            if mode not in QUERY_MODES:
+                raise ValueError(f"Unknown query mode {mode}, expected one of {', '.join(QUERY_MODES)}")
+            if search_ef is not None and search_ef < 1:
+                raise ValueError("search_ef must be a positive integer")
+            diversify = diversification is not None and diversification.enabled
+            if diversify:
+                diversification.validate()
+            
+            # Vectors are only comparable within one embedding model and width
+            model, dimensions = self._resolve_query_model(database_id, model)
+            
+            all_results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+            cache_keys = [None] * len(queries)
+            if self.result_cache:
+                generation = self.result_cache.generation(database_id)
+                for i, query in enumerate(queries):
+                    cache_keys[i] = self.result_cache.make_key(
+                        database_id, generation, query, n_results, model, mode, filters and filters.cache_key(), rerank,
+                        diversification.cache_key() if diversify else None, search_ef
+                    )
+                    all_results[i] = self.result_cache.get(cache_keys[i])
             
-            # Get query embedding
-            query_embedding = self.embedding_service.get_embeddings([query], model)[0]
+            missing = [i for i, results in enumerate(all_results) if results is None]
+            if not missing:
+                return all_results
+            
+            # Get query embeddings
+            query_embeddings = None
+            if mode != "lexical":
+                query_embeddings = await self._with_timeout(
+                    "embedding",
+                    settings.QUERY_EMBEDDING_TIMEOUT_SECONDS,
+                    self.embedding_service.get_query_embeddings([queries[i] for i in missing], model, dimensions)
+                )
+                self._check_dimensions(database_id, dimensions, query_embeddings)
             
             # Query collection
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
-                include=['documents', 'metadatas', 'distances']
+            candidates = n_results
+            if rerank:
+                candidates = max(candidates, n_results * settings.RERANK_CANDIDATE_FACTOR)
+            if diversify:
+                candidates = max(candidates, n_results * settings.DIVERSITY_CANDIDATE_FACTOR)
+            results = await self._with_timeout(
+                "search",
+                settings.QUERY_SEARCH_TIMEOUT_SECONDS,
+                self._run_in_query_executor(
+                    self._search, database_id, [queries[i] for i in missing], query_embeddings, candidates, mode, filters,
+                    search_ef
+                )
             )
             
-            # Format results
-            formatted_results = []
-            for i in range(len(results['documents'][0])):
-                formatted_results.append({
-                    'text': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i]
-                })
+            cacheable = True
+            if rerank:
+                # Diversification picks from every reranked candidate, not just the top n_results
+                reranked = await self._run_in_query_executor(
+                    self._rerank, [queries[i] for i in missing], results, candidates if diversify else n_results
+                )
+                # Results that skipped reranking under load must not be served to later rerank requests
+                cacheable = reranked is not None
+                if reranked is not None:
+                    results = reranked
+            
+            if diversify:
+                # Cosine relevance to the query only describes an unchanged vector ranking
+                relevance_embeddings = query_embeddings if mode == "vector" and not rerank else None
+                results = await self._run_in_query_executor(
+                    self._diversify, database_id, relevance_embeddings, results, n_results, diversification
+                )
+            else:
+                results = [row[:n_results] for row in results]
             
-            return formatted_results
+            for row, i in enumerate(missing):
+                all_results[i] = results[row]
+                if cache_keys[i] and cacheable:
+                    self.result_cache.put(cache_keys[i], results[row])
+            
+            return all_results
         
         except Exception as e:
             logger.error(f"Error querying database {database_id}: {str(e)}")
             raise e
 
-    def list_databases(self, user_id: str = None) -> List[dict]:
+    async def query_federated(
+        self,
+        query: str,
+        database_ids: Optional[List[str]] = None,
+        sector: Optional[str] = None,
+        owner: Optional[str] = None,
+        n_results: int = 5,
+        model: Optional[str] = None,
+        filters: Optional[QueryFilters] = None
+    ) -> Dict[str, Any]:
         """
-        List all databases in the vector_dbs directory.
-        If user_id is provided, filter by user_id in metadata.json
+        Search several databases with one query embedding and merge their hits by distance
+        into a global top n_results. Databases are given by id or selected by sector/owner.
+        A database that fails or times out is reported and left out of the merge.
         """
-        databases = []
+        try:
+            databases = self._select_federated_databases(database_ids, sector, owner, model)
+            if not databases:
+                raise ValueError("No ready databases match the federated query")
+            
+            # Distances are only comparable within one embedding model, width and distance space.
+            # Databases created before index parameters were recorded use Chroma's default l2.
+            models = {
+                (
+                    metadata.get("model") or settings.EMBEDDING_MODEL,
+                    metadata.get("dimensions"),
+                    (metadata.get("index_params") or {}).get("space", "l2")
+                )
+                for metadata in databases.values()
+            }
+            if len(models) > 1:
+                raise ValueError(
+                    "Federated queries need databases built with one embedding model, dimensionality and "
+                    "distance space, got "
+                    + ", ".join(sorted(f"{name} ({dims or 'full'} dimensions, {space})" for name, dims, space in models))
+                )
+            model, dimensions, _ = models.pop()
+            
+            # Databases answered from the result cache need neither the embedding nor a search
+            cached_results: Dict[str, List[Dict[str, Any]]] = {}
+            cache_keys: Dict[str, Any] = {}
+            if self.result_cache:
+                for database_id in databases:
+                    cache_keys[database_id] = self.result_cache.make_key(
+                        database_id, self.result_cache.generation(database_id), query, n_results, model,
+                        filters=filters and filters.cache_key()
+                    )
+                    cached = self.result_cache.get(cache_keys[database_id])
+                    if cached is not None:
+                        cached_results[database_id] = cached
+            
+            # Embed once for every database that has to be searched
+            query_embedding = None
+            if len(cached_results) < len(databases):
+                query_embedding = await self._with_timeout(
+                    "embedding",
+                    settings.QUERY_EMBEDDING_TIMEOUT_SECONDS,
+                    self.embedding_service.get_query_embedding(query, model, dimensions)
+                )
+                self._check_dimensions("federated query", dimensions, [query_embedding])
+            
+            async def search(database_id: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+                started = time.perf_counter()
+                report = {
+                    "database_id": database_id,
+                    "name": databases[database_id].get("name"),
+                    "cached": database_id in cached_results
+                }
+                results = cached_results.get(database_id, [])
+                if not report["cached"]:
+                    try:
+                        raw_results = await self._with_timeout(
+                            "search",
+                            settings.QUERY_SEARCH_TIMEOUT_SECONDS,
+                            self._run_in_query_executor(
+                                self._search_collection, database_id, [query_embedding], n_results, filters
+                            )
+                        )
+                        results = self._format_results(raw_results, 0)
+                        if database_id in cache_keys:
+                            self.result_cache.put(cache_keys[database_id], results)
+                    except Exception as e:
+                        logger.error(f"Federated query failed on database {database_id}: {str(e)}")
+                        report["error"] = str(e)
+                report["result_count"] = len(results)
+                report["latency_ms"] = (time.perf_counter() - started) * 1000
+                return [{**result, "database_id": database_id} for result in results], report
+            
+            # Fan out to every collection in parallel
+            outcomes = await asyncio.gather(*(search(database_id) for database_id in databases))
+            
+            merged = heapq.nsmallest(
+                n_results,
+                (result for results, _ in outcomes for result in results),
+                key=lambda result: result["distance"]
+            )
+            return {
+                "model": model,
+                "results": merged,
+                "databases": [report for _, report in outcomes]
+            }
         
-        # Scan through all directories in vector_dbs
-        for db_dir in self.vector_db_path.iterdir():
-            if not db_dir.is_dir() or db_dir.name.startswith('.'):
-                continue
-                
-            # Read metadata.json if it exists
-            metadata_path = db_dir / "metadata.json"
-            if not metadata_path.exists():
-                continue
+        except Exception as e:
+            logger.error(f"Error running federated query: {str(e)}")
+            raise e
 
-            try:
-                with open(metadata_path, "r") as f:
-                    metadata = json.load(f)
-            except Exception as e:
-                logger.error(f"Error reading metadata for {db_dir.name}: {e}")
+    def _select_federated_databases(
+        self,
+        database_ids: Optional[List[str]],
+        sector: Optional[str],
+        owner: Optional[str],
+        model: Optional[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Metadata of the ready databases named by id or matching the sector/owner selector"""
+        if database_ids:
+            selected = {}
+            for database_id in dict.fromkeys(database_ids):
+                metadata = self.get_database_info(database_id)
+                if not metadata:
+                    raise ValueError(f"Database {database_id} not found")
+                if metadata.get("status") != "completed":
+                    raise ValueError(f"Database {database_id} is not ready for querying")
+                selected[database_id] = metadata
+        else:
+            selected = dict(self.catalog.list(owner=owner, sector=sector, status="completed"))
+        
+        if model:
+            mismatched = [
+                database_id for database_id, metadata in selected.items()
+                if (metadata.get("model") or settings.EMBEDDING_MODEL) != model
+            ]
+            if database_ids and mismatched:
+                raise ValueError(f"Databases {mismatched} were not built with model {model}")
+            # A selector only picks the databases searchable with the requested model
+            selected = {database_id: metadata for database_id, metadata in selected.items() if database_id not in mismatched}
+        return selected
+
+    @staticmethod
+    def _format_results(results: Dict[str, Any], row: int) -> List[Dict[str, Any]]:
+        """Hits of one query vector from a collection.query response"""
+        formatted_results = []
+        for i in range(len(results['documents'][row])):
+            formatted_results.append({
+                'id': results['ids'][row][i],
+                'text': results['documents'][row][i],
+                'metadata': results['metadatas'][row][i],
+                'distance': results['distances'][row][i]
+            })
+        return formatted_results
+
+    def _search(
+        self,
+        database_id: str,
+        queries: List[str],
+        query_embeddings: Optional[List[List[float]]],
+        n_results: int,
+        mode: str,
+        filters: Optional[QueryFilters] = None,
+        search_ef: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Vector, lexical or hybrid search for a batch of queries. Hybrid takes
+        HYBRID_CANDIDATE_FACTOR * n_results candidates from each ranking and fuses them
+        with reciprocal rank fusion. Blocking; runs on the query executor.
+        """
+        if mode == "vector":
+            results = self._search_collection(database_id, query_embeddings, n_results, filters, search_ef)
+            return [self._format_results(results, row) for row in range(len(queries))]
+        if mode == "lexical":
+            # Vector and hybrid searches mark the database as queried in _search_collection
+            self.collections.touch(database_id)
+        
+        collection = self.chroma_client.get_collection(name=database_id)
+        index = self._get_lexical_index(database_id, collection)
+        allowed = None
+        if filters is not None and filters.cache_key() is not None:
+            # Chroma evaluates the filter; BM25 then ranks only the matching chunks
+            matching = collection.get(where=filters.where, where_document=filters.where_document, include=[])
+            allowed = index.mask(matching["ids"])
+        candidates = n_results if mode == "lexical" else n_results * settings.HYBRID_CANDIDATE_FACTOR
+        
+        vector_hits: List[Dict[str, Dict[str, Any]]] = [{} for _ in queries]
+        if mode == "hybrid":
+            results = self._search_collection(database_id, query_embeddings, candidates, filters, search_ef)
+            for row in range(len(queries)):
+                for chunk_id, result in zip(results['ids'][row], self._format_results(results, row)):
+                    vector_hits[row][chunk_id] = result
+        
+        lexical_rankings = [index.search(query, candidates, allowed) for query in queries]
+        
+        ranked = []
+        for row, lexical_hits in enumerate(lexical_rankings):
+            if mode == "lexical":
+                ranked.append(lexical_hits[:n_results])
+            else:
+                ranked.append(reciprocal_rank_fusion(
+                    [list(vector_hits[row]), [chunk_id for chunk_id, _ in lexical_hits]]
+                )[:n_results])
+        
+        # Chunks found only by the lexical index are read from the collection in one call
+        needed = list({
+            chunk_id for row, hits in enumerate(ranked)
+            for chunk_id, _ in hits if chunk_id not in vector_hits[row]
+        })
+        fetched = {}
+        if needed:
+            chunks = collection.get(ids=needed, include=['documents', 'metadatas'])
+            for chunk_id, text, metadata in zip(chunks['ids'], chunks['documents'], chunks['metadatas']):
+                fetched[chunk_id] = {'id': chunk_id, 'text': text, 'metadata': metadata, 'distance': None}
+        
+        # Ids removed since the index was built are skipped
+        return [
+            [
+                {**(vector_hits[row].get(chunk_id) or fetched[chunk_id]), 'score': score}
+                for chunk_id, score in hits
+                if chunk_id in vector_hits[row] or chunk_id in fetched
+            ]
+            for row, hits in enumerate(ranked)
+        ]
+
+    @staticmethod
+    def _rerank(
+        queries: List[str],
+        candidates: List[List[Dict[str, Any]]],
+        n_results: int
+    ) -> Optional[List[List[Dict[str, Any]]]]:
+        """Cross-encoder reranking of every query's candidates. Blocking; runs on the query executor."""
+        reranked = get_reranker().rerank(queries, candidates, n_results)
+        if reranked is None:
+            logger.info("Skipping rerank: reranker busy or over its latency budget")
+        return reranked
+
+    def _diversify(
+        self,
+        database_id: str,
+        query_embeddings: Optional[List[List[float]]],
+        candidates: List[List[Dict[str, Any]]],
+        n_results: int,
+        diversification: Diversification
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        MMR and per-source selection of n_results out of every query's candidates.
+        Candidate vectors are read from the collection in one call. Relevance is cosine
+        similarity to the query vector when given, otherwise the candidates' rank.
+        Blocking; runs on the query executor.
+        """
+        embeddings: Dict[str, np.ndarray] = {}
+        if diversification.mmr_lambda is not None:
+            ids = list({result['id'] for results in candidates for result in results})
+            if ids:
+                collection = self.chroma_client.get_collection(name=database_id)
+                stored = collection.get(ids=ids, include=['embeddings'])
+                embeddings = dict(zip(stored['ids'], np.asarray(stored['embeddings'], dtype=np.float32)))
+            # Chunks deleted since the search have no vector to compare against
+            candidates = [[result for result in results if result['id'] in embeddings] for results in candidates]
+        
+        diversified = []
+        for row, results in enumerate(candidates):
+            if not results:
+                diversified.append([])
                 continue
+            vectors = np.stack([embeddings[result['id']] for result in results]) if embeddings else None
+            if query_embeddings is not None and vectors is not None:
+                query_vector = np.asarray(query_embeddings[row], dtype=np.float32)
+                norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector)
+                relevance = vectors @ query_vector / np.maximum(norms, 1e-12)
+            else:
+                relevance = rank_relevance(len(results))
+            sources = [(result.get('metadata') or {}).get('source') for result in results]
+            selected = select_diverse(relevance, vectors, sources, n_results, diversification)
+            diversified.append([results[i] for i in selected])
+        return diversified
 
-            # Try to get collection info from ChromaDB if status is completed
-            document_count = metadata.get("document_count", 0)
-            if metadata.get("status") == "completed":
-                try:
-                    collection = self.chroma_client.get_collection(name=db_dir.name)
-                    if collection:
-                        document_count = collection.count()
-                        # Update metadata if count differs
-                        if document_count != metadata.get("document_count"):
-                            self.update_database_metadata(db_dir.name, {
-                                "document_count": document_count
-                            })
-                except Exception as e:
-                    # If collection doesn't exist but metadata says completed,
-                    # mark it as error
-                    if metadata.get("status") == "completed":
-                        self.update_database_metadata(db_dir.name, {
-                            "status": "error",
-                            "error_message": "Vector database files not found"
-                        })
-                        metadata["status"] = "error"
-            
-            # Include database only if:
-            # 1. No user_id filter is provided (dashboard view)
-            # 2. Or if user_id matches the filter (your databases view)
-            if not user_id or metadata.get("created_by") == user_id:
-                databases.append({
-                    "id": db_dir.name,
-                    "name": metadata.get("name", db_dir.name),
-                    "description": metadata.get("description", ""),
-                    "sector": metadata.get("sector", ""),
-                    "file_count": metadata.get("file_count", 0),
-                    "document_count": document_count,
-                    "total_file_size": metadata.get("total_file_size", 0),
-                    "database_size": metadata.get("database_size", 0),
-                    "status": metadata.get("status", "unknown"),
-                    "created_by": metadata.get("created_by"),
-                    "created_at": metadata.get("created_at"),
-                    "updated_at": metadata.get("updated_at"),
-                    "error_message": metadata.get("error_message")
-                })
-                    
-        return databases
+    def _search_collection(
+        self,
+        database_id: str,
+        query_embeddings: List[List[float]],
+        n_results: int,
+        filters: Optional[QueryFilters] = None,
+        search_ef: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Nearest-neighbour search for a batch of query vectors, exact for small collections and
+        through Chroma's HNSW index otherwise. Blocking; runs on the query executor.
+        """
+        # Every search, federated ones included, keeps the database resident and within the budget
+        self.collections.touch(database_id)
+        collection = self.chroma_client.get_collection(name=database_id)
+        if not collection:
+            raise ValueError(f"Database {database_id} not found")
+        index = self._get_vector_index(database_id, collection)
+        if index is not None:
+            return self._search_exact(collection, index, query_embeddings, n_results, filters, search_ef)
+        if not search_ef or search_ef <= n_results:
+            return collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=filters.where if filters else None,
+                where_document=filters.where_document if filters else None,
+                include=['documents', 'metadatas', 'distances']
+            )
+        
+        # HNSW searches with max(search_ef, k) candidates, so asking for search_ef hits raises
+        # the effective ef of this request only; the index's configured search_ef is untouched
+        wide = collection.query(
+            query_embeddings=query_embeddings,
+            n_results=search_ef,
+            where=filters.where if filters else None,
+            where_document=filters.where_document if filters else None,
+            include=['distances']
+        )
+        hits = [(ids[:n_results], distances[:n_results]) for ids, distances in zip(wide['ids'], wide['distances'])]
+        return self._collect_hits(collection, hits)
+
+    @staticmethod
+    def _search_exact(
+        collection,
+        index: Union[ExactIndex, QuantizedIndex],
+        query_embeddings: List[List[float]],
+        n_results: int,
+        filters: Optional[QueryFilters] = None,
+        search_ef: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Exact or quantized search answered in the shape of a collection.query response.
+        search_ef raises the number of quantized candidates rescored at full precision.
+        """
+        allowed = None
+        if filters is not None and filters.cache_key() is not None:
+            # Chroma evaluates the filter; the matching rows are scored exactly
+            matching = collection.get(where=filters.where, where_document=filters.where_document, include=[])
+            allowed = index.mask(matching["ids"])
+        if isinstance(index, QuantizedIndex):
+            hits = index.search(query_embeddings, n_results, allowed, min_candidates=search_ef or 0)
+        else:
+            hits = index.search(query_embeddings, n_results, allowed)
+        return DatabaseService._collect_hits(collection, hits)
+
+    @staticmethod
+    def _collect_hits(collection, hits: List[Tuple[List[str], List[float]]]) -> Dict[str, Any]:
+        """Read the documents of (ids, distances) hits per query into a collection.query response"""
+        needed = list({chunk_id for ids, _ in hits for chunk_id in ids})
+        chunks = {}
+        if needed:
+            stored = collection.get(ids=needed, include=['documents', 'metadatas'])
+            chunks = {
+                chunk_id: (text, metadata)
+                for chunk_id, text, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])
+            }
+        
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        for ids, distances in hits:
+            # Ids deleted since the search ran are skipped
+            kept = [(chunk_id, distance) for chunk_id, distance in zip(ids, distances) if chunk_id in chunks]
+            results['ids'].append([chunk_id for chunk_id, _ in kept])
+            results['documents'].append([chunks[chunk_id][0] for chunk_id, _ in kept])
+            results['metadatas'].append([chunks[chunk_id][1] for chunk_id, _ in kept])
+            results['distances'].append([distance for _, distance in kept])
+        return results
+
+    @staticmethod
+    async def _run_in_query_executor(fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(_query_executor, partial(fn, *args))
+
+    @staticmethod
+    async def _with_timeout(stage: str, timeout: float, awaitable) -> Any:
+        """Await one stage of a query, raising QueryTimeoutError if it takes longer than timeout"""
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            raise QueryTimeoutError(f"Query {stage} stage timed out after {timeout}s")
+
+    def _resolve_query_model(self, database_id: str, model: Optional[str]) -> Tuple[str, Optional[int]]:
+        """
+        The database's embedding model and declared dimensions, rejecting queries with a
+        different model. Query vectors are always reduced to the database's dimensions.
+        """
+        metadata = self.get_database_info(database_id) or {}
+        database_model = metadata.get("model")
+        if model is None:
+            return database_model or settings.EMBEDDING_MODEL, metadata.get("dimensions")
+        if database_model and model != database_model:
+            raise ValueError(
+                f"Database {database_id} was built with model {database_model}, not {model}"
+            )
+        return model, metadata.get("dimensions")
+
+    @staticmethod
+    def _check_dimensions(database_id: str, dimensions: Optional[int], embeddings: List[List[float]]):
+        """Refuse to search with query vectors whose width differs from the database's"""
+        if dimensions is None:
+            return
+        widths = {len(embedding) for embedding in embeddings}
+        if widths - {dimensions}:
+            raise ValueError(
+                f"Query embeddings have {sorted(widths)} dimensions, {database_id} is stored at {dimensions}"
+            )
+
+    def list_databases(self, user_id: str = None) -> List[dict]:
+        """
+        List all databases from the catalog.
+        If user_id is provided, only the databases created by that user
+        """
+        return [
+            {
+                "id": database_id,
+                "name": metadata.get("name", database_id),
+                "description": metadata.get("description", ""),
+                "sector": metadata.get("sector", ""),
+                "file_count": metadata.get("file_count", 0),
+                "document_count": metadata.get("document_count", 0),
+                "total_file_size": metadata.get("total_file_size", 0),
+                "database_size": metadata.get("database_size", 0),
+                "status": metadata.get("status", "unknown"),
+                "created_by": metadata.get("created_by"),
+                "created_at": metadata.get("created_at"),
+                "updated_at": metadata.get("updated_at"),
+                "error_message": metadata.get("error_message")
+            }
+            for database_id, metadata in self.catalog.list(owner=user_id)
+        ]
 
     def get_database(self, database_id: str) -> Optional[dict]:
         """Get database details by ID"""
-        db_path = self.vector_db_path / database_id
-        metadata_path = db_path / "metadata.json"
-        
-        if not metadata_path.exists():
+        metadata = self.catalog.get(database_id)
+        if metadata is None:
             return None
             
-        with open(metadata_path, "r") as f:
-            metadata = json.load(f)
-            
         return {
             "id": database_id,
             "name": metadata.get("name"),
@@ -301,63 +1529,22 @@ class DatabaseService:
         }
 
     def get_database_info(self, database_id: str) -> Optional[Dict[str, Any]]:
-        """Get database information from metadata file"""
+        """Get database information from the catalog"""
         try:
-            db_path = self.vector_db_path / database_id
-            metadata_path = db_path / "metadata.json"
-            
-            if not metadata_path.exists():
-                return None
-                
-            with open(metadata_path) as f:
-                metadata = json.load(f)
-            
-            return metadata
-            
+            return self.catalog.get(database_id)
         except Exception as e:
             logger.error(f"Error getting database info: {str(e)}")
             return None
 
     def update_database_status(self, database_id: str, status: str) -> bool:
         """Update database status"""
-        db_path = self.vector_db_path / database_id
-        metadata_path = db_path / "metadata.json"
-        
-        if not metadata_path.exists():
-            return False
-            
-        with open(metadata_path, "r") as f:
-            metadata = json.load(f)
-            
-        metadata["status"] = status
-        
-        with open(metadata_path, "w") as f:
-            json.dump(metadata, f)
-            
-        return True
+        return self.catalog.update(database_id, {"status": status}) is not None
 
     def update_database_metadata(self, database_id: str, updates: Dict[str, Any]) -> bool:
         """Update database metadata"""
-        db_path = self.vector_db_path / database_id
-        metadata_path = db_path / "metadata.json"
-        
-        if not metadata_path.exists():
-            return False
-            
         try:
-            # Read existing metadata
-            with open(metadata_path, "r") as f:
-                metadata = json.load(f)
-            
-            # Update metadata
-            metadata.update(updates)
-            metadata["updated_at"] = datetime.now(timezone.utc).isoformat()
-            
-            # Write updated metadata
-            with open(metadata_path, "w") as f:
-                json.dump(metadata, f)
-                
-            return True
+            updates = {**updates, "updated_at": datetime.now(timezone.utc).isoformat()}
+            return self.catalog.update(database_id, updates) is not None
         except Exception as e:
             logger.error(f"Error updating metadata for {database_id}: {str(e)}")
             return False
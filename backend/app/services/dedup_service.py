@@ -0,0 +1,138 @@
+from typing import List, Dict, Any, Optional, Collection
+import hashlib
+import json
+import re
+import numpy as np
+from ..core.config import get_settings
+
+settings = get_settings()
+
+_WORD_RE = re.compile(r"\w+")
+_BIT_POSITIONS = np.arange(64, dtype=np.uint64)
+
+MERGE_KEYS = ("merged_sources", "duplicate_count", "merged_counts")
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """64-bit SimHash over word shingles of the normalized text"""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) >= shingle_size:
+        shingles = [" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+    else:
+        shingles = words or [text]
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64
+    )
+    # Each shingle votes +1/-1 on every bit; the sign of the tally gives the fingerprint bit
+    bits = ((hashes[:, None] >> _BIT_POSITIONS) & np.uint64(1)).astype(np.int32)
+    tally = bits.sum(axis=0) * 2 - len(shingles)
+    return int(np.packbits((tally > 0)[::-1]).view(">u8")[0])
+
+
+def merge_counts(metadata: Dict[str, Any], replaced: Collection[str] = ()) -> Dict[str, int]:
+    """
+    Duplicates a stored chunk absorbed per source, leaving out replaced sources, whose
+    duplicates are found again when they are re-ingested
+    """
+    if metadata.get("merged_counts"):
+        counts = json.loads(metadata["merged_counts"])
+    else:
+        # Chunks stored before per-source counts were recorded only have the total
+        sources = [source for source in (metadata.get("merged_sources") or "").split(",") if source]
+        counts = {source: 1 for source in sources}
+        if sources:
+            counts[sources[0]] += max(metadata.get("duplicate_count", 0) - len(sources), 0)
+    return {source: count for source, count in counts.items() if source not in replaced}
+
+
+def merges_metadata(counts: Dict[str, int]) -> Dict[str, Any]:
+    """Metadata update recording merge counts on a chunk; None values make Chroma delete the keys"""
+    if not counts:
+        return {key: None for key in MERGE_KEYS}
+    # Chroma metadata values must be scalars
+    return {
+        "merged_sources": ",".join(sorted(counts)),
+        "duplicate_count": sum(counts.values()),
+        "merged_counts": json.dumps(counts, sort_keys=True)
+    }
+
+
+class ChunkDeduplicator:
+    """
+    Drops exact duplicate chunks (by content hash) and near duplicates (SimHash within
+    max_distance bits) seen during one ingestion run, or of chunks already stored that
+    were passed to seed. Fingerprints are split into max_distance + 1 bands so candidates
+    are found by exact band lookup instead of a scan.
+    """
+
+    def __init__(self, max_distance: int = settings.DEDUP_MAX_HAMMING_DISTANCE):
+        self.max_distance = max_distance
+        self.band_count = max_distance + 1
+        self.band_bits = 64 // self.band_count
+        self._exact: Dict[str, str] = {}  # content hash -> kept chunk id
+        self._bands: List[Dict[int, List[int]]] = [{} for _ in range(self.band_count)]
+        self._fingerprints: Dict[int, str] = {}  # simhash -> kept chunk id
+        self._merged: Dict[str, Dict[str, int]] = {}  # kept chunk id -> source -> duplicates dropped
+        self.exact_dropped = 0
+        self.near_dropped = 0
+        self.chunks_seen = 0
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (band * self.band_bits)) & mask for band in range(self.band_count)]
+
+    def _find_near(self, fingerprint: int) -> Optional[str]:
+        for band, key in enumerate(self._band_keys(fingerprint)):
+            for candidate in self._bands[band].get(key, []):
+                if bin(candidate ^ fingerprint).count("1") <= self.max_distance:
+                    return self._fingerprints[candidate]
+        return None
+
+    def check(self, chunk_id: str, text: str, metadata: Dict[str, Any]) -> bool:
+        """Return True if the chunk should be kept, recording its source on the kept chunk otherwise"""
+        self.chunks_seen += 1
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        kept_id = self._exact.get(content_hash)
+        if kept_id is not None:
+            self.exact_dropped += 1
+            self._merge(kept_id, metadata)
+            return False
+
+        fingerprint = simhash(text)
+        kept_id = self._find_near(fingerprint)
+        if kept_id is not None:
+            self.near_dropped += 1
+            self._merge(kept_id, metadata)
+            return False
+
+        self._keep(chunk_id, content_hash, fingerprint)
+        return True
+
+    def seed(self, chunk_id: str, text: str):
+        """Register a chunk already stored, so that chunks duplicating it are dropped"""
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if content_hash not in self._exact:
+            self._keep(chunk_id, content_hash, simhash(text))
+
+    def _keep(self, chunk_id: str, content_hash: str, fingerprint: int):
+        self._exact[content_hash] = chunk_id
+        self._fingerprints[fingerprint] = chunk_id
+        for band, key in enumerate(self._band_keys(fingerprint)):
+            self._bands[band].setdefault(key, []).append(fingerprint)
+
+    def _merge(self, kept_id: str, metadata: Dict[str, Any]):
+        counts = self._merged.setdefault(kept_id, {})
+        counts[metadata["source"]] = counts.get(metadata["source"], 0) + 1
+
+    def merged_counts(self) -> Dict[str, Dict[str, int]]:
+        """Duplicates dropped in this run per kept chunk id and source"""
+        return self._merged
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chunks_seen": self.chunks_seen,
+            "exact_duplicates_dropped": self.exact_dropped,
+            "near_duplicates_dropped": self.near_dropped,
+            "chunks_dropped": self.exact_dropped + self.near_dropped,
+        }
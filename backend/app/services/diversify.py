@@ -0,0 +1,73 @@
+from typing import List, Any, Optional, NamedTuple, Tuple
+import numpy as np
+
+
+class Diversification(NamedTuple):
+    mmr_lambda: Optional[float] = None  # 1.0 ranks by relevance only, 0.0 by novelty only
+    max_per_source: Optional[int] = None  # At most this many results per metadata.source
+
+    @property
+    def enabled(self) -> bool:
+        return self.mmr_lambda is not None or self.max_per_source is not None
+
+    def validate(self):
+        if self.mmr_lambda is not None and not 0.0 <= self.mmr_lambda <= 1.0:
+            raise ValueError("mmr_lambda must be between 0 and 1")
+        if self.max_per_source is not None and self.max_per_source < 1:
+            raise ValueError("max_per_source must be at least 1")
+
+    def cache_key(self) -> Optional[Tuple]:
+        return tuple(self) if self.enabled else None
+
+
+def select_diverse(
+    relevance: np.ndarray,
+    embeddings: Optional[np.ndarray],
+    sources: List[Any],
+    n_results: int,
+    diversification: Diversification
+) -> List[int]:
+    """
+    Greedy Maximal Marginal Relevance over a candidate set, returning the indices of the
+    chosen candidates in order. Pairwise cosine similarities come from one matrix product;
+    each pick then updates every candidate's similarity to the chosen set in one vector
+    operation. Candidates from a source that already has max_per_source picks are masked.
+    Without mmr_lambda the candidates are taken by relevance alone.
+    """
+    count = len(relevance)
+    available = np.ones(count, dtype=bool)
+
+    if diversification.max_per_source is not None:
+        source_index = {}
+        source_ids = np.array([source_index.setdefault(source, len(source_index)) for source in sources], dtype=np.int64)
+        source_counts = np.zeros(len(source_index), dtype=np.int64)
+
+    if diversification.mmr_lambda is not None:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarity = vectors @ vectors.T
+        # Cosine similarity is at least -1, so this start value penalises every candidate equally
+        max_similarity = np.full(count, -1.0, dtype=np.float32)
+        weight = diversification.mmr_lambda
+
+    selected: List[int] = []
+    while len(selected) < n_results and available.any():
+        if diversification.mmr_lambda is not None:
+            scores = weight * relevance - (1 - weight) * max_similarity
+        else:
+            scores = relevance
+        best = int(np.argmax(np.where(available, scores, -np.inf)))
+        selected.append(best)
+        available[best] = False
+        if diversification.max_per_source is not None:
+            source_counts[source_ids[best]] += 1
+            if source_counts[source_ids[best]] >= diversification.max_per_source:
+                available &= source_ids != source_ids[best]
+        if diversification.mmr_lambda is not None:
+            np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+def rank_relevance(count: int) -> np.ndarray:
+    """Relevance in (0, 1] that follows an existing ranking, for candidates without a query vector"""
+    return 1.0 - np.arange(count, dtype=np.float32) / max(count, 1)
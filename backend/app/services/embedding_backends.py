@@ -0,0 +1,174 @@
+from typing import List, Dict, Optional
+import asyncio
+import hashlib
+import re
+import threading
+import logging
+from pathlib import Path
+import numpy as np
+from .embedding_dispatcher import get_embedding_dispatcher
+from ..core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Models named "local/<name>" are computed in-process instead of by the OpenAI API
+LOCAL_MODEL_PREFIX = "local/"
+HASHING_MODEL = "hashing"
+
+# Native width of the OpenAI models that accept a dimensions argument
+OPENAI_REDUCIBLE_MODELS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072}
+
+
+def is_local_model(model: str) -> bool:
+    return model.startswith(LOCAL_MODEL_PREFIX)
+
+
+def validate_dimensions(model: str, dimensions: Optional[int]):
+    """Reject a target dimensionality the model cannot produce"""
+    if dimensions is None:
+        return
+    if dimensions < 1:
+        raise ValueError("dimensions must be a positive integer")
+    if not is_local_model(model):
+        native = OPENAI_REDUCIBLE_MODELS.get(model)
+        if native is None:
+            raise ValueError(
+                f"Model {model} does not support reduced dimensions, use one of {', '.join(OPENAI_REDUCIBLE_MODELS)}"
+            )
+    else:
+        # Local models are loaded to read their width, which they would be for ingestion anyway
+        native = get_embedding_backend(model).native_dimension()
+    if native is not None and dimensions > native:
+        raise ValueError(f"Model {model} produces at most {native} dimensions")
+
+
+def embedding_key(model: str, dimensions: Optional[int]) -> str:
+    """Cache key for vectors of a model at a dimensionality; full-width vectors keep the plain model name"""
+    return model if dimensions is None else f"{model}@{dimensions}"
+
+
+def reduce_dimensions(embeddings: List[List[float]], dimensions: int) -> List[List[float]]:
+    """Keep the leading dimensions of each vector and rescale it to unit length"""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2 or not len(matrix):
+        return [list(row) for row in embeddings]
+    if matrix.shape[1] < dimensions:
+        raise ValueError(f"Cannot reduce {matrix.shape[1]}-dimensional embeddings to {dimensions} dimensions")
+    matrix = np.ascontiguousarray(matrix[:, :dimensions])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix.tolist()
+
+
+class EmbeddingBackend:
+    """
+    Base class for embedding backends. Backends that can produce reduced vectors
+    natively use dimensions; the embedding service truncates and normalizes the rest.
+    """
+    def embed(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        raise NotImplementedError
+
+    def native_dimension(self) -> Optional[int]:
+        """Width of the model's full vectors, None if it cannot be told without embedding"""
+        return None
+
+    async def embed_async(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        """Embed without blocking the calling event loop"""
+        return await asyncio.to_thread(self.embed, texts, dimensions)
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """Embeddings from the OpenAI API, sent through the shared rate-limited dispatcher"""
+    def __init__(self, model: str):
+        self.model = model
+        self.dispatcher = get_embedding_dispatcher()
+
+    def embed(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        return self.dispatcher.embed(texts, self.model, dimensions)
+
+    async def embed_async(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        return await self.dispatcher.embed_async(texts, self.model, dimensions)
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """
+    In-process CPU embeddings from a sentence-transformers model, loaded once per process.
+    Names are resolved against LOCAL_EMBEDDING_MODEL_DIR first so air-gapped hosts can
+    serve models from disk without reaching the Hugging Face hub.
+    """
+    def __init__(self, name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ValueError(
+                f"Local embedding model {name} requires the sentence-transformers package"
+            )
+        local_path = Path(settings.LOCAL_EMBEDDING_MODEL_DIR) / name
+        source = str(local_path) if local_path.exists() else name
+        logger.info(f"Loading local embedding model from {source}")
+        self.model = SentenceTransformer(source, device="cpu")
+        self._lock = threading.Lock()
+
+    def native_dimension(self) -> Optional[int]:
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        # One encode call vectorises the whole batch; the lock keeps concurrent
+        # ingestion workers from oversubscribing the CPU with parallel forward passes
+        with self._lock:
+            embeddings = self.model.encode(
+                texts,
+                batch_size=settings.LOCAL_EMBEDDING_BATCH_SIZE,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            )
+        return embeddings.astype(np.float32).tolist()
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Dependency-free feature-hashing embeddings over word unigrams and bigrams.
+    Useful for air-gapped development and tests; retrieval quality is lexical only.
+    """
+    _WORD_RE = re.compile(r"\w+")
+
+    def __init__(self, dimension: int = settings.HASHING_EMBEDDING_DIMENSION):
+        self.dimension = dimension
+
+    def native_dimension(self) -> Optional[int]:
+        return self.dimension
+
+    def _features(self, text: str) -> List[str]:
+        words = self._WORD_RE.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                sign = 1.0 if digest & 1 else -1.0
+                matrix[row, (digest >> 1) % self.dimension] += sign
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix.tolist()
+
+
+_backends: Dict[str, EmbeddingBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_embedding_backend(model: str) -> EmbeddingBackend:
+    """Return the process-wide backend serving an embedding model"""
+    with _backends_lock:
+        backend = _backends.get(model)
+        if backend is None:
+            if not is_local_model(model):
+                backend = OpenAIEmbeddingBackend(model)
+            elif model[len(LOCAL_MODEL_PREFIX):] == HASHING_MODEL:
+                backend = HashingEmbeddingBackend()
+            else:
+                backend = SentenceTransformerBackend(model[len(LOCAL_MODEL_PREFIX):])
+            _backends[model] = backend
+        return backend
@@ -0,0 +1,222 @@
+from typing import List, Dict, Optional, Any, Tuple
+import asyncio
+import random
+import threading
+import time
+import logging
+import openai
+from openai import AsyncOpenAI
+from .tokenizer import get_tokenizer
+from ..core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `per_minute` tokens per minute"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        """Wait until `amount` tokens are available and take them"""
+        # A single request larger than the bucket can only ever wait for a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class EmbeddingDispatcher:
+    """
+    Sends embedding batches concurrently on a dedicated event loop thread.
+    Requests are throttled by requests-per-minute and tokens-per-minute buckets,
+    and 429/5xx/connection failures are retried with jittered exponential backoff.
+    Sync callers use embed(); async callers await embed_async().
+    """
+
+    def __init__(
+        self,
+        api_key: str = settings.OPENAI_API_KEY,
+        concurrency: int = settings.EMBEDDING_CONCURRENCY,
+        requests_per_minute: int = settings.EMBEDDING_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = settings.EMBEDDING_TOKENS_PER_MINUTE,
+        batch_size: int = settings.EMBEDDING_BATCH_SIZE,
+        max_batch_tokens: int = settings.EMBEDDING_BATCH_TOKENS,
+        max_retries: int = settings.EMBEDDING_MAX_RETRIES
+    ):
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.stats_counters: Dict[str, float] = {
+            "requests": 0,
+            "texts": 0,
+            "tokens": 0,
+            "max_batch_tokens_sent": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "busy_seconds": 0.0,
+        }
+        self._started = time.monotonic()
+        self._api_key = api_key
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="embedding-dispatcher", daemon=True)
+        self._thread.start()
+        # Loop-bound primitives must be created on the dispatcher loop
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    async def _setup(self):
+        self.client = AsyncOpenAI(api_key=self._api_key, max_retries=0)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._request_bucket = TokenBucket(self.requests_per_minute)
+        self._token_bucket = TokenBucket(self.tokens_per_minute)
+
+    def pack_batches(self, texts: List[str], model: str) -> List[Tuple[List[str], int]]:
+        """
+        Group texts into (batch, token_count) pairs holding at most batch_size inputs
+        and max_batch_tokens tokens. Inputs over the model's per-input limit are truncated.
+        """
+        tokenizer = get_tokenizer(model)
+        batches = []
+        current: List[str] = []
+        current_tokens = 0
+        for text in texts:
+            count = tokenizer.count(text)
+            if count > tokenizer.max_input_tokens:
+                logger.warning(f"Truncating embedding input from {count} to {tokenizer.max_input_tokens} tokens")
+                text = tokenizer.truncate(text)
+                count = tokenizer.max_input_tokens
+            if current and (current_tokens + count > self.max_batch_tokens or len(current) >= self.batch_size):
+                batches.append((current, current_tokens))
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += count
+        if current:
+            batches.append((current, current_tokens))
+        return batches
+
+    def embed(self, texts: List[str], model: str, dimensions: Optional[int] = None) -> List[List[float]]:
+        """Embed texts from synchronous code, blocking until every batch is done"""
+        batches = self.pack_batches(texts, model)
+        return asyncio.run_coroutine_threadsafe(self._embed(batches, model, dimensions), self._loop).result()
+
+    async def embed_async(self, texts: List[str], model: str, dimensions: Optional[int] = None) -> List[List[float]]:
+        """Embed texts from another event loop without blocking it"""
+        batches = self.pack_batches(texts, model)
+        future = asyncio.run_coroutine_threadsafe(self._embed(batches, model, dimensions), self._loop)
+        return await asyncio.wrap_future(future)
+
+    async def _embed(
+        self,
+        batches: List[Tuple[List[str], int]],
+        model: str,
+        dimensions: Optional[int] = None
+    ) -> List[List[float]]:
+        results = await asyncio.gather(*(self._embed_batch(batch, tokens, model, dimensions) for batch, tokens in batches))
+        return [embedding for batch_embeddings in results for embedding in batch_embeddings]
+
+    async def _embed_batch(self, batch: List[str], tokens: int, model: str, dimensions: Optional[int] = None) -> List[List[float]]:
+        attempt = 0
+        while True:
+            await self._request_bucket.acquire(1)
+            await self._token_bucket.acquire(tokens)
+            async with self._semaphore:
+                started = time.monotonic()
+                try:
+                    # text-embedding-3 models shorten vectors server-side when asked for fewer dimensions
+                    extra = {"dimensions": dimensions} if dimensions else {}
+                    response = await self.client.embeddings.create(model=model, input=batch, **extra)
+                    sent_tokens = response.usage.total_tokens if response.usage else tokens
+                    logger.info(f"Embedded batch of {len(batch)} texts, {sent_tokens} tokens, using model: {model}")
+                    self.stats_counters["requests"] += 1
+                    self.stats_counters["texts"] += len(batch)
+                    self.stats_counters["tokens"] += sent_tokens
+                    self.stats_counters["max_batch_tokens_sent"] = max(
+                        self.stats_counters["max_batch_tokens_sent"], sent_tokens
+                    )
+                    return [data.embedding for data in response.data]
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        self.stats_counters["failures"] += 1
+                        logger.error(f"Embedding batch failed after {attempt} retries: {str(e)}")
+                        raise e
+                    error = e
+                finally:
+                    self.stats_counters["busy_seconds"] += time.monotonic() - started
+            attempt += 1
+            self.stats_counters["retries"] += 1
+            logger.warning(f"Retrying embedding batch in {delay:.2f}s (attempt {attempt}): {str(error)}")
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Backoff before the next attempt, or None if the error is not retryable"""
+        if attempt >= self.max_retries:
+            return None
+        if isinstance(error, openai.RateLimitError):
+            self.stats_counters["rate_limited"] += 1
+        elif isinstance(error, openai.APIStatusError):
+            if error.status_code < 500:
+                return None
+        elif not isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return None
+
+        # Full jitter exponential backoff, but never sooner than the server asked for
+        delay = random.uniform(0, min(
+            settings.EMBEDDING_BACKOFF_MAX,
+            settings.EMBEDDING_BACKOFF_BASE * (2 ** attempt)
+        ))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        """Throughput counters since the dispatcher started"""
+        elapsed = time.monotonic() - self._started
+        counters = dict(self.stats_counters)
+        return {
+            **counters,
+            "concurrency": self.concurrency,
+            "requests_per_minute_limit": self.requests_per_minute,
+            "tokens_per_minute_limit": self.tokens_per_minute,
+            "uptime_seconds": elapsed,
+            "avg_batch_tokens": counters["tokens"] / counters["requests"] if counters["requests"] else 0.0,
+            "requests_per_minute": counters["requests"] / elapsed * 60 if elapsed else 0.0,
+            "tokens_per_minute": counters["tokens"] / elapsed * 60 if elapsed else 0.0,
+            # Average number of requests in flight, compare with concurrency to spot idle capacity
+            "utilization": counters["busy_seconds"] / elapsed if elapsed else 0.0,
+        }
+
+
+_dispatcher: Optional[EmbeddingDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_embedding_dispatcher() -> EmbeddingDispatcher:
+    """Return the process-wide embedding dispatcher"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = EmbeddingDispatcher()
+        return _dispatcher
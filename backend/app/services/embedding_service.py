@@ -1,18 +1,21 @@
-from typing import List
+from typing import List, Iterable, Iterator, Optional
+import asyncio
 import os
 import nltk
 import logging
-from openai import OpenAI
+from .embedding_cache import get_embedding_cache
+from .query_cache import get_query_embedding_cache, normalize_query
+from .embedding_backends import get_embedding_backend, embedding_key, reduce_dimensions
 from ..core.config import get_settings
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-# Set OpenAI API key
 class EmbeddingService:
     def __init__(self):
-        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
         self.model = settings.EMBEDDING_MODEL  # Use model from settings
+        self.cache = get_embedding_cache()
+        self.query_cache = get_query_embedding_cache()
         
         # Download NLTK data if not already downloaded
         try:
@@ -22,60 +25,120 @@ class EmbeddingService:
 
     def chunk_text(self, text: str, chunk_size: int = 512) -> List[str]:
         """Split text into chunks using NLTK sentence tokenizer"""
-        # Split text into sentences
-        sentences = nltk.sent_tokenize(text)
-        
-        chunks = []
+        return list(self.iter_chunks([text], chunk_size))
+
+    def iter_chunks(self, segments: Iterable[str], chunk_size: int = 512) -> Iterator[str]:
+        """Lazily chunk a stream of text segments (pages, blocks), carrying partial chunks across segments"""
         current_chunk = []
         current_size = 0
         
-        for sentence in sentences:
-            # Approximate token count (rough estimate)
-            sentence_size = len(sentence.split())
-            
-            if current_size + sentence_size > chunk_size and current_chunk:
-                # If adding this sentence would exceed chunk size, save current chunk
-                chunks.append(' '.join(current_chunk))
-                current_chunk = [sentence]
-                current_size = sentence_size
-            else:
-                # Add sentence to current chunk
-                current_chunk.append(sentence)
-                current_size += sentence_size
+        for segment in segments:
+            # Split text into sentences
+            for sentence in nltk.sent_tokenize(segment):
+                # Approximate token count (rough estimate)
+                sentence_size = len(sentence.split())
+                
+                if current_size + sentence_size > chunk_size and current_chunk:
+                    # If adding this sentence would exceed chunk size, emit current chunk
+                    yield ' '.join(current_chunk)
+                    current_chunk = [sentence]
+                    current_size = sentence_size
+                else:
+                    # Add sentence to current chunk
+                    current_chunk.append(sentence)
+                    current_size += sentence_size
         
-        # Add the last chunk if it exists
+        # Emit the last chunk if it exists
         if current_chunk:
-            chunks.append(' '.join(current_chunk))
+            yield ' '.join(current_chunk)
+
+    def get_embeddings(self, texts: List[str], model: str = None, dimensions: Optional[int] = None) -> List[List[float]]:
+        """
+        Get embeddings for a list of texts, serving repeats from the embedding cache.
+        With dimensions, vectors are reduced to that width and normalized.
+        """
+        model_to_use = model or self.model
+        if self.cache is None or not texts:
+            return self._fetch_embeddings(texts, model_to_use, dimensions)
         
-        return chunks
+        cache_key = embedding_key(model_to_use, dimensions)
+        cached = self.cache.get_many(cache_key, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+        if missing:
+            fetched = self._fetch_embeddings(missing, model_to_use, dimensions)
+            self.cache.put_many(cache_key, list(zip(missing, fetched)))
+            by_text = dict(zip(missing, fetched))
+            cached = [vector if vector is not None else by_text[text] for text, vector in zip(texts, cached)]
+        
+        logger.info(f"Embedding cache served {len(texts) - len(missing)}/{len(texts)} texts")
+        return cached
+
+    async def get_query_embedding(self, query: str, model: str = None, dimensions: Optional[int] = None) -> List[float]:
+        """Embed a search query, serving repeated queries from the in-memory query cache"""
+        return (await self.get_query_embeddings([query], model, dimensions))[0]
+
+    async def get_query_embeddings(
+        self,
+        queries: List[str],
+        model: str = None,
+        dimensions: Optional[int] = None
+    ) -> List[List[float]]:
+        """
+        Embed search queries without blocking the event loop. Repeats are served from the
+        in-memory query cache, then from the embedding cache on disk; the remaining misses
+        are fetched in one call and stored in both.
+        """
+        model_to_use = model or self.model
+        queries = [normalize_query(query) for query in queries]
+        cache_key = embedding_key(model_to_use, dimensions)
+        if self.query_cache is None:
+            embeddings = [None] * len(queries)
+        else:
+            embeddings = [self.query_cache.get(cache_key, query) for query in queries]
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+        if missing:
+            fetched = dict(zip(missing, await self._get_embeddings_async(missing, model_to_use, dimensions)))
+            if self.query_cache is not None:
+                for query, embedding in fetched.items():
+                    self.query_cache.put(cache_key, query, embedding)
+            embeddings = [embedding if embedding is not None else fetched[query] for query, embedding in zip(queries, embeddings)]
+        return embeddings
+
+    async def _get_embeddings_async(self, texts: List[str], model_to_use: str, dimensions: Optional[int] = None) -> List[List[float]]:
+        """get_embeddings for the event loop: the SQLite cache is read and written on a worker thread"""
+        if self.cache is None:
+            return await self._fetch_embeddings_async(texts, model_to_use, dimensions)
+        cache_key = embedding_key(model_to_use, dimensions)
+        cached = await asyncio.to_thread(self.cache.get_many, cache_key, texts)
+        missing = [text for text, vector in zip(texts, cached) if vector is None]
+        if missing:
+            fetched = await self._fetch_embeddings_async(missing, model_to_use, dimensions)
+            await asyncio.to_thread(self.cache.put_many, cache_key, list(zip(missing, fetched)))
+            by_text = dict(zip(missing, fetched))
+            cached = [vector if vector is not None else by_text[text] for text, vector in zip(texts, cached)]
+        return cached
+
+    def _fetch_embeddings(self, texts: List[str], model_to_use: str, dimensions: Optional[int] = None) -> List[List[float]]:
+        """Get embeddings for a list of texts from the backend serving the model"""
+        try:
+            logger.info(f"Getting embeddings for {len(texts)} texts using model: {model_to_use}")
+            embeddings = get_embedding_backend(model_to_use).embed(texts, dimensions)
+            return reduce_dimensions(embeddings, dimensions) if dimensions else embeddings
+        except Exception as e:
+            logger.error(f"Error getting embeddings: {str(e)}")
+            raise e
 
-    def get_embeddings(self, texts: List[str], model: str = None) -> List[List[float]]:
-        """Get embeddings for a list of texts using OpenAI API"""
+    async def _fetch_embeddings_async(
+        self,
+        texts: List[str],
+        model_to_use: str,
+        dimensions: Optional[int] = None
+    ) -> List[List[float]]:
+        """Get embeddings from the backend serving the model without blocking the event loop"""
         try:
-            # Get embeddings in batches to avoid rate limits
-            batch_size = 100
-            all_embeddings = []
-            
-            # Use provided model or fallback to default
-            model_to_use = model or self.model
-            logger.info(f"Using model: {model_to_use}")
-            
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
-                try:
-                    logger.info(f"Getting embeddings for batch {i} using model: {model_to_use}")
-                    response = self.client.embeddings.create(
-                        model=model_to_use,
-                        input=batch
-                    )
-                    embeddings = [data.embedding for data in response.data]
-                    all_embeddings.extend(embeddings)
-                except Exception as e:
-                    logger.error(f"Error in batch {i}: {str(e)}")
-                    raise e
-            
-            return all_embeddings
-            
+            logger.info(f"Getting embeddings for {len(texts)} texts using model: {model_to_use}")
+            embeddings = await get_embedding_backend(model_to_use).embed_async(texts, dimensions)
+            return reduce_dimensions(embeddings, dimensions) if dimensions else embeddings
         except Exception as e:
             logger.error(f"Error getting embeddings: {str(e)}")
             raise e
@@ -0,0 +1,279 @@
+from typing import List, Dict, Optional, Tuple, Iterable, Any
+import json
+import os
+import struct
+import threading
+import logging
+import uuid
+from pathlib import Path
+import numpy as np
+from ..core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+INDEX_FILENAME = "exact.idx"
+_MAGIC_V1 = b"EXACTIX1"  # Header, matrix and id list in one file, rewritten by every build
+_MAGIC = b"EXACTIX2"  # Manifest of ids naming a matrix file that appends extend in place
+_HEADER_SIZE = 64  # Keeps the matrix aligned for memory mapping
+SPACES = ("l2", "ip", "cosine")
+
+# Rows scored per matrix product; bounds the float32 copy of float16 storage
+_BLOCK_ROWS = 16384
+
+
+def distances(queries: np.ndarray, vectors: np.ndarray, sq_norms: np.ndarray, space: str) -> np.ndarray:
+    """(queries, vectors) distance matrix in Chroma's definition of the space"""
+    scores = queries @ vectors.T
+    if space == "l2":
+        result = sq_norms[None, :] - 2 * scores + np.einsum("ij,ij->i", queries, queries)[:, None]
+        return np.maximum(result, 0, out=result)
+    if space == "ip":
+        return 1 - scores
+    norms = np.sqrt(sq_norms)[None, :] * np.linalg.norm(queries, axis=1)[:, None]
+    return 1 - scores / np.maximum(norms, 1e-12)
+
+
+class ExactIndex:
+    """
+    Brute-force nearest-neighbour search over a memory-mapped embedding matrix.
+    A batch of queries is scored with one matrix product per block of rows and the
+    top k are picked with argpartition. Distances follow Chroma's definitions for
+    the collection's space, so results are interchangeable with its HNSW index.
+
+    The index file is a manifest of the row ids next to the matrix file it names. Appends
+    write new rows at the end of the matrix and mark deleted rows with a None id, then
+    replace the manifest, so readers only ever see committed rows.
+    """
+
+    def __init__(self, ids: List[Optional[str]], vectors: np.ndarray, space: str = "l2"):
+        if space not in SPACES:
+            raise ValueError(f"Unknown distance space {space}, expected one of {', '.join(SPACES)}")
+        self.ids = ids
+        self.vectors = vectors
+        self.space = space
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(ids) if chunk_id is not None}
+        # Rows still holding a chunk, None when no row has been deleted
+        self._live = None if len(self._positions) == len(ids) else np.array([chunk_id is not None for chunk_id in ids], dtype=bool)
+        self._sq_norms: Optional[np.ndarray] = None  # Computed on first search, see sq_norms
+
+    def _blocks(self) -> Iterable[Tuple[int, np.ndarray]]:
+        for start in range(0, len(self.ids), _BLOCK_ROWS):
+            yield start, np.asarray(self.vectors[start:start + _BLOCK_ROWS], dtype=np.float32)
+
+    def sq_norms(self) -> np.ndarray:
+        """Squared row norms; a quantized index that only reads candidate rows never needs them"""
+        if self._sq_norms is None:
+            self._sq_norms = np.concatenate([
+                np.einsum("ij,ij->i", block, block) for _, block in self._blocks()
+            ]) if len(self.ids) else np.zeros(0, dtype=np.float32)
+        return self._sq_norms
+
+    @property
+    def tombstones(self) -> int:
+        """Rows of deleted chunks that the matrix still holds until it is rewritten"""
+        return len(self.ids) - len(self._positions)
+
+    @staticmethod
+    def _write_rows(f, pages: Iterable[Tuple[List[str], List[List[float]]]], ids: List[Optional[str]], dims: int, dtype) -> int:
+        """Append pages to an open matrix file and their ids to ids; returns the row width"""
+        for page_ids, embeddings in pages:
+            matrix = np.asarray(embeddings, dtype=dtype)
+            if dims and matrix.shape[1] != dims:
+                raise ValueError(f"Cannot add {matrix.shape[1]}-dimensional vectors to a {dims}-dimensional index")
+            dims = matrix.shape[1]
+            f.write(matrix.astype(matrix.dtype.newbyteorder("<"), copy=False).tobytes())
+            ids.extend(page_ids)
+        return dims
+
+    @staticmethod
+    def _commit(path: Path, matrix: str, ids: List[Optional[str]], dims: int, dtype):
+        """
+        Atomically replace the manifest, the point at which written rows become visible:
+        a fixed header with the row count, width, dtype and matrix file name, then the JSON ids
+        """
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            header = _MAGIC + struct.pack("<QQ", len(ids), dims) + np.dtype(dtype).str.encode("ascii").ljust(8)
+            f.write(header + matrix.encode("ascii").ljust(_HEADER_SIZE - len(header)))
+            f.write(json.dumps(ids).encode("utf-8"))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def manifest(path: Path, with_ids: bool = True) -> Optional[Dict[str, Any]]:
+        """Row count, width, dtype, matrix file and row ids of an appendable index; None for a single-file one"""
+        with open(path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+            if header[:len(_MAGIC_V1)] == _MAGIC_V1:
+                return None
+            if header[:len(_MAGIC)] != _MAGIC:
+                raise ValueError(f"{path} is not an exact index")
+            rows, dims = struct.unpack("<QQ", header[len(_MAGIC):len(_MAGIC) + 16])
+            return {
+                "rows": rows,
+                "dims": dims,
+                "dtype": header[len(_MAGIC) + 16:len(_MAGIC) + 24].strip().decode("ascii"),
+                "matrix": header[len(_MAGIC) + 24:].strip().decode("ascii"),
+                "ids": json.loads(f.read()) if with_ids else None
+            }
+
+    @staticmethod
+    def write(
+        path: Path,
+        pages: Iterable[Tuple[List[str], List[List[float]]]],
+        dtype: str = settings.EXACT_SEARCH_DTYPE
+    ) -> int:
+        """
+        Stream (ids, embeddings) pages into a new contiguous row-major matrix file, then
+        swap in a manifest naming it and delete the matrix it replaces. Searches still
+        mapping the old matrix keep reading it until they finish. Returns the number of
+        rows written.
+        """
+        ids: List[Optional[str]] = []
+        matrix = f"{path.stem}.{uuid.uuid4().hex[:12]}.mat"
+        with open(path.parent / matrix, "wb") as f:
+            dims = ExactIndex._write_rows(f, pages, ids, 0, dtype)
+        ExactIndex._commit(path, matrix, ids, dims, dtype)
+        for old in path.parent.glob(f"{path.stem}.*.mat"):
+            if old.name != matrix:
+                old.unlink(missing_ok=True)
+        return len(ids)
+
+    @staticmethod
+    def append(
+        path: Path,
+        pages: Iterable[Tuple[List[str], List[List[float]]]],
+        removed: Iterable[str] = ()
+    ) -> int:
+        """
+        Write pages after the last committed row of the matrix and mark removed ids as
+        deleted, without reading or rewriting the stored rows. Returns the rows appended.
+        """
+        manifest = ExactIndex.manifest(path)
+        if manifest is None:
+            raise ValueError(f"{path} predates appendable exact indexes and must be rewritten")
+        removed = set(removed)
+        ids = [None if chunk_id in removed else chunk_id for chunk_id in manifest["ids"]]
+        committed = len(ids)
+        dtype = np.dtype(manifest["dtype"])
+        with open(path.parent / manifest["matrix"], "r+b") as f:
+            # Rows past the manifest were left by an interrupted append
+            f.truncate(committed * manifest["dims"] * dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            dims = ExactIndex._write_rows(f, pages, ids, manifest["dims"], dtype)
+            f.flush()
+            os.fsync(f.fileno())
+        ExactIndex._commit(path, manifest["matrix"], ids, dims, dtype)
+        return len(ids) - committed
+
+    @classmethod
+    def load(cls, path: Path, space: str = "l2") -> "ExactIndex":
+        with open(path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+        if header[:len(_MAGIC_V1)] == _MAGIC_V1:
+            with open(path, "rb") as f:
+                rows, dims, ids_offset = struct.unpack("<QQQ", header[len(_MAGIC_V1):len(_MAGIC_V1) + 24])
+                dtype = np.dtype(header[len(_MAGIC_V1) + 24:len(_MAGIC_V1) + 32].strip().decode("ascii"))
+                f.seek(ids_offset)
+                ids = json.loads(f.read())
+            matrix, offset = path, _HEADER_SIZE
+        else:
+            manifest = cls.manifest(path)
+            ids, dims, dtype = manifest["ids"], manifest["dims"], np.dtype(manifest["dtype"])
+            rows, matrix, offset = len(ids), path.parent / manifest["matrix"], 0
+        if rows:
+            vectors = np.memmap(matrix, dtype=dtype, mode="r", offset=offset, shape=(rows, dims))
+        else:
+            vectors = np.zeros((0, dims), dtype=dtype)
+        return cls(ids, vectors, space)
+
+    def mask(self, ids: Iterable[str]) -> np.ndarray:
+        """Boolean row mask selecting the given chunk ids"""
+        allowed = np.zeros(len(self.ids), dtype=bool)
+        positions = [self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions]
+        allowed[positions] = True
+        return allowed
+
+    def search(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        allowed: Optional[np.ndarray] = None
+    ) -> List[Tuple[List[str], List[float]]]:
+        """Exact top k (ids, distances) per query, nearest first, optionally restricted to a row mask"""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if not len(self.ids):
+            return [([], []) for _ in queries]
+        if self._live is not None:
+            allowed = self._live if allowed is None else allowed & self._live
+        sq_norms = self.sq_norms()
+        all_distances = np.concatenate([
+            distances(queries, block, sq_norms[start:start + len(block)], self.space)
+            for start, block in self._blocks()
+        ], axis=1)
+        if allowed is not None:
+            all_distances[:, ~allowed] = np.inf
+            k = min(k, int(allowed.sum()))
+        k = min(k, len(self.ids))
+        if k <= 0:
+            return [([], []) for _ in queries]
+
+        top = np.argpartition(all_distances, k - 1, axis=1)[:, :k]
+        top_distances = np.take_along_axis(all_distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_distances = np.take_along_axis(top_distances, order, axis=1)
+        return [
+            ([self.ids[i] for i in rows], [float(d) for d in row_distances])
+            for rows, row_distances in zip(top, top_distances)
+        ]
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "vectors": len(self._positions),
+            "deleted_rows": self.tombstones,
+            "dimensions": int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0,
+            "dtype": str(self.vectors.dtype),
+            "matrix_bytes": int(self.vectors.nbytes),
+        }
+
+
+def index_bytes(path: Path) -> int:
+    """Size on disk of the exact index at path with the matrix it names, 0 if there is none"""
+    try:
+        size = path.stat().st_size
+        manifest = ExactIndex.manifest(path, with_ids=False)
+    except FileNotFoundError:
+        return 0
+    if manifest is not None:
+        size += (path.parent / manifest["matrix"]).stat().st_size
+    return size
+
+
+_indexes: Dict[str, Tuple[int, ExactIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+def unload_exact_index(path: Path):
+    """Drop the cached index; its memory map is closed once no running search holds it"""
+    with _indexes_lock:
+        _indexes.pop(str(path), None)
+
+
+def load_exact_index(path: Path, space: str = "l2") -> Optional[ExactIndex]:
+    """Return the exact index stored at path, reloading it only when the file has been rewritten"""
+    key = str(path)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        with _indexes_lock:
+            _indexes.pop(key, None)
+        return None
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == mtime and cached[1].space == space:
+            return cached[1]
+    index = ExactIndex.load(path, space)
+    with _indexes_lock:
+        _indexes[key] = (mtime, index)
+    return index
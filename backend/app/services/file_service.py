@@ -1,5 +1,7 @@
-from typing import List, Dict, Any, BinaryIO
+from typing import List, Dict, Any, BinaryIO, NamedTuple, Optional, Iterator
 import os
+import hashlib
+import shutil
 from pathlib import Path
 import magic
 import PyPDF2
@@ -12,6 +14,16 @@ from ..core.config import get_settings
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+class FileTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size limit"""
+
+
+class SavedFile(NamedTuple):
+    path: Path
+    size: int
+    sha256: str
+
+
 class FileService:
     SUPPORTED_MIMETYPES = {
         'text/plain': '.txt',
@@ -20,6 +32,11 @@ class FileService:
         'application/json': '.json',
     }
 
+    CHUNK_SIZE = 1024 * 1024  # Bytes copied per read when streaming uploads
+    TEXT_BLOCK_SIZE = 64 * 1024  # Characters per segment when streaming text files
+    CSV_BLOCK_ROWS = 1000  # Rows per segment when streaming CSV files
+    STAGING_DIRNAME = ".staged"  # Appended files wait here until the append that indexes them succeeds
+
     def __init__(self):
         self.upload_dir = settings.UPLOAD_DIR
         os.makedirs(self.upload_dir, exist_ok=True)
@@ -34,18 +51,47 @@ class FileService:
         
         return mime
 
-    async def save_file(self, file: UploadFile, filename: str, database_id: str) -> Path:
-        """Save uploaded file to disk"""
+    async def save_file(
+        self,
+        file: UploadFile,
+        filename: str,
+        database_id: str,
+        max_size: Optional[int] = None,
+        staged: bool = False
+    ) -> SavedFile:
+        """
+        Stream uploaded file to disk in fixed-size chunks, hashing as it goes. A staged file
+        is kept apart and replaces the stored file of the same name only through commit_staged.
+        """
         database_dir = Path(self.upload_dir) / database_id
+        if staged:
+            database_dir = database_dir / self.STAGING_DIRNAME
         database_dir.mkdir(parents=True, exist_ok=True)
         
-        file_path = database_dir / filename
-        content = await file.read()
-        with open(file_path, 'wb') as f:
-            f.write(content)
+        max_size = settings.MAX_UPLOAD_SIZE if max_size is None else max_size
+        file_path = database_dir / Path(filename).name  # Drop any client-supplied directories
+        digest = hashlib.sha256()
+        size = 0
+        
+        try:
+            with open(file_path, 'wb') as f:
+                while True:
+                    chunk = await file.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_size:
+                        raise FileTooLargeError(
+                            f"File {filename} exceeds the maximum upload size of {max_size} bytes"
+                        )
+                    digest.update(chunk)
+                    f.write(chunk)
+        except Exception:
+            file_path.unlink(missing_ok=True)
+            raise
         
         await file.seek(0)  # Reset file pointer for future reads
-        return file_path
+        return SavedFile(path=file_path, size=size, sha256=digest.hexdigest())
 
     def read_file(self, file_path: Path) -> str:
         """Read file content based on file type"""
@@ -62,35 +108,81 @@ class FileService:
         else:
             raise ValueError(f"Unsupported file type: {mime}")
 
+    def iter_file_text(self, file_path: Path) -> Iterator[str]:
+        """Yield file content segment by segment (PDF pages, text blocks, CSV row groups)"""
+        mime = magic.from_file(str(file_path), mime=True)
+        
+        if mime == 'text/plain':
+            return self._iter_text_blocks(file_path)
+        elif mime == 'application/pdf':
+            return self._iter_pdf_pages(file_path)
+        elif mime == 'text/csv':
+            return self._iter_csv_blocks(file_path)
+        elif mime == 'application/json':
+            # json has no incremental parser in the stdlib, the document is loaded whole
+            return iter([self._read_json_file(file_path)])
+        else:
+            raise ValueError(f"Unsupported file type: {mime}")
+
     def _read_text_file(self, file_path: Path) -> str:
         """Read text file"""
         with open(file_path, 'r', encoding='utf-8') as f:
             return f.read()
 
+    def _iter_text_blocks(self, file_path: Path) -> Iterator[str]:
+        """Read text file in blocks of roughly TEXT_BLOCK_SIZE characters, split on line boundaries"""
+        block = []
+        block_size = 0
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                block.append(line)
+                block_size += len(line)
+                if block_size >= self.TEXT_BLOCK_SIZE:
+                    yield ''.join(block)
+                    block = []
+                    block_size = 0
+        if block:
+            yield ''.join(block)
+
     def _read_pdf_file(self, file_path: Path) -> str:
         """Read PDF file"""
-        text = []
+        return '\n'.join(self._iter_pdf_pages(file_path))
+
+    def _iter_pdf_pages(self, file_path: Path) -> Iterator[str]:
+        """Read PDF file one page at a time"""
         with open(file_path, 'rb') as f:
             pdf_reader = PyPDF2.PdfReader(f)
             for page in pdf_reader.pages:
-                text.append(page.extract_text())
-        return '\n'.join(text)
+                yield page.extract_text()
 
     def _read_csv_file(self, file_path: Path) -> str:
         """Read CSV file"""
         df = pd.read_csv(file_path)
         return df.to_string()
 
+    def _iter_csv_blocks(self, file_path: Path) -> Iterator[str]:
+        """Read CSV file in groups of CSV_BLOCK_ROWS rows, each rendered with its header"""
+        for df in pd.read_csv(file_path, chunksize=self.CSV_BLOCK_ROWS):
+            yield df.to_string()
+
     def _read_json_file(self, file_path: Path) -> str:
         """Read JSON file"""
         with open(file_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         return json.dumps(data, indent=2)
 
+    def commit_staged(self, database_id: str, paths: List[Path]):
+        """Move staged files over the database's stored files of the same name"""
+        database_dir = Path(self.upload_dir) / database_id
+        for path in paths:
+            os.replace(path, database_dir / path.name)
+
+    def discard_staged(self, database_id: str):
+        """Delete the database's staged files that were never committed"""
+        shutil.rmtree(Path(self.upload_dir) / database_id / self.STAGING_DIRNAME, ignore_errors=True)
+
     def cleanup_files(self, database_id: str):
         """Clean up files for a database"""
         database_dir = Path(self.upload_dir) / database_id
         if database_dir.exists():
-            for file_path in database_dir.glob('*'):
-                file_path.unlink()
-            database_dir.rmdir()
+            shutil.rmtree(database_dir)
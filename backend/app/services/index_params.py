@@ -0,0 +1,47 @@
+from typing import Dict, Any, Optional, NamedTuple
+from .exact_index import SPACES
+
+
+class IndexParams(NamedTuple):
+    space: str  # Distance metric: l2, ip or cosine
+    M: int  # Graph neighbours per node: memory and recall grow with it
+    construction_ef: int  # Candidate list size while inserting: build time and graph quality
+    search_ef: int  # Candidate list size while searching: latency and recall
+
+    def collection_metadata(self) -> Dict[str, Any]:
+        """Chroma collection metadata that configures the HNSW index"""
+        return {
+            "hnsw:space": self.space,
+            "hnsw:M": self.M,
+            "hnsw:construction_ef": self.construction_ef,
+            "hnsw:search_ef": self.search_ef,
+        }
+
+
+# "balanced" matches Chroma's own defaults
+INDEX_PRESETS: Dict[str, IndexParams] = {
+    "fast": IndexParams("l2", 12, 64, 32),
+    "balanced": IndexParams("l2", 16, 100, 100),
+    "high-recall": IndexParams("l2", 32, 200, 256),
+}
+DEFAULT_PRESET = "balanced"
+
+
+def resolve_index_params(
+    preset: Optional[str] = None,
+    space: Optional[str] = None,
+    M: Optional[int] = None,
+    construction_ef: Optional[int] = None,
+    search_ef: Optional[int] = None
+) -> IndexParams:
+    """Start from a preset and override it with any parameter given explicitly"""
+    preset = preset or DEFAULT_PRESET
+    if preset not in INDEX_PRESETS:
+        raise ValueError(f"Unknown index preset {preset}, expected one of {', '.join(INDEX_PRESETS)}")
+    if space is not None and space not in SPACES:
+        raise ValueError(f"Unknown distance space {space}, expected one of {', '.join(SPACES)}")
+    for name, value in (("M", M), ("construction_ef", construction_ef), ("search_ef", search_ef)):
+        if value is not None and value < 1:
+            raise ValueError(f"{name} must be a positive integer")
+    overrides = {"space": space, "M": M, "construction_ef": construction_ef, "search_ef": search_ef}
+    return INDEX_PRESETS[preset]._replace(**{key: value for key, value in overrides.items() if value is not None})
@@ -0,0 +1,326 @@
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Callable, Set
+import json
+import hashlib
+import queue
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from .file_service import FileService
+from .embedding_service import EmbeddingService
+from .job_service import JobService
+from .tokenizer import get_tokenizer
+from .dedup_service import ChunkDeduplicator
+from .query_cache import get_query_result_cache
+from ..core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_DONE = object()  # Marks the end of a stage's output
+
+
+def chunk_id(source: str, text: str) -> str:
+    """Stable vector id derived from a chunk's source file and content"""
+    return hashlib.sha256(f"{source}\n{text}".encode("utf-8")).hexdigest()
+
+
+class _StageFailed(Exception):
+    """Carries an exception raised inside a pipeline stage to the caller"""
+
+
+class ChunkWriter:
+    """Append chunks to a JSON array file without holding them in memory"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+        self._count = 0
+
+    def __enter__(self):
+        self._file = open(self.path, "w")
+        self._file.write("[")
+        return self
+
+    def write(self, chunks: List[Dict[str, Any]]):
+        for chunk in chunks:
+            self._file.write(",\n" if self._count else "\n")
+            self._file.write(json.dumps(chunk))
+            self._count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.write("\n]" if self._count else "]")
+        self._file.close()
+        return False
+
+
+class IngestionPipeline:
+    """
+    Extract -> chunk -> embed -> write pipeline with bounded queues between stages.
+    Extraction and embedding run on their own threads; the caller's thread writes to Chroma.
+    Each queue holds at most `queue_size` batches, so memory stays constant regardless of corpus size.
+    """
+
+    def __init__(
+        self,
+        file_service: FileService,
+        embedding_service: EmbeddingService,
+        job_service: Optional[JobService] = None,
+        queue_size: int = settings.INGESTION_QUEUE_BATCHES,
+        embed_batch_size: int = settings.EMBEDDING_BATCH_SIZE,
+        embed_batch_tokens: int = settings.EMBEDDING_BATCH_TOKENS,
+        write_batch_size: int = settings.CHROMA_WRITE_BATCH_SIZE,
+        embed_window: int = settings.EMBEDDING_CONCURRENCY
+    ):
+        self.file_service = file_service
+        self.embedding_service = embedding_service
+        self.job_service = job_service
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size
+        self.embed_batch_tokens = embed_batch_tokens
+        self.write_batch_size = write_batch_size
+        self.embed_window = embed_window
+        self.result_cache = get_query_result_cache()
+
+    def run(
+        self,
+        collection,
+        saved_files: List[Tuple[str, Path]],
+        database_id: str,
+        model: str,
+        chunk_size: int = 512,
+        job_id: Optional[str] = None,
+        chunk_sink: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+        seen_ids: Optional[Set[str]] = None,
+        deduplicator: Optional[ChunkDeduplicator] = None,
+        file_metadata: Optional[Dict[str, Dict[str, Any]]] = None,
+        dimensions: Optional[int] = None
+    ) -> int:
+        """
+        Ingest saved files into a collection, returning the number of vectors written.
+        Chunks whose id is already in the collection are not re-embedded. When seen_ids
+        is given, it collects the id of every chunk kept, written or not. When a
+        deduplicator is given, duplicate chunks are dropped before embedding. file_metadata
+        maps filenames to extra metadata stored on each of their chunks. dimensions is
+        the database's reduced embedding width, if it declared one.
+        """
+        stop = threading.Event()
+        chunk_queue = queue.Queue(maxsize=self.queue_size)
+        vector_queue = queue.Queue(maxsize=self.queue_size)
+
+        stages = [
+            threading.Thread(
+                target=self._run_stage,
+                args=(self._extract, (saved_files, database_id, model, chunk_size, job_id, seen_ids, deduplicator, file_metadata or {}), chunk_queue, stop),
+                name=f"extract-{database_id}",
+                daemon=True
+            ),
+            threading.Thread(
+                target=self._run_stage,
+                args=(self._embed, (collection, chunk_queue, model, job_id, stop, dimensions), vector_queue, stop),
+                name=f"embed-{database_id}",
+                daemon=True
+            ),
+        ]
+        for stage in stages:
+            stage.start()
+
+        try:
+            return self._write(collection, vector_queue, database_id, job_id, chunk_sink)
+        finally:
+            # Unblock and drain upstream stages if the writer stopped early
+            stop.set()
+            for q in (chunk_queue, vector_queue):
+                self._drain(q)
+            for stage in stages:
+                stage.join()
+
+    def _run_stage(self, produce: Callable[..., Iterator[Any]], args: tuple, out: queue.Queue, stop: threading.Event):
+        """Run a stage generator, forwarding its items (or its failure) downstream"""
+        try:
+            for item in produce(*args):
+                if not self._put(out, item, stop):
+                    return
+            self._put(out, _DONE, stop)
+        except Exception as e:
+            logger.error(f"Ingestion stage {threading.current_thread().name} failed: {str(e)}")
+            self._put(out, _StageFailed(e), stop)
+
+    def _extract(
+        self,
+        saved_files: List[Tuple[str, Path]],
+        database_id: str,
+        model: str,
+        chunk_size: int,
+        job_id: Optional[str],
+        seen_ids: Optional[Set[str]],
+        deduplicator: Optional[ChunkDeduplicator],
+        file_metadata: Dict[str, Dict[str, Any]]
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yield batches of chunks with metadata, parsing files page by page. Batches are packed
+        up to embed_batch_size chunks or embed_batch_tokens tokens, and chunks longer than the
+        model's input limit are split into consecutive pieces so none is silently truncated.
+        """
+        tokenizer = get_tokenizer(model)
+        batch = []
+        batch_tokens = 0
+        for filename, file_path in saved_files:
+            dropped = 0
+            segments = self.file_service.iter_file_text(file_path)
+            for chunk in self.embedding_service.iter_chunks(segments, chunk_size):
+                for piece in tokenizer.split(chunk):
+                    piece_id = chunk_id(filename, piece)
+                    metadata = {
+                        **file_metadata.get(filename, {}),
+                        'source': filename,
+                        'database_id': database_id
+                    }
+                    if deduplicator is not None and not deduplicator.check(piece_id, piece, metadata):
+                        dropped += 1
+                        continue
+                    if seen_ids is not None:
+                        seen_ids.add(piece_id)
+                    
+                    tokens = tokenizer.count(piece)
+                    if batch and (len(batch) >= self.embed_batch_size or batch_tokens + tokens > self.embed_batch_tokens):
+                        yield batch
+                        batch = []
+                        batch_tokens = 0
+                    batch.append({
+                        'id': piece_id,
+                        'text': piece,
+                        'metadata': metadata
+                    })
+                    batch_tokens += tokens
+            self._progress(job_id, files_parsed=1, chunks_deduplicated=dropped)
+        if batch:
+            yield batch
+
+    def _embed(
+        self,
+        collection,
+        chunk_queue: queue.Queue,
+        model: str,
+        job_id: Optional[str],
+        stop: threading.Event,
+        dimensions: Optional[int] = None
+    ) -> Iterator[Tuple[List[Dict[str, Any]], List[List[float]]]]:
+        """Yield (chunks, embeddings) for each batch read from the extract stage, in order"""
+        # Keep up to embed_window batches in flight so the dispatcher can overlap round-trips
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.embed_window, thread_name_prefix="embed") as executor:
+            try:
+                for batch in self._iter_queue(chunk_queue, stop):
+                    # Repeated text in one source repeats its id, which Chroma rejects within one call
+                    unique = {}
+                    for chunk in batch:
+                        unique.setdefault(chunk['id'], chunk)
+                    batch = list(unique.values())
+                    # Only embed chunks the collection does not already hold
+                    existing = set(collection.get(ids=[chunk['id'] for chunk in batch], include=[])["ids"])
+                    if existing:
+                        batch = [chunk for chunk in batch if chunk['id'] not in existing]
+                        if not batch:
+                            continue
+                    texts = [chunk['text'] for chunk in batch]
+                    in_flight.append((batch, executor.submit(self.embedding_service.get_embeddings, texts, model, dimensions)))
+                    if len(in_flight) >= self.embed_window:
+                        yield self._finish_embedding(in_flight.popleft(), job_id)
+                while in_flight:
+                    yield self._finish_embedding(in_flight.popleft(), job_id)
+            finally:
+                for _, future in in_flight:
+                    future.cancel()
+
+    def _finish_embedding(
+        self,
+        pending: Tuple[List[Dict[str, Any]], Future],
+        job_id: Optional[str]
+    ) -> Tuple[List[Dict[str, Any]], List[List[float]]]:
+        batch, future = pending
+        embeddings = future.result()
+        self._progress(job_id, chunks_embedded=len(batch))
+        return batch, embeddings
+
+    def _write(
+        self,
+        collection,
+        vector_queue: queue.Queue,
+        database_id: str,
+        job_id: Optional[str],
+        chunk_sink: Optional[Callable[[List[Dict[str, Any]]], None]]
+    ) -> int:
+        """Write embedded chunks to the collection in batches of write_batch_size"""
+        written = 0
+        pending_chunks = []
+        pending_embeddings = []
+
+        def flush(count: int):
+            nonlocal written, pending_chunks, pending_embeddings
+            chunks, pending_chunks = pending_chunks[:count], pending_chunks[count:]
+            embeddings, pending_embeddings = pending_embeddings[:count], pending_embeddings[count:]
+            # A repeated chunk yields a repeated id, which Chroma rejects within one call
+            unique = {}
+            for chunk, embedding in zip(chunks, embeddings):
+                unique.setdefault(chunk['id'], (chunk, embedding))
+            collection.upsert(
+                embeddings=[embedding for _, embedding in unique.values()],
+                documents=[chunk['text'] for chunk, _ in unique.values()],
+                metadatas=[chunk['metadata'] for chunk, _ in unique.values()],
+                ids=list(unique)
+            )
+            if self.result_cache:
+                self.result_cache.bump_generation(database_id)
+            if chunk_sink:
+                chunk_sink(chunks)
+            written += len(chunks)
+            self._progress(job_id, vectors_written=len(chunks))
+
+        for chunks, embeddings in self._iter_queue(vector_queue, None):
+            pending_chunks.extend(chunks)
+            pending_embeddings.extend(embeddings)
+            while len(pending_chunks) >= self.write_batch_size:
+                flush(self.write_batch_size)
+        if pending_chunks:
+            flush(len(pending_chunks))
+        return written
+
+    def _iter_queue(self, q: queue.Queue, stop: Optional[threading.Event]) -> Iterator[Any]:
+        """Yield items from an upstream queue until it finishes, re-raising upstream failures"""
+        while True:
+            try:
+                item = q.get(timeout=0.5)
+            except queue.Empty:
+                if stop is not None and stop.is_set():
+                    return
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, _StageFailed):
+                raise item.args[0]
+            yield item
+
+    @staticmethod
+    def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        """Block until there is room downstream, giving up if the pipeline is stopping"""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _drain(q: queue.Queue):
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                return
+
+    def _progress(self, job_id: Optional[str], **counters: int):
+        if self.job_service and job_id:
+            self.job_service.increment_progress(job_id, **counters)
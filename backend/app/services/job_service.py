@@ -0,0 +1,167 @@
+from typing import List, Dict, Any, Optional, Callable
+import uuid
+import json
+import threading
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from ..core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Process-wide worker pool shared by every JobService instance. The semaphore
+# bounds running + waiting jobs so a burst of uploads cannot queue unbounded work.
+_executor = ThreadPoolExecutor(
+    max_workers=settings.INGESTION_WORKERS,
+    thread_name_prefix="ingestion"
+)
+_slots = threading.BoundedSemaphore(settings.INGESTION_WORKERS + settings.INGESTION_QUEUE_SIZE)
+_lock = threading.Lock()
+
+PROGRESS_FIELDS = ("files_parsed", "chunks_deduplicated", "chunks_embedded", "vectors_written")
+
+
+class JobQueueFullError(Exception):
+    """Raised when the ingestion queue has no free slots"""
+
+
+class JobService:
+    def __init__(self):
+        self.jobs_dir = Path(settings.JOBS_DIR)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _write_job(self, job: Dict[str, Any]):
+        """Atomically persist a job record"""
+        job_path = self._job_path(job["id"])
+        tmp_path = job_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        tmp_path.replace(job_path)
+
+    def create_job(
+        self,
+        database_id: str,
+        file_count: int,
+        user_id: Optional[str] = None,
+        kind: str = "build"
+    ) -> Dict[str, Any]:
+        """Create and persist a queued job record. kind is "build" for a new database or "append" for added files"""
+        current_time = datetime.now(timezone.utc).isoformat()
+        job = {
+            "id": str(uuid.uuid4()),
+            "database_id": database_id,
+            "kind": kind,
+            "created_by": user_id,
+            "status": "queued",
+            "file_count": file_count,
+            "files_parsed": 0,
+            "chunks_deduplicated": 0,
+            "chunks_embedded": 0,
+            "vectors_written": 0,
+            "error_message": None,
+            "created_at": current_time,
+            "updated_at": current_time,
+            "started_at": None,
+            "finished_at": None,
+        }
+        with _lock:
+            self._write_job(job)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job record by ID"""
+        job_path = self._job_path(job_id)
+        if not job_path.exists():
+            return None
+        try:
+            with open(job_path) as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error reading job {job_id}: {str(e)}")
+            return None
+
+    def update_job(self, job_id: str, updates: Dict[str, Any]) -> bool:
+        """Update fields of a job record"""
+        with _lock:
+            job = self.get_job(job_id)
+            if not job:
+                return False
+            job.update(updates)
+            job["updated_at"] = datetime.now(timezone.utc).isoformat()
+            self._write_job(job)
+            return True
+
+    def increment_progress(self, job_id: str, **counters: int) -> bool:
+        """Add to the progress counters of a job"""
+        with _lock:
+            job = self.get_job(job_id)
+            if not job:
+                return False
+            for field, value in counters.items():
+                if field not in PROGRESS_FIELDS:
+                    raise ValueError(f"Unknown progress field: {field}")
+                job[field] = job.get(field, 0) + value
+            job["updated_at"] = datetime.now(timezone.utc).isoformat()
+            self._write_job(job)
+            return True
+
+    def reserve_slot(self):
+        """
+        Claim a place in the ingestion queue before any work is done for a job, raising
+        JobQueueFullError if it is saturated. The slot passes to the job on submit;
+        release_slot gives it back if the job is never submitted.
+        """
+        if not _slots.acquire(blocking=False):
+            raise JobQueueFullError("Ingestion queue is full, try again later")
+
+    def release_slot(self):
+        _slots.release()
+
+    def delete_job(self, job_id: str):
+        """Remove the record of a job that was never submitted"""
+        with _lock:
+            self._job_path(job_id).unlink(missing_ok=True)
+
+    def submit(self, job_id: str, fn: Callable[[], Any]):
+        """Hand a job's work to the worker pool on a slot claimed with reserve_slot"""
+        def run():
+            try:
+                self.update_job(job_id, {
+                    "status": "running",
+                    "started_at": datetime.now(timezone.utc).isoformat()
+                })
+                fn()
+                self.update_job(job_id, {
+                    "status": "completed",
+                    "finished_at": datetime.now(timezone.utc).isoformat()
+                })
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                self.update_job(job_id, {
+                    "status": "error",
+                    "error_message": str(e),
+                    "finished_at": datetime.now(timezone.utc).isoformat()
+                })
+            finally:
+                _slots.release()
+
+        _executor.submit(run)
+
+    def fail_interrupted_jobs(self) -> List[Dict[str, Any]]:
+        """Mark jobs left queued or running by a previous process as failed"""
+        failed = []
+        for job_path in self.jobs_dir.glob("*.json"):
+            job = self.get_job(job_path.stem)
+            if job and job.get("status") in ("queued", "running"):
+                self.update_job(job["id"], {
+                    "status": "error",
+                    "error_message": "Job interrupted by server restart",
+                    "finished_at": datetime.now(timezone.utc).isoformat()
+                })
+                failed.append(job)
+        return failed
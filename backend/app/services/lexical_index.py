@@ -0,0 +1,315 @@
+from typing import List, Dict, Optional, Tuple, Iterable, Iterator, BinaryIO, Collection
+from array import array
+from collections import Counter
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import logging
+from pathlib import Path
+import numpy as np
+from ..core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+INDEX_FILENAME = "lexical.idx"
+_MAGIC = b"BM25IDX1"
+
+# Identifiers such as "X-99", "E1234" or "v2.3.1" are kept whole and also split into parts
+_TOKEN_RE = re.compile(r"\w+(?:[-_./:]\w+)*")
+_PART_RE = re.compile(r"[-_./:]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        parts = _PART_RE.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+def encode_varints(values: np.ndarray) -> bytes:
+    """LEB128-encode non-negative integers, 7 bits per byte with a continuation flag"""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b""
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += values >= np.uint64(1 << (7 * k))
+    offsets = np.cumsum(nbytes) - nbytes
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for k in range(int(nbytes.max())):
+        mask = nbytes > k
+        chunk = ((values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)).astype(np.uint8)
+        chunk[nbytes[mask] > k + 1] |= 0x80
+        out[offsets[mask] + k] = chunk
+    return out.tobytes()
+
+
+def decode_varints(data: bytes) -> np.ndarray:
+    """Inverse of encode_varints, vectorised over the whole buffer"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not len(raw):
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(raw)) - np.repeat(starts, ends - starts + 1)
+    shifted = (raw & 0x7F).astype(np.uint64) << (position.astype(np.uint64) * np.uint64(7))
+    return np.add.reduceat(shifted, starts)
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of one collection.
+    Postings are (doc gap, term frequency) pairs stored as varints, one block per term;
+    a query decodes only the blocks of its own terms.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        doc_lengths: np.ndarray,
+        terms: Dict[str, Tuple[int, int, int]],
+        postings: bytes,
+        k1: float = settings.LEXICAL_BM25_K1,
+        b: float = settings.LEXICAL_BM25_B
+    ):
+        self.ids = ids
+        self.doc_lengths = doc_lengths.astype(np.float32)
+        self.terms = terms  # term -> (offset, length, document frequency)
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(self.doc_lengths.mean()) if len(ids) else 0.0
+        # Per-document part of the BM25 denominator, computed once
+        self._length_norm = k1 * (1 - b + b * self.doc_lengths / (self.avg_length or 1.0))
+        self._positions: Optional[Dict[str, int]] = None  # Built by the first filtered search, see mask
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex":
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{path} is not a lexical index")
+            header_length, doc_count = struct.unpack("<QQ", f.read(16))
+            header = json.loads(f.read(header_length))
+            doc_lengths = np.frombuffer(f.read(4 * doc_count), dtype="<u4")
+            postings = f.read()
+        terms = {term: tuple(entry) for term, entry in header["terms"].items()}
+        return cls(header["ids"], doc_lengths, terms, postings)
+
+    def _postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        offset, length, _ = entry
+        pairs = decode_varints(self.postings[offset:offset + length]).reshape(-1, 2)
+        return np.cumsum(pairs[:, 0]).astype(np.int64), pairs[:, 1].astype(np.float32)
+
+    def mask(self, ids: Iterable[str]) -> np.ndarray:
+        """Boolean document mask selecting the given chunk ids"""
+        if self._positions is None:
+            self._positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        allowed = np.zeros(len(self.ids), dtype=bool)
+        allowed[[self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions]] = True
+        return allowed
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        Top k (chunk id, BM25 score) pairs for a query, best first, optionally restricted to a
+        document mask. Restricted postings are dropped before scoring; idf stays corpus-wide.
+        """
+        doc_count = len(self.ids)
+        scores = None
+        for term in set(tokenize(query)):
+            postings = self._postings(term)
+            if postings is None:
+                continue
+            docs, tfs = postings
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            if allowed is not None:
+                keep = allowed[docs]
+                docs, tfs = docs[keep], tfs[keep]
+            if scores is None:
+                scores = np.zeros(doc_count, dtype=np.float32)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self._length_norm[docs])
+        if scores is None:
+            return []
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.ids[doc], float(scores[doc])) for doc in matched]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "documents": len(self.ids),
+            "terms": len(self.terms),
+            "postings_bytes": len(self.postings),
+        }
+
+
+def _write_index_file(path: Path, ids: List[str], doc_lengths, terms: Dict[str, Tuple[int, int, int]], write_postings):
+    """Atomically write the index as magic, JSON header, document lengths and postings"""
+    header = json.dumps({"ids": ids, "terms": terms}).encode("utf-8")
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(struct.pack("<QQ", len(header), len(ids)))
+        f.write(header)
+        f.write(np.asarray(doc_lengths).astype("<u4").tobytes())
+        write_postings(f)
+    os.replace(tmp_path, path)
+
+
+def _spill_run(term_postings: Dict[str, array], f: BinaryIO):
+    """Write a block of postings as term-sorted records: term length, posting count, term, (doc, tf) pairs"""
+    for term in sorted(term_postings):
+        encoded = term.encode("utf-8")
+        pairs = term_postings[term]
+        f.write(struct.pack("<II", len(encoded), len(pairs) // 2))
+        f.write(encoded)
+        f.write(np.asarray(pairs, dtype="<u4").tobytes())
+
+
+def _read_run(path: Path, source: int) -> Iterator[Tuple[str, int, np.ndarray]]:
+    with open(path, "rb") as f:
+        while True:
+            record = f.read(8)
+            if not record:
+                return
+            term_length, count = struct.unpack("<II", record)
+            term = f.read(term_length).decode("utf-8")
+            yield term, source, np.frombuffer(f.read(8 * count), dtype="<u4").reshape(-1, 2)
+
+
+def _base_postings(base: "LexicalIndex", renumber: np.ndarray) -> Iterator[Tuple[str, int, np.ndarray]]:
+    """The postings of an existing index in term order, without removed documents and renumbered"""
+    for term in sorted(base.terms):
+        docs, tfs = base._postings(term)
+        docs = renumber[docs]
+        kept = docs >= 0
+        if kept.any():
+            yield term, 0, np.stack([docs[kept], tfs[kept].astype(np.int64)], axis=1)
+
+
+def write_lexical_index(
+    path: Path,
+    documents: Iterable[Tuple[str, str]],
+    base: Optional["LexicalIndex"] = None,
+    removed: Collection[str] = (),
+    block_postings: int = settings.LEXICAL_BUILD_BLOCK_POSTINGS
+) -> Dict[str, int]:
+    """
+    Index (chunk id, text) pairs into the file at path and return its stats. Postings are
+    collected in blocks of at most block_postings, each spilled to disk sorted by term, and the
+    blocks are merged term by term into the index, so memory does not grow with the corpus.
+    With a base index, its documents other than the removed ids are kept without reading
+    their text again and the given documents are added after them.
+    """
+    ids: List[str] = []
+    doc_lengths = array("I")
+    sources: List[Iterator[Tuple[str, int, np.ndarray]]] = []
+    if base is not None:
+        kept = np.array([chunk_id not in removed for chunk_id in base.ids], dtype=bool)
+        renumber = np.full(len(base.ids), -1, dtype=np.int64)
+        renumber[kept] = np.arange(int(kept.sum()))
+        ids.extend(chunk_id for chunk_id, keep in zip(base.ids, kept) if keep)
+        doc_lengths.extend(int(length) for length in base.doc_lengths[kept])
+        sources.append(_base_postings(base, renumber))
+
+    with tempfile.TemporaryDirectory(dir=path.parent, prefix=".lexical-") as tmp_dir:
+        runs: List[Path] = []
+        term_postings: Dict[str, array] = {}
+        buffered = 0
+
+        def spill():
+            run = Path(tmp_dir) / f"run-{len(runs)}"
+            with open(run, "wb") as f:
+                _spill_run(term_postings, f)
+            runs.append(run)
+            term_postings.clear()
+
+        for chunk_id, text in documents:
+            doc = len(ids)
+            ids.append(chunk_id)
+            tokens = tokenize(text or "")
+            doc_lengths.append(len(tokens))
+            counts = Counter(tokens)
+            for token, count in counts.items():
+                term_postings.setdefault(token, array("I")).extend((doc, count))
+            buffered += len(counts)
+            if buffered >= block_postings:
+                spill()
+                buffered = 0
+        if term_postings:
+            spill()
+        # Runs hold ascending document ranges, so concatenating a term's postings in run order keeps them sorted
+        sources.extend(_read_run(run, source) for source, run in enumerate(runs, start=1))
+
+        terms: Dict[str, Tuple[int, int, int]] = {}
+        postings_path = Path(tmp_dir) / "postings"
+        offset = 0
+        with open(postings_path, "wb") as out:
+            merged = heapq.merge(*sources, key=lambda record: (record[0], record[1]))
+            for term, records in itertools.groupby(merged, key=lambda record: record[0]):
+                pairs = np.concatenate([record[2] for record in records]).astype(np.uint64)
+                # Documents are in ascending order, so gaps are non-negative
+                pairs[1:, 0] = pairs[1:, 0] - pairs[:-1, 0]
+                block = encode_varints(pairs.reshape(-1))
+                terms[term] = (offset, len(block), len(pairs))
+                out.write(block)
+                offset += len(block)
+
+        def copy_postings(f: BinaryIO):
+            with open(postings_path, "rb") as postings:
+                shutil.copyfileobj(postings, f)
+
+        _write_index_file(path, ids, doc_lengths, terms, copy_postings)
+    return {"documents": len(ids), "terms": len(terms), "postings_bytes": offset}
+
+
+_indexes: Dict[str, Tuple[int, LexicalIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+def unload_lexical_index(path: Path):
+    """Forget the loaded postings of the index stored at path"""
+    with _indexes_lock:
+        _indexes.pop(str(path), None)
+
+
+def load_lexical_index(path: Path) -> Optional[LexicalIndex]:
+    """Return the index stored at path, reloading it only when the file has been rewritten"""
+    key = str(path)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        with _indexes_lock:
+            _indexes.pop(key, None)
+        return None
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    index = LexicalIndex.load(path)
+    with _indexes_lock:
+        _indexes[key] = (mtime, index)
+    return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = settings.HYBRID_RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists by summing 1 / (k + rank), best first"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
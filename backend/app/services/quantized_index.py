@@ -0,0 +1,410 @@
+from typing import List, Dict, Optional, Tuple, Any
+import json
+import os
+import struct
+import threading
+import logging
+from functools import partial
+from pathlib import Path
+import numpy as np
+from ..core.config import get_settings
+from .exact_index import ExactIndex, load_exact_index, INDEX_FILENAME as EXACT_INDEX_FILENAME, distances as exact_distances
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+INDEX_FILENAME = "quantized.idx"
+_MAGIC_V1 = b"PQINDEX1"  # Codes only, every search scans all of them
+_MAGIC = b"PQINDEX2"  # Codes and a coarse partition
+
+
+def subspace_count(dims: int, subspace_dims: int = settings.PQ_SUBSPACE_DIMS) -> int:
+    """Number of subspaces: dims split into chunks of subspace_dims, or the nearest smaller size that divides dims"""
+    for size in range(min(subspace_dims, dims), 0, -1):
+        if dims % size == 0:
+            return dims // size
+    return dims
+
+
+def _kmeans(points: np.ndarray, clusters: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Lloyd's k-means with squared distances from one matrix product per iteration"""
+    centroids = points[rng.choice(len(points), clusters, replace=False)].copy()
+    point_norms = np.einsum("ij,ij->i", points, points)[:, None]
+    for _ in range(iterations):
+        sq = point_norms - 2 * points @ centroids.T + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+        assignment = np.argmin(sq, axis=1)
+        counts = np.bincount(assignment, minlength=clusters).astype(np.float32)
+        # Per-cluster sums as a one-hot matrix product, much faster than np.add.at
+        one_hot = np.zeros((len(points), clusters), dtype=np.float32)
+        one_hot[np.arange(len(points)), assignment] = 1
+        sums = one_hot.T @ points
+        filled = counts > 0
+        # Empty clusters keep their previous centroid
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def _carry_over(
+    previous_ids: List[str],
+    previous: np.ndarray,
+    ids: List[str],
+    vectors: np.ndarray,
+    encode,
+    batch_size: int
+) -> Tuple[np.ndarray, int]:
+    """
+    Values for ids, whose rows are vectors, along the last axis: copied from previous for ids seen
+    before, since a chunk id fixes its text and so its vector, and computed by encode for the rest.
+    Rows of deleted chunks, whose id is None, are zero. Returns the values and the number of
+    vectors encoded.
+    """
+    seen = {chunk_id: i for i, chunk_id in enumerate(previous_ids) if chunk_id is not None}
+    columns = np.array([-2 if chunk_id is None else seen.get(chunk_id, -1) for chunk_id in ids], dtype=np.int64)
+    values = np.zeros(previous.shape[:-1] + (len(ids),), dtype=previous.dtype)
+    known = columns >= 0
+    values[..., known] = previous[..., columns[known]]
+    new_rows = np.flatnonzero(columns == -1)
+    for start in range(0, len(new_rows), batch_size):
+        rows = new_rows[start:start + batch_size]
+        values[..., rows] = encode(np.asarray(vectors[rows], dtype=np.float32))
+    return values, len(new_rows)
+
+
+class QuantizedIndex:
+    """
+    Product-quantized codes for the first pass with full-precision rescoring.
+    Each vector is split into subspaces and every slice is replaced by the byte id of its
+    nearest centroid, so 1536 float32 values become 96 bytes in RAM. A query builds one
+    distance table per subspace and scores codes with table lookups; the best candidates
+    are then rescored against the full-precision matrix memory-mapped from disk.
+
+    Indexes of at least PQ_IVF_MIN_VECTORS vectors also keep a coarse partition: k-means
+    lists over the full vectors. A query then scores only the codes in its PQ_IVF_PROBE
+    nearest lists, widened until they hold enough candidates, instead of every code.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        codebooks: np.ndarray,
+        codes: np.ndarray,
+        full: ExactIndex,
+        coarse: Optional[np.ndarray] = None,
+        lists: Optional[np.ndarray] = None
+    ):
+        self.ids = ids
+        self.codebooks = codebooks  # (subspaces, centroids, subspace dims)
+        self.codes = codes  # (subspaces, vectors), one contiguous row per subspace
+        self.full = full
+        self.space = full.space
+        self.coarse = coarse  # (lists, dims) centroids, None when every search scans all codes
+        self.lists = lists  # List of each vector
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(ids) if chunk_id is not None}
+        # Rows of the full-precision matrix, -1 where a chunk is missing from it or deleted
+        self._full_rows = np.array([full._positions.get(chunk_id, -1) for chunk_id in ids], dtype=np.int64)
+        if coarse is not None:
+            # Members of list l are _members[_bounds[l]:_bounds[l + 1]]
+            self._members = np.argsort(lists, kind="stable")
+            self._bounds = np.searchsorted(lists[self._members], np.arange(len(coarse) + 1))
+            self._usable_per_list = np.bincount(lists[self._full_rows >= 0], minlength=len(coarse))
+
+    @classmethod
+    def train(
+        cls,
+        vectors: np.ndarray,
+        subspace_dims: int = settings.PQ_SUBSPACE_DIMS,
+        sample: int = settings.PQ_TRAINING_SAMPLE,
+        iterations: int = settings.PQ_ITERATIONS
+    ) -> np.ndarray:
+        """Codebooks of up to 256 centroids per subspace, trained on a sample of the vectors"""
+        if not len(vectors):
+            raise ValueError("Cannot train product quantization codebooks without vectors")
+        rng = np.random.default_rng(0)
+        if len(vectors) > sample:
+            vectors = vectors[np.sort(rng.choice(len(vectors), sample, replace=False))]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        subspaces = subspace_count(vectors.shape[1], subspace_dims)
+        clusters = min(256, len(vectors))
+        split = vectors.reshape(len(vectors), subspaces, -1)
+        return np.stack([
+            _kmeans(np.ascontiguousarray(split[:, j]), clusters, iterations, rng) for j in range(subspaces)
+        ])
+
+    @staticmethod
+    def encode(codebooks: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """Nearest-centroid byte per subspace, returned subspace-major"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        subspaces = len(codebooks)
+        split = vectors.reshape(len(vectors), subspaces, -1)
+        codes = np.empty((subspaces, len(vectors)), dtype=np.uint8)
+        for j in range(subspaces):
+            centroids = codebooks[j]
+            sq = np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2 * split[:, j] @ centroids.T
+            codes[j] = np.argmin(sq, axis=1)
+        return codes
+
+    @staticmethod
+    def train_coarse(
+        vectors: np.ndarray,
+        lists: int,
+        sample: int = settings.PQ_TRAINING_SAMPLE,
+        iterations: int = settings.PQ_ITERATIONS
+    ) -> np.ndarray:
+        """Centroids of the coarse partition, k-means over a sample of the full vectors"""
+        rng = np.random.default_rng(0)
+        # Enough points per list for k-means to place every centroid
+        sample = min(len(vectors), max(sample, 32 * lists))
+        rows = np.sort(rng.choice(len(vectors), sample, replace=False))
+        return _kmeans(np.asarray(vectors[rows], dtype=np.float32), min(lists, sample), iterations, rng)
+
+    @staticmethod
+    def assign(coarse: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """Nearest coarse centroid of each vector"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        sq = np.einsum("ij,ij->i", coarse, coarse)[None, :] - 2 * vectors @ coarse.T
+        return np.argmin(sq, axis=1).astype(np.uint32)
+
+    @staticmethod
+    def write(
+        path: Path,
+        ids: List[str],
+        codebooks: np.ndarray,
+        codes: np.ndarray,
+        coarse: Optional[np.ndarray] = None,
+        lists: Optional[np.ndarray] = None
+    ):
+        """Atomically write magic, shape, codebooks, codes, the coarse partition and the JSON id list"""
+        subspaces, clusters, subspace_dims = codebooks.shape
+        list_count = 0 if coarse is None else len(coarse)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC)
+            f.write(struct.pack("<QQQQQ", subspaces, clusters, subspace_dims, codes.shape[1], list_count))
+            f.write(codebooks.astype("<f4").tobytes())
+            f.write(codes.astype(np.uint8).tobytes())
+            if list_count:
+                f.write(coarse.astype("<f4").tobytes())
+                f.write(lists.astype("<u4").tobytes())
+            f.write(json.dumps(ids).encode("utf-8"))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read(path: Path) -> Tuple[List[str], np.ndarray, np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+        """The ids, codebooks, codes, coarse centroids and lists stored at path"""
+        with open(path, "rb") as f:
+            magic = f.read(len(_MAGIC))
+            if magic == _MAGIC:
+                subspaces, clusters, subspace_dims, count, list_count = struct.unpack("<QQQQQ", f.read(40))
+            elif magic == _MAGIC_V1:
+                subspaces, clusters, subspace_dims, count = struct.unpack("<QQQQ", f.read(32))
+                list_count = 0
+            else:
+                raise ValueError(f"{path} is not a quantized index")
+            codebooks = np.frombuffer(f.read(4 * subspaces * clusters * subspace_dims), dtype="<f4")
+            codes = np.frombuffer(f.read(subspaces * count), dtype=np.uint8)
+            coarse = lists = None
+            if list_count:
+                coarse = np.frombuffer(f.read(4 * list_count * subspaces * subspace_dims), dtype="<f4")
+                coarse = coarse.astype(np.float32).reshape(list_count, subspaces * subspace_dims)
+                lists = np.frombuffer(f.read(4 * count), dtype="<u4").astype(np.int64)
+            ids = json.loads(f.read())
+        return (
+            ids,
+            codebooks.astype(np.float32).reshape(subspaces, clusters, subspace_dims),
+            codes.reshape(subspaces, count),
+            coarse,
+            lists
+        )
+
+    @classmethod
+    def load(cls, path: Path, full: ExactIndex) -> "QuantizedIndex":
+        ids, codebooks, codes, coarse, lists = cls.read(path)
+        return cls(ids, codebooks, codes, full, coarse, lists)
+
+    @classmethod
+    def update_codes(
+        cls,
+        codebooks: np.ndarray,
+        previous_ids: List[str],
+        previous_codes: np.ndarray,
+        ids: List[str],
+        vectors: np.ndarray,
+        batch_size: int
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Codes of ids, whose rows are vectors, under existing codebooks. Ids encoded before keep
+        their codes; only the others are encoded. Returns the codes and the number encoded.
+        """
+        return _carry_over(previous_ids, previous_codes, ids, vectors, partial(cls.encode, codebooks), batch_size)
+
+    @classmethod
+    def update_lists(
+        cls,
+        coarse: np.ndarray,
+        previous_ids: List[str],
+        previous_lists: np.ndarray,
+        ids: List[str],
+        vectors: np.ndarray,
+        batch_size: int
+    ) -> np.ndarray:
+        """Coarse list of each of ids, assigning only those not assigned before"""
+        return _carry_over(previous_ids, previous_lists, ids, vectors, partial(cls.assign, coarse), batch_size)[0]
+
+    def mask(self, ids) -> np.ndarray:
+        allowed = np.zeros(len(self.ids), dtype=bool)
+        allowed[[self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions]] = True
+        return allowed
+
+    def _approximate_distances(self, query: np.ndarray, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """Asymmetric distances of all codes, or those at positions: the query stays exact, stored vectors are their centroids"""
+        split = query.reshape(len(self.codebooks), -1)
+        if self.space == "l2":
+            tables = np.einsum("jcd,jcd->jc", self.codebooks, self.codebooks) - 2 * np.einsum("jcd,jd->jc", self.codebooks, split)
+        else:
+            # Ranking by inner product; cosine candidates are rescored exactly anyway
+            tables = -np.einsum("jcd,jd->jc", self.codebooks, split)
+        approximate = np.zeros(len(self.ids) if positions is None else len(positions), dtype=np.float32)
+        for j in range(len(self.codebooks)):
+            codes = self.codes[j] if positions is None else self.codes[j].take(positions)
+            approximate += tables[j].take(codes)
+        return approximate
+
+    def _probe(self, query: np.ndarray, needed: int, usable_per_list: np.ndarray) -> np.ndarray:
+        """Positions in the nearest coarse lists: at least PQ_IVF_PROBE lists holding at least needed usable codes"""
+        sq = np.einsum("ij,ij->i", self.coarse, self.coarse) - 2 * self.coarse @ query
+        order = np.argsort(sq, kind="stable")
+        covered = np.cumsum(usable_per_list[order])
+        probed = max(settings.PQ_IVF_PROBE, int(np.searchsorted(covered, needed)) + 1)
+        return np.concatenate([
+            self._members[self._bounds[l]:self._bounds[l + 1]] for l in order[:probed]
+        ])
+
+    def search(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        allowed: Optional[np.ndarray] = None,
+        rescore_factor: int = settings.QUANTIZED_RESCORE_FACTOR,
+        min_candidates: int = 0
+    ) -> List[Tuple[List[str], List[float]]]:
+        """
+        Top k (ids, distances) per query: the best max(k * rescore_factor, min_candidates)
+        PQ candidates rescored at full precision, nearest first
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        usable = self._full_rows >= 0
+        if allowed is not None:
+            usable &= allowed
+        usable_count = int(usable.sum())
+        usable_per_list = None
+        if self.coarse is not None:
+            usable_per_list = self._usable_per_list if allowed is None else np.bincount(
+                self.lists[usable], minlength=len(self.coarse)
+            )
+        hits = []
+        for query in queries:
+            candidates = min(max(k * rescore_factor, min_candidates), usable_count)
+            if candidates <= 0:
+                hits.append(([], []))
+                continue
+            if self.coarse is None:
+                positions = np.flatnonzero(usable)
+                approximate = self._approximate_distances(query)[positions]
+            else:
+                positions = self._probe(query, candidates, usable_per_list)
+                positions = positions[usable[positions]]
+                approximate = self._approximate_distances(query, positions)
+            top = positions[np.argpartition(approximate, candidates - 1)[:candidates]]
+            # Sorted rows keep the memory-mapped reads sequential
+            rows = np.sort(self._full_rows[top])
+            vectors = np.asarray(self.full.vectors[rows], dtype=np.float32)
+            exact = exact_distances(query[None, :], vectors, np.einsum("ij,ij->i", vectors, vectors), self.space)[0]
+            order = np.argsort(exact, kind="stable")[:k]
+            hits.append(([self.full.ids[rows[i]] for i in order], [float(exact[i]) for i in order]))
+        return hits
+
+    def stats(self) -> Dict[str, Any]:
+        """Size of the in-memory codes against the float32 vectors they stand in for during search"""
+        code_bytes = int(self.codes.nbytes + self.codebooks.nbytes)
+        if self.coarse is not None:
+            code_bytes += int(self.coarse.nbytes + self.lists.nbytes)
+        vectors = int((self._full_rows >= 0).sum())
+        full_bytes = vectors * self.codebooks.shape[0] * self.codebooks.shape[2] * 4
+        return {
+            "vectors": vectors,
+            "subspaces": int(self.codebooks.shape[0]),
+            "coarse_lists": 0 if self.coarse is None else len(self.coarse),
+            "code_bytes": code_bytes,
+            "full_precision_bytes": full_bytes,
+            "memory_reduction": round(full_bytes / code_bytes, 1) if code_bytes else None,
+        }
+
+    def recall(
+        self,
+        k: int = settings.QUANTIZED_RECALL_K,
+        queries: int = 100,
+        sample: int = settings.QUANTIZED_RECALL_SAMPLE
+    ) -> float:
+        """
+        Estimated mean recall@k against exact search, for stored vectors perturbed into plausible
+        queries. Both searches run over the same fixed-size sample of stored vectors, so the
+        cost does not grow with the collection.
+        """
+        positions = np.flatnonzero(self._full_rows >= 0)
+        if not len(positions):
+            return 1.0
+        rng = np.random.default_rng(0)
+        pool = rng.choice(positions, min(sample, len(positions)), replace=False)
+        # Sorted rows keep the memory-mapped reads sequential
+        rows = self._full_rows[pool]
+        order = np.argsort(rows)
+        pool, rows = pool[order], rows[order]
+        vectors = np.asarray(self.full.vectors[rows], dtype=np.float32)
+
+        picked = rng.choice(len(pool), min(queries, len(pool)), replace=False)
+        samples = vectors[picked] + rng.normal(0, 0.5, (len(picked), vectors.shape[1])).astype(np.float32) * vectors.std(axis=0)
+        allowed = np.zeros(len(self.ids), dtype=bool)
+        allowed[pool] = True
+        approximate = self.search(samples, k, allowed=allowed)
+        exact = exact_distances(samples, vectors, np.einsum("ij,ij->i", vectors, vectors), self.space)
+        nearest = np.argsort(exact, axis=1, kind="stable")[:, :k]
+        return float(np.mean([
+            len(set(a_ids) & {self.full.ids[rows[i]] for i in e_rows}) / max(len(e_rows), 1)
+            for (a_ids, _), e_rows in zip(approximate, nearest)
+        ]))
+
+
+_indexes: Dict[str, Tuple[int, QuantizedIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+def load_quantized_index(directory: Path, space: str = "l2") -> Optional[QuantizedIndex]:
+    """
+    Return a database's quantized index with its full-precision matrix, reloading
+    it only when either file has been rewritten
+    """
+    key = str(directory)
+    path = directory / INDEX_FILENAME
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        with _indexes_lock:
+            _indexes.pop(key, None)
+        return None
+    full = load_exact_index(directory / EXACT_INDEX_FILENAME, space)
+    if full is None:
+        return None
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == mtime and cached[1].full is full:
+            return cached[1]
+    index = QuantizedIndex.load(path, full)
+    with _indexes_lock:
+        _indexes[key] = (mtime, index)
+    return index
+
+
+def unload_quantized_index(directory: Path):
+    """Drop a database's cached codes; its full-precision matrix is unloaded with the exact index"""
+    with _indexes_lock:
+        _indexes.pop(str(directory), None)
@@ -0,0 +1,209 @@
+from typing import List, Dict, Optional, Any, Tuple
+from collections import OrderedDict
+import copy
+import json
+import re
+import threading
+import time
+import unicodedata
+from ..core.config import get_settings
+
+settings = get_settings()
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query so trivially different spellings share a cache entry"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", query)).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    In-memory LRU cache of query embeddings keyed by (model, normalized query).
+    Entries expire ttl_seconds after they were stored; the least recently used
+    entry is evicted once max_entries is reached.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        """Return the cached embedding of an already normalized query, or None"""
+        key = (model, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model: str, query: str, vector: List[float]):
+        key = (model, query)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+_query_embedding_cache: Optional[QueryEmbeddingCache] = None
+_query_embedding_cache_lock = threading.Lock()
+
+
+def get_query_embedding_cache() -> Optional[QueryEmbeddingCache]:
+    """Return the process-wide query embedding cache, or None when it is disabled"""
+    global _query_embedding_cache
+    if settings.QUERY_EMBEDDING_CACHE_SIZE <= 0:
+        return None
+    with _query_embedding_cache_lock:
+        if _query_embedding_cache is None:
+            _query_embedding_cache = QueryEmbeddingCache(
+                settings.QUERY_EMBEDDING_CACHE_SIZE,
+                settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS
+            )
+        return _query_embedding_cache
+
+
+class QueryResultCache:
+    """
+    In-memory LRU cache of query results keyed by database generation.
+    Every write to a database's collection bumps its generation after the write
+    lands, so results cached before the write can no longer be looked up.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, database_id: str) -> int:
+        with self._lock:
+            return self._generations.get(database_id, 0)
+
+    def bump_generation(self, database_id: str):
+        """Invalidate every cached result of a database; call after its collection changed"""
+        with self._lock:
+            self._generations[database_id] = self._generations.get(database_id, 0) + 1
+
+    @staticmethod
+    def make_key(
+        database_id: str,
+        generation: int,
+        query: str,
+        n_results: int,
+        model: str,
+        mode: str = "vector",
+        filters: Optional[Dict[str, Any]] = None,
+        rerank: bool = False,
+        diversify: Optional[Tuple] = None,
+        search_ef: Optional[int] = None
+    ) -> Tuple:
+        return (database_id, generation, model, mode, rerank, diversify, search_ef, normalize_query(query), n_results,
+                json.dumps(filters, sort_keys=True, default=str) if filters else None)
+
+    def get(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        database_id = key[0]
+        with self._lock:
+            counters = self._counters.setdefault(database_id, {"hits": 0, "misses": 0})
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            counters["hits"] += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key: Tuple, results: List[Dict[str, Any]]):
+        with self._lock:
+            # A write that landed while the query ran makes its results unreachable already
+            if key[1] != self._generations.get(key[0], 0):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(results))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Overall size and per-database hit ratio and generation"""
+        with self._lock:
+            databases = {}
+            for database_id in set(self._counters) | set(self._generations):
+                counters = self._counters.get(database_id, {"hits": 0, "misses": 0})
+                lookups = counters["hits"] + counters["misses"]
+                databases[database_id] = {
+                    **counters,
+                    "hit_ratio": counters["hits"] / lookups if lookups else 0.0,
+                    "generation": self._generations.get(database_id, 0),
+                }
+            hits = sum(counters["hits"] for counters in self._counters.values())
+            lookups = hits + sum(counters["misses"] for counters in self._counters.values())
+            return {
+                "hits": hits,
+                "misses": lookups - hits,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "databases": databases,
+            }
+
+
+_query_result_cache: Optional[QueryResultCache] = None
+_query_result_cache_lock = threading.Lock()
+
+
+def get_query_result_cache() -> Optional[QueryResultCache]:
+    """Return the process-wide query result cache, or None when it is disabled"""
+    global _query_result_cache
+    if settings.QUERY_RESULT_CACHE_SIZE <= 0:
+        return None
+    with _query_result_cache_lock:
+        if _query_result_cache is None:
+            _query_result_cache = QueryResultCache(
+                settings.QUERY_RESULT_CACHE_SIZE,
+                settings.QUERY_RESULT_CACHE_TTL_SECONDS
+            )
+        return _query_result_cache
@@ -0,0 +1,162 @@
+from typing import List, Dict, Any, Optional, NamedTuple, Union
+import json
+from datetime import datetime, date, timezone
+
+# Metadata written by ingestion; uploads cannot set these keys themselves
+RESERVED_METADATA_KEYS = ("source", "database_id", "uploaded_at", "merged_sources", "duplicate_count", "merged_counts")
+_OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin")
+
+
+class InvalidFilterError(ValueError):
+    """Raised when a query filter or upload metadata is malformed"""
+
+
+class QueryFilters(NamedTuple):
+    where: Optional[Dict[str, Any]]
+    where_document: Optional[Dict[str, Any]]
+
+    def cache_key(self) -> Optional[Dict[str, Any]]:
+        if not self.where and not self.where_document:
+            return None
+        return {"where": self.where, "where_document": self.where_document}
+
+
+def to_timestamp(value: Union[str, int, float]) -> float:
+    """Epoch seconds for an ISO-8601 date or datetime (naive values are UTC), or a number"""
+    if isinstance(value, bool):
+        raise InvalidFilterError(f"Invalid date {value!r}")
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise InvalidFilterError(f"Invalid date {value!r}, expected ISO-8601")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _is_iso_date(value: str) -> bool:
+    try:
+        date.fromisoformat(value[:10])
+    except ValueError:
+        return False
+    try:
+        to_timestamp(value)
+    except InvalidFilterError:
+        return False
+    return True
+
+
+def parse_file_metadata(raw: Optional[str], filenames: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Parse the per-file metadata sent with an upload: a JSON object mapping filenames to
+    flat objects of scalar values. ISO-8601 date strings are stored as epoch seconds so
+    they can be filtered by range.
+    """
+    if not raw:
+        return {}
+    try:
+        parsed = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise InvalidFilterError(f"file_metadata is not valid JSON: {str(e)}")
+    if not isinstance(parsed, dict):
+        raise InvalidFilterError("file_metadata must map filenames to metadata objects")
+
+    file_metadata = {}
+    for filename, metadata in parsed.items():
+        if filename not in filenames:
+            raise InvalidFilterError(f"file_metadata names {filename}, which was not uploaded")
+        if not isinstance(metadata, dict):
+            raise InvalidFilterError(f"Metadata for {filename} must be an object")
+        values = {}
+        for key, value in metadata.items():
+            if key in RESERVED_METADATA_KEYS:
+                raise InvalidFilterError(f"Metadata key {key} is reserved")
+            if value is None or not isinstance(value, (str, int, float, bool)):
+                raise InvalidFilterError(f"Metadata {key} of {filename} must be a string, number or boolean")
+            values[key] = to_timestamp(value) if isinstance(value, str) and _is_iso_date(value) else value
+        file_metadata[filename] = values
+    return file_metadata
+
+
+def _field_clause(field: str, condition: Any) -> Dict[str, Any]:
+    """Chroma clause for one field: a scalar means equality, a list means $in, a dict holds operators"""
+    if isinstance(condition, list):
+        return {field: {"$in": condition}}
+    if isinstance(condition, dict):
+        unknown = [op for op in condition if op not in _OPERATORS]
+        if unknown:
+            raise InvalidFilterError(f"Unsupported operators {unknown} on {field}, expected {list(_OPERATORS)}")
+        clauses = [{field: {op: value}} for op, value in condition.items()]
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    if condition is None:
+        raise InvalidFilterError(f"Filter on {field} needs a value")
+    return {field: {"$eq": condition}}
+
+
+def parse_filters(raw: Optional[Union[str, Dict[str, Any]]]) -> QueryFilters:
+    """
+    Translate a query filter expression into Chroma where / where_document clauses:
+
+        {
+            "source": "a.pdf" | ["a.pdf", "b.pdf"],
+            "metadata": {"department": "legal", "pages": {"$gte": 10}},
+            "dates": {"uploaded_at": {"from": "2024-01-01", "to": "2024-06-30"}},
+            "contains": "E1234" | ["E1234", "disk"],
+            "not_contains": "draft"
+        }
+
+    All conditions must hold. Date fields are uploaded_at or dates given in upload metadata.
+    """
+    if not raw:
+        return QueryFilters(None, None)
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise InvalidFilterError(f"filters is not valid JSON: {str(e)}")
+    if not isinstance(raw, dict):
+        raise InvalidFilterError("filters must be a JSON object")
+    unknown = set(raw) - {"source", "metadata", "dates", "contains", "not_contains"}
+    if unknown:
+        raise InvalidFilterError(f"Unknown filter keys {sorted(unknown)}")
+
+    clauses = []
+    if raw.get("source") is not None:
+        clauses.append(_field_clause("source", raw["source"]))
+
+    metadata = raw.get("metadata") or {}
+    if not isinstance(metadata, dict):
+        raise InvalidFilterError("metadata filter must be an object")
+    for field, condition in metadata.items():
+        clauses.append(_field_clause(field, condition))
+
+    dates = raw.get("dates") or {}
+    if not isinstance(dates, dict):
+        raise InvalidFilterError("dates filter must be an object")
+    for field, bounds in dates.items():
+        if not isinstance(bounds, dict) or not set(bounds) <= {"from", "to"} or not bounds:
+            raise InvalidFilterError(f"Date range on {field} needs from and/or to")
+        if bounds.get("from") is not None:
+            clauses.append({field: {"$gte": to_timestamp(bounds["from"])}})
+        if bounds.get("to") is not None:
+            clauses.append({field: {"$lte": to_timestamp(bounds["to"])}})
+
+    document_clauses = []
+    for key, operator in (("contains", "$contains"), ("not_contains", "$not_contains")):
+        values = raw.get(key)
+        if values is None:
+            continue
+        for value in values if isinstance(values, list) else [values]:
+            if not isinstance(value, str) or not value:
+                raise InvalidFilterError(f"{key} values must be non-empty strings")
+            document_clauses.append({operator: value})
+
+    where = None
+    if clauses:
+        where = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    where_document = None
+    if document_clauses:
+        where_document = document_clauses[0] if len(document_clauses) == 1 else {"$and": document_clauses}
+    return QueryFilters(where, where_document)
@@ -0,0 +1,129 @@
+from typing import List, Dict, Any, Optional
+import threading
+import time
+import logging
+from pathlib import Path
+from ..core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class CrossEncoderReranker:
+    """
+    Scores (query, passage) pairs with a sentence-transformers cross-encoder on the CPU.
+    The model is loaded once per process and every pair of a request is scored in one
+    batched forward pass. Reranking is skipped, rather than queued, when concurrency reranks
+    are already running or when the expected cost exceeds the latency budget. While requests
+    are skipped for the budget, one is still scored every reprobe_seconds, so an estimate taken
+    during a load spike is corrected once the load has gone.
+    """
+
+    def __init__(
+        self,
+        name: str = settings.RERANK_MODEL,
+        latency_budget_ms: float = settings.RERANK_LATENCY_BUDGET_MS,
+        concurrency: int = settings.RERANK_CONCURRENCY,
+        reprobe_seconds: float = settings.RERANK_REPROBE_SECONDS
+    ):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            raise ValueError(f"Reranking with {name} requires the sentence-transformers package")
+        local_path = Path(settings.LOCAL_EMBEDDING_MODEL_DIR) / name
+        source = str(local_path) if local_path.exists() else name
+        logger.info(f"Loading rerank model from {source}")
+        self.name = name
+        self.model = CrossEncoder(source, device="cpu")
+        self.latency_budget_ms = latency_budget_ms
+        self.concurrency = max(concurrency, 1)
+        self.reprobe_seconds = reprobe_seconds
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._ms_per_pair: Optional[float] = None  # Moving average of observed cost
+        self._last_scored = time.monotonic()
+        self.reranked = 0
+        self.reprobes = 0
+        self.skipped_busy = 0
+        self.skipped_budget = 0
+
+    def score(self, pairs: List[List[str]]) -> Optional[List[float]]:
+        """Relevance score for each [query, passage] pair, or None if reranking was skipped"""
+        probe = False
+        with self._lock:
+            if self._ms_per_pair is not None and self._ms_per_pair * len(pairs) > self.latency_budget_ms:
+                # Skipped requests never update the estimate, so probe with one of them now and then
+                if time.monotonic() - self._last_scored < self.reprobe_seconds:
+                    self.skipped_budget += 1
+                    return None
+                self._last_scored = time.monotonic()
+                self.reprobes += 1
+                probe = True
+        # All slots busy means we are under load; serve the first-stage ranking instead of waiting
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.skipped_busy += 1
+            return None
+        try:
+            started = time.perf_counter()
+            scores = self.model.predict(pairs, batch_size=settings.RERANK_BATCH_SIZE, convert_to_numpy=True)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        finally:
+            self._slots.release()
+        ms_per_pair = elapsed_ms / max(len(pairs), 1)
+        with self._lock:
+            # A probe replaces the estimate: the average it would blend into is as old as the skipping
+            if self._ms_per_pair is None or probe:
+                self._ms_per_pair = ms_per_pair
+            else:
+                self._ms_per_pair = 0.8 * self._ms_per_pair + 0.2 * ms_per_pair
+            self._last_scored = time.monotonic()
+            self.reranked += 1
+        return [float(score) for score in scores]
+
+    def rerank(
+        self,
+        queries: List[str],
+        candidates: List[List[Dict[str, Any]]],
+        n_results: int
+    ) -> Optional[List[List[Dict[str, Any]]]]:
+        """Reorder each query's candidates by cross-encoder score and keep the top n_results"""
+        pairs = [[query, result["text"]] for query, results in zip(queries, candidates) for result in results]
+        if not pairs:
+            return [[] for _ in queries]
+        scores = self.score(pairs)
+        if scores is None:
+            return None
+        reranked = []
+        position = 0
+        for results in candidates:
+            scored = [{**result, "rerank_score": score} for result, score in zip(results, scores[position:position + len(results)])]
+            position += len(results)
+            scored.sort(key=lambda result: result["rerank_score"], reverse=True)
+            reranked.append(scored[:n_results])
+        return reranked
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.name,
+            "reranked": self.reranked,
+            "skipped_busy": self.skipped_busy,
+            "skipped_budget": self.skipped_budget,
+            "reprobes": self.reprobes,
+            "concurrency": self.concurrency,
+            "ms_per_pair": self._ms_per_pair,
+            "latency_budget_ms": self.latency_budget_ms,
+        }
+
+
+_reranker: Optional[CrossEncoderReranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> CrossEncoderReranker:
+    """Return the process-wide reranker, loading the model on first use"""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = CrossEncoderReranker()
+        return _reranker
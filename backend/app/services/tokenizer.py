@@ -0,0 +1,79 @@
+from typing import List
+from functools import lru_cache
+import tiktoken
+from ..core.config import get_settings
+
+settings = get_settings()
+
+# Maximum tokens OpenAI accepts for a single embedding input
+MODEL_INPUT_TOKEN_LIMITS = {
+    "text-embedding-ada-002": 8191,
+    "text-embedding-3-small": 8191,
+    "text-embedding-3-large": 8191,
+}
+DEFAULT_INPUT_TOKEN_LIMIT = 8191
+
+
+class Tokenizer:
+    """Counts, splits and truncates text in model tokens"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.max_input_tokens = MODEL_INPUT_TOKEN_LIMITS.get(model, DEFAULT_INPUT_TOKEN_LIMIT)
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def split(self, text: str, max_tokens: int = None) -> List[str]:
+        """Split text into consecutive pieces of at most max_tokens tokens"""
+        max_tokens = max_tokens or self.max_input_tokens
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return [text]
+        return [self.encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+    def truncate(self, text: str, max_tokens: int = None) -> str:
+        """Keep only the first max_tokens tokens of text"""
+        max_tokens = max_tokens or self.max_input_tokens
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens])
+
+
+class WordTokenizer(Tokenizer):
+    """Whitespace word counts for local models, which truncate to their own sequence length"""
+
+    def __init__(self, model: str, max_input_tokens: int):
+        self.model = model
+        self.max_input_tokens = max_input_tokens
+
+    def count(self, text: str) -> int:
+        return len(text.split())
+
+    def split(self, text: str, max_tokens: int = None) -> List[str]:
+        max_tokens = max_tokens or self.max_input_tokens
+        words = text.split()
+        if len(words) <= max_tokens:
+            return [text]
+        return [' '.join(words[i:i + max_tokens]) for i in range(0, len(words), max_tokens)]
+
+    def truncate(self, text: str, max_tokens: int = None) -> str:
+        max_tokens = max_tokens or self.max_input_tokens
+        words = text.split()
+        if len(words) <= max_tokens:
+            return text
+        return ' '.join(words[:max_tokens])
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str) -> Tokenizer:
+    """Return a shared tokenizer for an embedding model"""
+    from .embedding_backends import is_local_model
+    if is_local_model(model):
+        return WordTokenizer(model, settings.LOCAL_EMBEDDING_MAX_INPUT_WORDS)
+    return Tokenizer(model)
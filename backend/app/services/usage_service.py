@@ -120,6 +120,14 @@ class UsageService:
             logger.error(f"Error getting API key usage: {str(e)}")
             return None
     
+    def database_query_counts(self) -> Dict[str, int]:
+        """Total queries per database across all users"""
+        counts: Dict[str, int] = {}
+        for user_data in self._load_usage().get("users", {}).values():
+            for database_id, queries in user_data.get("databases", {}).items():
+                counts[database_id] = counts.get(database_id, 0) + queries
+        return counts
+    
     def get_all_usage(self) -> Dict:
         """Get all usage statistics"""
         try:
@@ -0,0 +1,185 @@
+"""
+Latency benchmarks for the API, run in-process against the ASGI app.
+
+    python benchmark.py services --requests 200 --database-id <id>
+    python benchmark.py concurrency --database-id <id> --levels 1,8,32
+    python benchmark.py exact --database-id <id> --k 10
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+import httpx
+import numpy as np
+from fastapi.testclient import TestClient
+from app.main import app, lifespan
+from app.api.deps import get_database_service
+from app.services.database_service import DatabaseService
+from app.services.exact_index import ExactIndex, load_exact_index
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    return {
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+def measure(call: Callable[[], object], requests: int, warmup: int = 5) -> Dict[str, float]:
+    for _ in range(warmup):
+        call()
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def print_row(label: str, result: Dict[str, float]):
+    print(f"{label:<28} " + "  ".join(f"{key}={value:8.2f}" for key, value in result.items()))
+
+
+def bench_services(args):
+    """Per-request service construction (before) against lifespan singletons (after)"""
+    with TestClient(app) as client:
+        calls = {"list": lambda: client.get(f"{args.prefix}/list")}
+        if args.database_id:
+            calls["status"] = lambda: client.get(f"{args.prefix}/{args.database_id}/status")
+            calls["query"] = lambda: client.post(
+                f"{args.prefix}/{args.database_id}/query",
+                data={"query": args.query, "n_results": "5"}
+            )
+
+        for name, call in calls.items():
+            # Before: a new DatabaseService, Chroma client and OpenAI client on every request
+            app.dependency_overrides[get_database_service] = lambda: DatabaseService()
+            before = measure(call, args.requests)
+            app.dependency_overrides.clear()
+            after = measure(call, args.requests)
+            print_row(f"{name} per-request", before)
+            print_row(f"{name} shared", after)
+            print(f"{name} p50 speedup: {before['p50_ms'] / after['p50_ms']:.1f}x")
+
+
+async def run_concurrent(client: httpx.AsyncClient, args, concurrency: int) -> Dict[str, float]:
+    """Issue args.requests distinct queries with at most `concurrency` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            # Distinct queries so neither the embedding nor the result cache answers them
+            response = await client.post(
+                f"{args.prefix}/{args.database_id}/query",
+                data={"query": f"{args.query} #{concurrency}-{i}", "n_results": "5"}
+            )
+            response.raise_for_status()
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return {"requests_per_s": len(samples) / elapsed, **summarize(samples)}
+
+
+async def bench_concurrency_async(args):
+    transport = httpx.ASGITransport(app=app)
+    async with lifespan(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            baseline = None
+            for level in [int(level) for level in args.levels.split(",")]:
+                result = await run_concurrent(client, args, level)
+                baseline = baseline or result["requests_per_s"]
+                print_row(f"concurrency {level}", result)
+                # Throughput grows with concurrency only if queries overlap on the event loop
+                print(f"concurrency {level} throughput vs first level: {result['requests_per_s'] / baseline:.1f}x")
+
+
+def bench_concurrency(args):
+    """Query throughput and latency with increasing numbers of requests in flight"""
+    asyncio.run(bench_concurrency_async(args))
+
+
+def bench_exact(args):
+    """Brute-force search over the memory-mapped matrix against Chroma's HNSW index"""
+    service = DatabaseService()
+    collection = service.chroma_client.get_collection(name=args.database_id)
+    space = service._collection_space(collection)
+    stored = collection.get(include=["embeddings"])
+    embeddings = np.asarray(stored["embeddings"], dtype=np.float32)
+    print(f"{len(stored['ids'])} vectors of {embeddings.shape[1]} dimensions, space {space}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "exact.idx"
+        started = time.perf_counter()
+        ExactIndex.write(path, [(stored["ids"], embeddings)], dtype=args.dtype)
+        index = load_exact_index(path, space)
+        print(f"exact index build {(time.perf_counter() - started) * 1000:.1f} ms, {index.stats()}")
+
+        # Queries near stored chunks, like real questions about the documents
+        rng = np.random.default_rng(0)
+        picks = embeddings[rng.integers(0, len(embeddings), args.requests)]
+        queries = picks + rng.normal(0, args.noise * float(np.abs(embeddings).mean()), picks.shape).astype(np.float32)
+
+        hnsw_ids = []
+        hnsw_samples = []
+        exact_ids = []
+        exact_samples = []
+        for query in queries.tolist():
+            started = time.perf_counter()
+            result = collection.query(query_embeddings=[query], n_results=args.k, include=["distances"])
+            hnsw_samples.append(time.perf_counter() - started)
+            hnsw_ids.append(result["ids"][0])
+            started = time.perf_counter()
+            exact_ids.append(index.search([query], args.k)[0][0])
+            exact_samples.append(time.perf_counter() - started)
+        del index
+
+    recall = statistics.mean(len(set(hnsw) & set(exact)) / max(len(exact), 1) for hnsw, exact in zip(hnsw_ids, exact_ids))
+    hnsw = summarize(hnsw_samples)
+    exact = summarize(exact_samples)
+    print_row("hnsw", hnsw)
+    print_row(f"exact {args.dtype}", exact)
+    print(f"exact p50 speedup: {hnsw['p50_ms'] / exact['p50_ms']:.1f}x, hnsw recall@{args.k} vs exact: {recall:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector DB API latency benchmarks")
+    parser.add_argument("--prefix", default="/api/v1/database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    services = subparsers.add_parser("services", help="Service construction per request vs shared services")
+    services.add_argument("--requests", type=int, default=100)
+    services.add_argument("--database-id", help="Existing database to query; only /list is timed without it")
+    services.add_argument("--query", default="What is this document about?")
+    services.set_defaults(func=bench_services)
+
+    concurrency = subparsers.add_parser("concurrency", help="Query throughput with concurrent requests in flight")
+    concurrency.add_argument("--database-id", required=True)
+    concurrency.add_argument("--requests", type=int, default=200)
+    concurrency.add_argument("--levels", default="1,4,16,64", help="Comma-separated numbers of requests in flight")
+    concurrency.add_argument("--query", default="What is this document about?")
+    concurrency.set_defaults(func=bench_concurrency)
+
+    exact = subparsers.add_parser("exact", help="Brute-force NumPy search vs Chroma HNSW: latency and recall")
+    exact.add_argument("--database-id", required=True)
+    exact.add_argument("--requests", type=int, default=200)
+    exact.add_argument("--k", type=int, default=10)
+    exact.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    exact.add_argument("--noise", type=float, default=0.5, help="Query perturbation relative to the mean component size")
+    exact.set_defaults(func=bench_exact)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import re
+import pytest
+from app.services import embedding_service
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in its own directory; services resolve their storage paths relative to it"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def sentence_tokenizer(monkeypatch):
+    """Split sentences on terminal punctuation, so chunking needs neither NLTK punkt data nor a download"""
+    monkeypatch.setattr(embedding_service.nltk.data, "find", lambda resource: resource)
+    monkeypatch.setattr(embedding_service.nltk, "download", lambda *args, **kwargs: pytest.fail("tried to download NLTK data"))
+    monkeypatch.setattr(
+        embedding_service.nltk,
+        "sent_tokenize",
+        lambda text: [sentence for sentence in re.split(r"(?<=[.!?])\s+", text) if sentence.strip()]
+    )
@@ -0,0 +1,34 @@
+from app.services.collection_manager import CollectionManager
+
+
+def manager(sizes, hnsw_sizes, budget_bytes):
+    unloaded = []
+    collections = CollectionManager(
+        load=lambda database_id: None,
+        unload=unloaded.append,
+        size=sizes.__getitem__,
+        budget_bytes=budget_bytes,
+        hnsw_size=hnsw_sizes.__getitem__
+    )
+    return collections, unloaded
+
+
+def test_eviction_does_not_count_hnsw_as_freed():
+    collections, unloaded = manager({"a": 60, "b": 60}, {"a": 500, "b": 0}, budget_bytes=100)
+    collections.touch("a")
+    collections.touch("b")
+
+    stats = collections.stats()
+    assert unloaded == ["a"]
+    assert stats["resident_bytes"] == 60
+    # Chroma still holds a's HNSW segment after the eviction
+    assert stats["hnsw_cache"] == "unmanaged"
+    assert stats["hnsw_bytes"] == 500
+
+
+def test_preload_counts_unmanaged_hnsw_towards_the_budget():
+    collections, _ = manager({"a": 10, "b": 10, "c": 10}, {"a": 50, "b": 50, "c": 0}, budget_bytes=100)
+    collections.preload(pinned=[], ranked=["a", "b", "c"])
+
+    assert [entry["database_id"] for entry in collections.stats()["databases"]] == ["a", "c"]
+    assert collections.evictions == 0
@@ -0,0 +1,36 @@
+import json
+from app.services.dedup_service import ChunkDeduplicator, merge_counts, merges_metadata
+
+TEXT = (
+    "Invoices are paid within thirty days of receipt by the finance team. Disputed invoices are "
+    "escalated to the account manager, who contacts the supplier and records the outcome in the "
+    "ledger before the next monthly close, so that every payment can be traced to its approval."
+)
+
+
+def test_seeded_chunks_absorb_duplicates_from_later_runs():
+    deduplicator = ChunkDeduplicator()
+    deduplicator.seed("stored", TEXT)
+
+    assert not deduplicator.check("new", TEXT, {"source": "b.txt"})
+    assert not deduplicator.check("near", TEXT.replace("monthly", "quarterly"), {"source": "c.txt"})
+    assert deduplicator.merged_counts() == {"stored": {"b.txt": 1, "c.txt": 1}}
+    # Seeds are not part of the run's stats
+    assert deduplicator.stats()["chunks_seen"] == 2
+
+
+def test_merge_counts_leave_out_replaced_sources():
+    metadata = merges_metadata({"a.txt": 2, "b.txt": 1})
+
+    assert metadata["merged_sources"] == "a.txt,b.txt"
+    assert metadata["duplicate_count"] == 3
+    assert merge_counts(metadata, replaced=["a.txt"]) == {"b.txt": 1}
+    assert merges_metadata({}) == {"merged_sources": None, "duplicate_count": None, "merged_counts": None}
+
+
+def test_chunks_without_per_source_counts_keep_their_total():
+    counts = merge_counts({"merged_sources": "a.txt,b.txt", "duplicate_count": 4})
+
+    assert sum(counts.values()) == 4
+    assert set(counts) == {"a.txt", "b.txt"}
+    assert json.loads(merges_metadata(counts)["merged_counts"]) == counts
@@ -0,0 +1,119 @@
+import asyncio
+import sys
+import threading
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from app.services import embedding_backends
+from app.services.database_service import DatabaseService
+from app.services.embedding_backends import (
+    HashingEmbeddingBackend, SentenceTransformerBackend, get_embedding_backend, validate_dimensions
+)
+
+
+class FakeSentenceTransformer:
+    """Stands in for sentence_transformers.SentenceTransformer: 384-wide bag-of-words vectors"""
+
+    def __init__(self, source, device=None):
+        self.source = source
+        self.device = device
+        self.calls = []
+        self.loaded_on = threading.current_thread()
+
+    def get_sentence_embedding_dimension(self):
+        return 384
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, convert_to_numpy=True):
+        self.calls.append({"texts": list(texts), "batch_size": batch_size, "normalize": normalize_embeddings})
+        vectors = np.zeros((len(texts), 384), dtype=np.float64)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, sum(map(ord, word.strip(".,"))) % 384] += 1
+        if normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+
+@pytest.fixture(autouse=True)
+def fake_sentence_transformers(monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", SimpleNamespace(SentenceTransformer=FakeSentenceTransformer))
+    monkeypatch.setattr(embedding_backends, "_backends", {})
+
+
+def test_hashing_vectors_are_deterministic_and_unit_length():
+    backend = HashingEmbeddingBackend()
+    first, again, empty = backend.embed(["Expense reports are due monthly", "Expense reports are due monthly", ""])
+
+    assert len(first) == backend.native_dimension() == embedding_backends.settings.HASHING_EMBEDDING_DIMENSION
+    assert first == again
+    assert np.linalg.norm(first) == pytest.approx(1.0)
+    assert not any(empty)
+
+
+def test_hashing_vectors_rank_shared_words_closer():
+    query, related, unrelated = np.array(HashingEmbeddingBackend().embed([
+        "when are laptops replaced", "laptops are replaced every three years", "expense reports are due monthly"
+    ]))
+
+    assert query @ related > query @ unrelated
+
+
+def test_sentence_transformer_encodes_one_normalized_batch_on_cpu():
+    backend = SentenceTransformerBackend("all-MiniLM-L6-v2")
+    vectors = backend.embed(["first passage", "second passage"])
+
+    assert backend.model.device == "cpu"
+    assert backend.model.calls == [{
+        "texts": ["first passage", "second passage"],
+        "batch_size": embedding_backends.settings.LOCAL_EMBEDDING_BATCH_SIZE,
+        "normalize": True
+    }]
+    assert len(vectors) == 2 and len(vectors[0]) == backend.native_dimension() == 384
+    assert all(isinstance(value, float) for value in vectors[0])
+
+
+def test_sentence_transformer_prefers_models_on_disk(workdir):
+    (workdir / embedding_backends.settings.LOCAL_EMBEDDING_MODEL_DIR / "all-MiniLM-L6-v2").mkdir(parents=True)
+
+    assert SentenceTransformerBackend("all-MiniLM-L6-v2").model.source.endswith("models/all-MiniLM-L6-v2")
+    assert SentenceTransformerBackend("other-model").model.source == "other-model"
+
+
+def test_sentence_transformer_without_the_package_is_a_value_error(monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", None)
+
+    with pytest.raises(ValueError, match="requires the sentence-transformers package"):
+        SentenceTransformerBackend("all-MiniLM-L6-v2")
+
+
+def test_local_model_names_route_to_local_backends():
+    assert isinstance(get_embedding_backend("local/hashing"), HashingEmbeddingBackend)
+    backend = get_embedding_backend("local/all-MiniLM-L6-v2")
+    assert isinstance(backend, SentenceTransformerBackend)
+    assert get_embedding_backend("local/all-MiniLM-L6-v2") is backend
+
+
+def test_local_models_accept_dimensions_up_to_their_width():
+    validate_dimensions("local/all-MiniLM-L6-v2", 384)
+    validate_dimensions("local/all-MiniLM-L6-v2", 128)
+
+
+def test_local_models_reject_dimensions_beyond_their_width():
+    with pytest.raises(ValueError, match="at most 384 dimensions"):
+        validate_dimensions("local/all-MiniLM-L6-v2", 512)
+
+
+def test_hashing_and_openai_widths_are_still_checked():
+    with pytest.raises(ValueError, match="at most"):
+        validate_dimensions("local/hashing", embedding_backends.settings.HASHING_EMBEDDING_DIMENSION + 1)
+    with pytest.raises(ValueError, match="at most 1536"):
+        validate_dimensions("text-embedding-3-small", 2048)
+
+
+def test_create_database_loads_local_models_off_the_event_loop():
+    service = DatabaseService.__new__(DatabaseService)
+
+    with pytest.raises(ValueError, match="at most 384 dimensions"):
+        asyncio.run(service.create_database("db", [], "", "", model="local/all-MiniLM-L6-v2", dimensions=512))
+
+    assert get_embedding_backend("local/all-MiniLM-L6-v2").model.loaded_on is not threading.main_thread()
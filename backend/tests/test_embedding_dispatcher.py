@@ -0,0 +1,133 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import httpx
+import openai
+import pytest
+from app.services import embedding_dispatcher
+from app.services.embedding_dispatcher import EmbeddingDispatcher, TokenBucket
+
+# Local model names are counted in words, so no tiktoken encoding has to be downloaded
+MODEL = "local/hashing"
+_REQUEST = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+
+
+def rate_limit_error(retry_after: str = "0") -> openai.RateLimitError:
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=_REQUEST)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def bad_request_error() -> openai.BadRequestError:
+    return openai.BadRequestError("bad input", response=httpx.Response(400, request=_REQUEST), body=None)
+
+
+class FakeEmbeddings:
+    """Stands in for AsyncOpenAI.embeddings: raises the scripted errors first, then embeds by length"""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def create(self, model, input, **kwargs):
+        self.calls.append(list(input))
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(
+            data=[SimpleNamespace(embedding=[float(len(text)), 1.0]) for text in input],
+            usage=SimpleNamespace(total_tokens=sum(len(text.split()) for text in input))
+        )
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    monkeypatch.setattr(embedding_dispatcher.settings, "EMBEDDING_BACKOFF_BASE", 0.001)
+    dispatcher = EmbeddingDispatcher(
+        api_key="test",
+        concurrency=2,
+        requests_per_minute=6000,
+        tokens_per_minute=600000,
+        batch_size=4,
+        max_batch_tokens=10,
+        max_retries=3
+    )
+    dispatcher.client = SimpleNamespace(embeddings=FakeEmbeddings())
+    return dispatcher
+
+
+def test_token_bucket_waits_for_refill():
+    async def drain_and_acquire():
+        bucket = TokenBucket(per_minute=600)  # 10 tokens per second
+        await bucket.acquire(600)
+        started = time.monotonic()
+        await bucket.acquire(5)
+        return time.monotonic() - started
+
+    assert 0.4 <= asyncio.run(drain_and_acquire()) < 1.5
+
+
+def test_requests_are_throttled_by_the_token_budget(dispatcher):
+    async def drain():
+        dispatcher._token_bucket.tokens = 0
+        dispatcher._token_bucket.updated = time.monotonic()
+        dispatcher._token_bucket.rate = 10.0
+
+    asyncio.run_coroutine_threadsafe(drain(), dispatcher._loop).result()
+    started = time.monotonic()
+    dispatcher.embed(["one two three four five"], MODEL)
+    assert time.monotonic() - started >= 0.4
+
+
+def test_batches_respect_input_and_token_limits(dispatcher):
+    texts = ["a b c", "d e f g", "h i", "j", "k l m n o p", "q"]
+    batches = dispatcher.pack_batches(texts, MODEL)
+
+    # The first batch is closed by the 4-input limit, exactly at the 10-token limit
+    assert [batch for batch, _ in batches] == [["a b c", "d e f g", "h i", "j"], ["k l m n o p", "q"]]
+    assert [tokens for _, tokens in batches] == [10, 7]
+    assert all(len(batch) <= dispatcher.batch_size for batch, _ in batches)
+
+
+def test_embeddings_come_back_in_input_order(dispatcher):
+    texts = [" ".join(["w"] * n) for n in range(1, 12)]
+    embeddings = dispatcher.embed(texts, MODEL)
+
+    assert [embedding[0] for embedding in embeddings] == [float(len(text)) for text in texts]
+    assert len(dispatcher.client.embeddings.calls) > 1
+
+
+def test_rate_limited_batches_are_retried(dispatcher):
+    dispatcher.client.embeddings.errors = [rate_limit_error(), rate_limit_error()]
+    embeddings = dispatcher.embed(["hello world"], MODEL)
+
+    assert embeddings == [[11.0, 1.0]]
+    assert dispatcher.stats_counters["retries"] == 2
+    assert dispatcher.stats_counters["rate_limited"] == 2
+    assert len(dispatcher.client.embeddings.calls) == 3
+
+
+def test_client_errors_are_not_retried(dispatcher):
+    dispatcher.client.embeddings.errors = [bad_request_error()]
+    with pytest.raises(openai.BadRequestError):
+        dispatcher.embed(["hello"], MODEL)
+
+    assert dispatcher.stats_counters["retries"] == 0
+    assert dispatcher.stats_counters["failures"] == 1
+
+
+def test_retries_stop_after_max_retries(dispatcher):
+    dispatcher.client.embeddings.errors = [rate_limit_error() for _ in range(dispatcher.max_retries + 1)]
+    with pytest.raises(openai.RateLimitError):
+        dispatcher.embed(["hello"], MODEL)
+
+    assert len(dispatcher.client.embeddings.calls) == dispatcher.max_retries + 1
+
+
+def test_backoff_grows_and_honours_retry_after(dispatcher, monkeypatch):
+    monkeypatch.setattr(embedding_dispatcher.settings, "EMBEDDING_BACKOFF_BASE", 1.0)
+    monkeypatch.setattr(embedding_dispatcher.settings, "EMBEDDING_BACKOFF_MAX", 4.0)
+    monkeypatch.setattr(embedding_dispatcher.random, "uniform", lambda low, high: high)
+
+    assert [dispatcher._retry_delay(rate_limit_error(), attempt) for attempt in range(3)] == [1.0, 2.0, 4.0]
+    assert dispatcher._retry_delay(rate_limit_error(retry_after="7"), 0) == 7.0
+    assert dispatcher._retry_delay(rate_limit_error(), dispatcher.max_retries) is None
+
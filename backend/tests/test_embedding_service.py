@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from app.services import embedding_service
+from app.services.embedding_backends import EmbeddingBackend
+from app.services.embedding_cache import EmbeddingCache
+from app.services.embedding_service import EmbeddingService
+from app.services.query_cache import QueryEmbeddingCache
+
+
+class CountingBackend(EmbeddingBackend):
+    def __init__(self):
+        self.calls = []
+
+    def embed(self, texts, dimensions=None):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = CountingBackend()
+    monkeypatch.setattr(embedding_service, "get_embedding_backend", lambda model: backend)
+    return backend
+
+
+@pytest.fixture
+def service(workdir, sentence_tokenizer):
+    service = EmbeddingService()
+    service.cache = EmbeddingCache(str(workdir / "embeddings.sqlite3"), 10 * 1024 * 1024)
+    service.query_cache = QueryEmbeddingCache(100, 60.0)
+    return service
+
+
+def test_query_cache_misses_are_served_from_the_disk_cache(service, backend):
+    service.get_embeddings(["stored passage"], "local/counting")
+    service.query_cache = QueryEmbeddingCache(100, 60.0)  # As after a restart
+
+    embeddings = asyncio.run(service.get_query_embeddings(["stored passage", "new query"], "local/counting"))
+
+    assert embeddings == [[14.0, 1.0], [9.0, 1.0]]
+    assert backend.calls == [["stored passage"], ["new query"]]
+    assert service.cache.get_many("local/counting", ["new query"]) == [[9.0, 1.0]]
+
+
+def test_queries_use_the_disk_cache_without_the_query_cache(service, backend):
+    service.query_cache = None
+    asyncio.run(service.get_query_embedding("repeated query", "local/counting"))
+    asyncio.run(service.get_query_embedding("repeated query", "local/counting"))
+
+    assert backend.calls == [["repeated query"]]
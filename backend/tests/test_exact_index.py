@@ -0,0 +1,57 @@
+import json
+import struct
+import numpy as np
+from app.services.exact_index import ExactIndex, load_exact_index, index_bytes, INDEX_FILENAME
+
+
+def vectors(count, dims=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dims)).astype(np.float32)
+
+
+def test_append_adds_rows_and_marks_removed_ones(workdir):
+    path = workdir / INDEX_FILENAME
+    stored = vectors(100)
+    ExactIndex.write(path, [([f"a{i}" for i in range(100)], stored.tolist())], dtype="float32")
+    matrix = workdir / ExactIndex.manifest(path)["matrix"]
+    before = matrix.read_bytes()
+
+    added = vectors(10, seed=1)
+    appended = ExactIndex.append(path, [([f"b{i}" for i in range(10)], added.tolist())], removed=["a3", "a7"])
+    index = load_exact_index(path)
+
+    assert appended == 10
+    # Stored rows are left as they were; new ones follow them
+    assert matrix.read_bytes()[:len(before)] == before
+    assert index.tombstones == 2 and index.stats()["vectors"] == 108
+    assert index.search([added[4].tolist()], 1)[0][0] == ["b4"]
+    hits = index.search([stored[3].tolist(), stored[7].tolist()], 5)
+    assert all("a3" not in ids and "a7" not in ids for ids, _ in hits)
+    assert index_bytes(path) == path.stat().st_size + matrix.stat().st_size
+
+
+def test_append_discards_rows_of_an_interrupted_append(workdir):
+    path = workdir / INDEX_FILENAME
+    ExactIndex.write(path, [(["a", "b"], vectors(2).tolist())], dtype="float32")
+    matrix = workdir / ExactIndex.manifest(path)["matrix"]
+    with open(matrix, "ab") as f:
+        f.write(vectors(3, seed=2).tobytes())
+
+    ExactIndex.append(path, [(["c"], vectors(1, seed=3).tolist())])
+    index = load_exact_index(path)
+
+    assert index.ids == ["a", "b", "c"]
+    assert np.array_equal(index.vectors[2], vectors(1, seed=3)[0])
+    assert matrix.stat().st_size == 3 * 8 * 4
+
+
+def test_single_file_indexes_still_load(workdir):
+    path = workdir / INDEX_FILENAME
+    stored = vectors(4)
+    ids = json.dumps(["a", "b", "c", "d"]).encode("utf-8")
+    header = b"EXACTIX1" + struct.pack("<QQQ", 4, 8, 64 + stored.nbytes) + b"<f4".ljust(8)
+    path.write_bytes(header.ljust(64, b"\0") + stored.tobytes() + ids)
+
+    index = load_exact_index(path)
+
+    assert ExactIndex.manifest(path) is None
+    assert index.search([stored[2].tolist()], 1)[0][0] == ["c"]
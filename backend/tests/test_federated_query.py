@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from app.services.collection_manager import CollectionManager
+from app.services.database_service import DatabaseService
+
+
+def service_over(databases):
+    """A DatabaseService whose selector returns the given metadata, without opening any storage"""
+    service = DatabaseService.__new__(DatabaseService)
+    service._select_federated_databases = lambda *args: databases
+    return service
+
+
+def database(space=None):
+    metadata = {"name": "db", "model": "local/hashing", "dimensions": None, "status": "completed"}
+    if space is not None:
+        metadata["index_params"] = {"space": space, "M": 16, "construction_ef": 100, "search_ef": 100}
+    return metadata
+
+
+def test_databases_with_different_spaces_are_rejected():
+    service = service_over({"a": database("cosine"), "b": database("l2")})
+
+    with pytest.raises(ValueError, match="distance space"):
+        asyncio.run(service.query_federated("query", database_ids=["a", "b"]))
+
+
+def test_databases_without_index_params_count_as_l2():
+    service = service_over({"a": database("cosine"), "b": database()})
+
+    with pytest.raises(ValueError, match="cosine"):
+        asyncio.run(service.query_federated("query", database_ids=["a", "b"]))
+
+
+def test_federated_queries_keep_databases_within_the_budget():
+    service = service_over({name: database() for name in ("a", "b", "c")})
+    unloaded = []
+    service.collections = CollectionManager(
+        load=lambda database_id: None, unload=unloaded.append, size=lambda database_id: 60, budget_bytes=100
+    )
+    service.result_cache = None
+    service.embedding_service = SimpleNamespace(get_query_embedding=lambda *args: asyncio.sleep(0, [0.0, 1.0]))
+    service._get_vector_index = lambda database_id, collection: None
+    hits = lambda name: {"ids": [[name]], "documents": [[name]], "metadatas": [[{}]], "distances": [[0.5]]}
+    service.chroma_client = SimpleNamespace(get_collection=lambda name: SimpleNamespace(query=lambda **kwargs: hits(name)))
+
+    response = asyncio.run(service.query_federated("query", database_ids=["a", "b", "c"], n_results=3))
+
+    stats = service.collections.stats()
+    assert sorted(result["database_id"] for result in response["results"]) == ["a", "b", "c"]
+    assert stats["resident_bytes"] <= 100
+    assert len(unloaded) == 2
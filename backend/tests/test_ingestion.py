@@ -0,0 +1,78 @@
+import sys
+import uuid
+from types import SimpleNamespace
+import chromadb
+import pytest
+from app.services import embedding_backends
+from app.services.embedding_service import EmbeddingService
+from app.services.file_service import FileService
+from app.services.ingestion_service import IngestionPipeline, chunk_id
+from .test_embedding_backends import FakeSentenceTransformer
+
+
+class ParagraphEmbeddingService:
+    """Chunks on blank lines and embeds by character statistics, so tests need no model or NLTK data"""
+
+    def iter_chunks(self, segments, chunk_size=512):
+        for segment in segments:
+            for paragraph in segment.split("\n\n"):
+                if paragraph.strip():
+                    yield paragraph.strip()
+
+    def get_embeddings(self, texts, model=None, dimensions=None):
+        return [[float(len(text)), float(sum(map(ord, text)) % 97), 1.0] for text in texts]
+
+
+def new_collection():
+    return chromadb.EphemeralClient().create_collection(f"test-{uuid.uuid4()}")
+
+
+def test_repeated_chunks_in_one_batch_are_written_once(workdir):
+    path = workdir / "report.txt"
+    path.write_text("\n\n".join([
+        "Confidential - do not distribute",
+        "First finding",
+        "Confidential - do not distribute",
+        "Second finding",
+    ]))
+    collection = new_collection()
+    pipeline = IngestionPipeline(FileService(), ParagraphEmbeddingService())
+
+    pipeline.run(collection, [("report.txt", path)], "db", "local/hashing")
+
+    assert collection.count() == 3
+    assert chunk_id("report.txt", "Confidential - do not distribute") in collection.get(include=[])["ids"]
+
+
+def test_reingesting_a_file_embeds_nothing_new(workdir):
+    path = workdir / "notes.txt"
+    path.write_text("Alpha\n\nBeta\n\nAlpha")
+    collection = new_collection()
+    embedder = ParagraphEmbeddingService()
+    pipeline = IngestionPipeline(FileService(), embedder)
+    pipeline.run(collection, [("notes.txt", path)], "db", "local/hashing")
+
+    calls = []
+    embedder.get_embeddings = lambda texts, model=None, dimensions=None: calls.append(texts) or []
+    pipeline.run(collection, [("notes.txt", path)], "db", "local/hashing")
+
+    assert calls == []
+    assert collection.count() == 2
+
+
+@pytest.mark.parametrize("model", ["local/hashing", "local/all-MiniLM-L6-v2"])
+def test_local_models_ingest_and_retrieve_offline(workdir, sentence_tokenizer, monkeypatch, model):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", SimpleNamespace(SentenceTransformer=FakeSentenceTransformer))
+    monkeypatch.setattr(embedding_backends, "_backends", {})
+    path = workdir / "handbook.txt"
+    path.write_text("Expense reports are due monthly. Travel needs approval.\n\nLaptops are replaced every three years.")
+    collection = new_collection()
+    embedder = EmbeddingService()
+    pipeline = IngestionPipeline(FileService(), embedder)
+
+    written = pipeline.run(collection, [("handbook.txt", path)], "db", model, chunk_size=8)
+
+    assert written == collection.count() == 2
+    query = embedder.get_embeddings(["when are laptops replaced"], model)
+    hit = collection.query(query_embeddings=query, n_results=1)["documents"][0][0]
+    assert hit == "Laptops are replaced every three years."
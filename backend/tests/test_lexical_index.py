@@ -0,0 +1,58 @@
+from app.services.lexical_index import LexicalIndex, write_lexical_index
+
+DOCUMENTS = [
+    ("a1", "Error E1234 raised by the billing service"),
+    ("a2", "Billing retries failed payments nightly"),
+    ("b1", "The search service ranks passages with BM25"),
+    ("b2", "Passages mentioning E1234 should rank first for E1234"),
+    ("c1", "Nightly jobs rebuild the search index"),
+]
+QUERIES = ["E1234", "billing service", "nightly search index", "passages rank"]
+
+
+def build(path, documents, **kwargs):
+    stats = write_lexical_index(path, documents, **kwargs)
+    return stats, LexicalIndex.load(path)
+
+
+def results(index):
+    return {query: dict(index.search(query, 10)) for query in QUERIES}
+
+
+def test_spilled_blocks_merge_into_the_same_index(workdir):
+    stats, whole = build(workdir / "whole.idx", DOCUMENTS)
+    spilled_stats, spilled = build(workdir / "spilled.idx", DOCUMENTS, block_postings=3)
+
+    assert spilled_stats == stats == whole.stats()
+    assert spilled.ids == whole.ids
+    assert spilled.terms == whole.terms
+    assert spilled.postings == whole.postings
+    assert results(whole)["E1234"]["b2"] > results(whole)["E1234"]["a1"] > 0
+    assert not list(workdir.glob(".lexical-*"))
+
+
+def test_update_replaces_only_the_given_documents(workdir):
+    _, base = build(workdir / "base.idx", DOCUMENTS)
+    replacement = [("a3", "Billing now retries failed payments hourly")]
+
+    stats, updated = build(
+        workdir / "updated.idx", replacement, base=base, removed={"a1", "a2"}, block_postings=2
+    )
+    _, rebuilt = build(workdir / "rebuilt.idx", DOCUMENTS[2:] + replacement)
+
+    assert stats["documents"] == 4
+    assert updated.ids == ["b1", "b2", "c1", "a3"]
+    assert results(updated) == results(rebuilt)
+    assert "a1" not in results(updated)["E1234"]
+
+
+def test_filtered_search_ranks_only_allowed_documents(workdir):
+    _, index = build(workdir / "lexical.idx", DOCUMENTS)
+    unfiltered = dict(index.search("billing service", 10))
+
+    # With k=1 an unfiltered pool would hold only a1, which the filter excludes
+    filtered = index.search("billing service", 1, allowed=index.mask(["a2", "b1"]))
+
+    best = max(["a2", "b1"], key=unfiltered.get)
+    assert filtered == [(best, unfiltered[best])]
+    assert index.search("billing service", 10, allowed=index.mask([])) == []
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from app.services.exact_index import ExactIndex, load_exact_index, INDEX_FILENAME as EXACT_INDEX_FILENAME
+from app.services.quantized_index import QuantizedIndex, load_quantized_index, INDEX_FILENAME
+
+
+def clustered_vectors(count, dims=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(20, dims))
+    return (centers[rng.integers(0, 20, count)] + 0.3 * rng.normal(size=(count, dims))).astype(np.float32)
+
+
+def quantized_index(directory, vectors):
+    ids = [f"chunk-{i}" for i in range(len(vectors))]
+    ExactIndex.write(directory / EXACT_INDEX_FILENAME, [(ids, vectors.tolist())], dtype="float32")
+    full = load_exact_index(directory / EXACT_INDEX_FILENAME, "l2")
+    codebooks = QuantizedIndex.train(full.vectors, subspace_dims=8)
+    codes, _ = QuantizedIndex.update_codes(codebooks, [], np.zeros((len(codebooks), 0), np.uint8), ids, full.vectors, 256)
+    QuantizedIndex.write(directory / INDEX_FILENAME, ids, codebooks, codes)
+    return load_quantized_index(directory, "l2")
+
+
+def test_recall_is_estimated_on_a_bounded_sample(workdir, monkeypatch):
+    index = quantized_index(workdir, clustered_vectors(3000))
+    searched = []
+    search = index.search
+    monkeypatch.setattr(index, "search", lambda queries, k, allowed=None: searched.append(allowed) or search(queries, k, allowed=allowed))
+    monkeypatch.setattr(index.full, "search", lambda *args, **kwargs: pytest.fail("recall ran a full exact search"))
+
+    recall = index.recall(k=10, queries=50, sample=500)
+
+    assert 0.5 <= recall <= 1.0
+    assert searched[0].sum() == 500
+
+
+def test_update_codes_encodes_only_new_vectors(workdir):
+    vectors = clustered_vectors(600)
+    index = quantized_index(workdir, vectors[:400])
+    ids = [f"chunk-{i}" for i in range(600)]
+    # Stored ids in a new order, with new ones in between
+    order = np.random.default_rng(1).permutation(600)
+
+    codes, encoded = QuantizedIndex.update_codes(
+        index.codebooks, index.ids, index.codes, [ids[i] for i in order], vectors[order], batch_size=64
+    )
+
+    assert encoded == 200
+    assert np.array_equal(codes, QuantizedIndex.encode(index.codebooks, vectors[order]))
+
+
+def test_train_rejects_an_empty_collection():
+    with pytest.raises(ValueError):
+        QuantizedIndex.train(np.zeros((0, 0), np.float32))
+
+
+def test_coarse_partition_scans_only_probed_lists(workdir, monkeypatch):
+    vectors = clustered_vectors(4000)
+    index = quantized_index(workdir, vectors)
+    coarse = QuantizedIndex.train_coarse(index.full.vectors, 40)
+    lists = QuantizedIndex.update_lists(coarse, [], np.zeros(0, np.int64), index.ids, index.full.vectors, 512)
+    QuantizedIndex.write(workdir / INDEX_FILENAME, index.ids, index.codebooks, index.codes, coarse, lists)
+    partitioned = QuantizedIndex.load(workdir / INDEX_FILENAME, index.full)
+    monkeypatch.setattr("app.services.quantized_index.settings.PQ_IVF_PROBE", 4)
+    scanned = []
+    approximate = partitioned._approximate_distances
+    monkeypatch.setattr(partitioned, "_approximate_distances", lambda query, positions=None: scanned.append(len(positions)) or approximate(query, positions))
+
+    queries = vectors[:20] + 0.05
+    hits = partitioned.search(queries, 10)
+    exact = index.full.search(queries.tolist(), 10)
+
+    assert partitioned.stats()["coarse_lists"] == 40
+    assert max(scanned) < len(vectors)
+    assert np.mean([len(set(a) & set(e)) / 10 for (a, _), (e, _) in zip(hits, exact)]) >= 0.8
+    # A filter leaving few candidates widens the probe until it finds them
+    allowed = np.zeros(len(vectors), dtype=bool)
+    allowed[::400] = True
+    filtered = partitioned.search(queries[:1], 10, allowed=allowed)
+    assert sorted(filtered[0][0]) == sorted(index.ids[i] for i in range(0, 4000, 400))
@@ -0,0 +1,62 @@
+import sys
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from app.services.reranker import CrossEncoderReranker
+
+
+class FakeCrossEncoder:
+    """Scores a pair by passage length; each pair costs delay seconds, and gate can hold a forward pass"""
+
+    delay = 0.0
+    gate = None
+
+    def __init__(self, source, device=None):
+        self.source = source
+
+    def predict(self, pairs, batch_size=None, convert_to_numpy=True):
+        if self.gate is not None:
+            self.gate.wait()
+        time.sleep(self.delay * len(pairs))
+        return [float(len(passage)) for _, passage in pairs]
+
+
+@pytest.fixture
+def reranker(monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", SimpleNamespace(CrossEncoder=FakeCrossEncoder))
+    return CrossEncoderReranker("fake", latency_budget_ms=50.0, concurrency=2, reprobe_seconds=0.2)
+
+
+def test_requests_over_budget_are_reprobed(reranker):
+    reranker.model.delay = 0.02  # 20 ms per pair, so 4 pairs exceed the 50 ms budget
+    pairs = [["q", "passage"]] * 4
+    assert reranker.score(pairs) is not None
+    assert reranker.score(pairs) is None
+    assert reranker.stats()["skipped_budget"] == 1
+
+    # The load is gone, but only a probe can find that out
+    reranker.model.delay = 0.0
+    time.sleep(0.25)
+    assert reranker.score(pairs) is not None
+    assert reranker.stats()["reprobes"] == 1
+    assert reranker.score(pairs) is not None
+    assert reranker.stats()["reranked"] == 3
+
+
+def test_reranks_run_concurrently_up_to_the_limit(reranker):
+    reranker.model.gate = threading.Event()
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(reranker.score([["q", "p"]]))) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    while reranker._slots._value > 0:
+        time.sleep(0.01)
+
+    # A third rerank finds both slots taken and is skipped instead of queued
+    assert reranker.score([["q", "p"]]) is None
+    reranker.model.gate.set()
+    for worker in workers:
+        worker.join()
+    assert results == [[1.0], [1.0]]
+    assert reranker.stats()["skipped_busy"] == 1
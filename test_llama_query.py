@@ -3,14 +3,15 @@ import json
 import argparse
 import sys
 
-def query_vector_db(query: str, api_key: str) -> dict:
+def query_vector_db(query: str, api_key: str, n_results: int = 5, rerank: bool = False) -> dict:
     """Query the vector database using the external API"""
     url = "http://localhost:8000/api/v1/database/external/query"
     
     data = {
         "query": query,
         "api_key": api_key,
-        "n_results": 5
+        "n_results": n_results,
+        "rerank": str(rerank).lower()
     }
     
     try:
@@ -50,7 +51,7 @@ def format_prompt(query: str, context: list) -> str:
     for idx, result in enumerate(context, 1):
         source = result.get('source', 'unknown')
         text = result.get('text', '').strip()
-        score = result.get('score', 0)
+        score = result.get('rerank_score', result.get('score', 0))
         prompt += f"{idx}. [{source}] (relevance: {score:.2f}): {text}\n"
     
     prompt += f"\nQuestion: {query}\n\nAssistant: Let me help you with that question based on the provided context.\n"
@@ -60,13 +61,15 @@ def main():
     parser = argparse.ArgumentParser(description='Query vector database and Llama')
     parser.add_argument('--api-key', required=True, help='API key for the vector database')
     parser.add_argument('--query', required=True, help='Query to search for')
+    parser.add_argument('--n-results', type=int, default=5, help='Number of passages to use as context')
+    parser.add_argument('--rerank', action='store_true', help='Rerank passages with the cross-encoder (fewer passages are needed)')
     parser.add_argument('--debug', action='store_true', help='Print debug information')
     args = parser.parse_args()
     
     # Step 1: Query vector database for context
     print("\n1. Querying vector database for context...")
     try:
-        db_response = query_vector_db(args.query, args.api_key)
+        db_response = query_vector_db(args.query, args.api_key, args.n_results, args.rerank)
         
         if args.debug:
             print("\nRaw DB Response:")